@@ -3,10 +3,12 @@ import sys
 import os
 import argparse
 
-from .metabase import MetabaseClient
+from .metabase import ExposureWriter, MetabaseClient
 from .parsers.dbt_folder import DbtFolderReader
 from .parsers.dbt_manifest import DbtManifestReader
 from .models.config import MetabaseConfig, DbtConfig
+from .models.metabase import MetabaseModel
+from .state import ExportJournal, ExportState, ExposureState, MetadataCache
 from .utils import get_version
 
 from typing import Iterable, List, Union, Optional
@@ -14,11 +16,59 @@ from typing import Iterable, List, Union, Optional
 __version__ = get_version()
 
 
+def _build_client(metabase_config: MetabaseConfig) -> MetabaseClient:
+    """Instantiates Metabase client from config.
+
+    Args:
+        metabase_config (MetabaseConfig): Metabase connection config.
+
+    Returns:
+        MetabaseClient: Authenticated client, close it when done.
+    """
+
+    mbc = MetabaseClient(
+        host=metabase_config.host,
+        user=metabase_config.user,
+        password=metabase_config.password,
+        use_http=metabase_config.use_http,
+        verify=metabase_config.verify,
+        http_pool_size=metabase_config.http_pool_size,
+        http_keep_alive=metabase_config.http_keep_alive,
+        http_connect_timeout=metabase_config.http_connect_timeout,
+        http_read_timeout=metabase_config.http_read_timeout,
+        http_retries=metabase_config.http_retries,
+        run_timeout=metabase_config.run_timeout,
+        concurrency=metabase_config.concurrency,
+        metadata_cache=(
+            MetadataCache(
+                metabase_config.metadata_cache_path,
+                ttl=metabase_config.metadata_cache_ttl,
+                max_bytes=(
+                    int(metabase_config.metadata_cache_max_mb * 1024 * 1024)
+                    if metabase_config.metadata_cache_max_mb is not None
+                    else None
+                ),
+            )
+            if metabase_config.metadata_cache_path
+            else None
+        ),
+    )
+    if metabase_config.database_id is not None:
+        mbc.database_ids[metabase_config.database.upper()] = metabase_config.database_id
+    return mbc
+
+
 def models(
     metabase_config: MetabaseConfig,
     dbt_config: DbtConfig,
     dbt_include_tags: bool = True,
     dbt_docs_url: Optional[str] = None,
+    plan_path: Optional[str] = None,
+    apply_path: Optional[str] = None,
+    state_path: Optional[str] = None,
+    state_reconcile_days: Optional[float] = None,
+    journal_path: Optional[str] = None,
+    resume: bool = False,
 ):
     """Exports models from dbt to Metabase.
 
@@ -29,8 +79,31 @@ def models(
         dbt_docs_url (str, optional): URL to your dbt docs hosted catalog, a link will be appended to the model description (only works for manifest parsing). Defaults to None.
         dbt_includes (Iterable, optional): Model names to limit processing to. Defaults to None.
         dbt_excludes (Iterable, optional): Model names to exclude. Defaults to None.
+        plan_path (str, optional): Write the changes to this JSON plan instead of Metabase. Defaults to None.
+        apply_path (str, optional): Apply a JSON plan written with plan_path instead of reading dbt models. Defaults to None.
+        state_path (str, optional): Skip models unchanged since the last export recorded in this JSON state file. Defaults to None.
+        state_reconcile_days (float, optional): Export all models when the last full export recorded in state is older than this. Defaults to None.
+        journal_path (str, optional): Record writes to Metabase in this journal until the run succeeds. Defaults to None.
+        resume (bool, optional): Skip writes recorded in journal_path by an interrupted run of the same export. Defaults to False.
     """
 
+    journal: Optional[ExportJournal] = None
+    if journal_path:
+        journal = ExportJournal(journal_path, resume=resume)
+    elif resume:
+        logging.warning("Argument --resume is unused without --journal_path")
+
+    success = False
+
+    if apply_path:
+        try:
+            with _build_client(metabase_config) as mbc:
+                success = mbc.apply_plan(apply_path, journal=journal)
+        finally:
+            if journal:
+                journal.close(success)
+        return
+
     # Assertions
     if dbt_config.path and dbt_config.manifest_path:
         logging.warning("Prioritizing manifest path arg")
@@ -50,20 +123,24 @@ def models(
                 "Argument --dbt_docs_url %s is unused in dbt_project yml parser. Use manifest parser instead.",
                 dbt_docs_url,
             )
+        if dbt_config.state_manifest_path:
+            logging.info(
+                "Argument --dbt_state_manifest %s is unused in dbt_project yml parser. Use manifest parser instead.",
+                dbt_config.state_manifest_path,
+            )
 
-    # Instantiate Metabase client
-    mbc = MetabaseClient(
-        host=metabase_config.host,
-        user=metabase_config.user,
-        password=metabase_config.password,
-        use_http=metabase_config.use_http,
-        verify=metabase_config.verify,
-    )
     reader: Union[DbtFolderReader, DbtManifestReader]
 
     # Resolve dbt reader being either YAML or manifest.json based
     if dbt_config.manifest_path:
-        reader = DbtManifestReader(os.path.expandvars(dbt_config.manifest_path))
+        reader = DbtManifestReader(
+            os.path.expandvars(dbt_config.manifest_path),
+            state_manifest_path=(
+                os.path.expandvars(dbt_config.state_manifest_path)
+                if dbt_config.state_manifest_path
+                else None
+            ),
+        )
     elif dbt_config.path:
         reader = DbtFolderReader(os.path.expandvars(dbt_config.path))
 
@@ -83,22 +160,61 @@ def models(
         docs_url=dbt_docs_url,
     )
 
-    # Sync and attempt schema alignment prior to execution; if timeout is not explicitly set, proceed regardless of success
-    if not metabase_config.sync_skip:
-        if metabase_config.sync_timeout is not None and not mbc.sync_and_wait(
-            metabase_config.database,
-            dbt_models,
-            metabase_config.sync_timeout,
-        ):
-            logging.critical("Sync timeout reached, models still not compatible")
+    # FK targets are resolved across all models, including ones skipped below
+    # or left out by the state manifest
+    all_models = (
+        reader.all_models if isinstance(reader, DbtManifestReader) else dbt_models
+    )
+
+    state: Optional[ExportState] = None
+    if state_path:
+        state = ExportState(
+            state_path,
+            host=metabase_config.host,
+            database=metabase_config.database,
+            reconcile_days=state_reconcile_days,
+        )
+        dbt_models = state.changed(dbt_models)
+        if not dbt_models:
+            logging.info("No models changed since last export")
             return
 
-    # Process Metabase stuff
-    mbc.export_models(
-        database=metabase_config.database,
-        models=dbt_models,
-        aliases=reader.catch_aliases,
-    )
+    # Instantiate Metabase client
+    with _build_client(metabase_config) as mbc:
+
+        # Sync and attempt schema alignment prior to execution; if timeout is not explicitly set, proceed regardless of success
+        # Planning must not change anything in Metabase, so it works off the current data model
+        if not metabase_config.sync_skip and not plan_path:
+            if metabase_config.sync_timeout is not None and not mbc.sync_and_wait(
+                metabase_config.database,
+                dbt_models,
+                metabase_config.sync_timeout,
+                tables_only=metabase_config.sync_tables_only,
+            ):
+                logging.critical("Sync timeout reached, models still not compatible")
+                return
+
+        # Process Metabase stuff
+        exported: List[MetabaseModel] = []
+        try:
+            success = mbc.export_models(
+                database=metabase_config.database,
+                models=dbt_models,
+                aliases=reader.catch_aliases,
+                plan_path=plan_path,
+                journal=journal,
+                all_models=all_models,
+                exported=exported,
+            )
+        finally:
+            if journal:
+                journal.close(success)
+
+    # Planned changes are not in Metabase yet, so they are not recorded, neither are
+    # models missing in Metabase, which are exported again once their tables appear.
+    # Exported models are left out when any write failed.
+    if state and (success or exported) and not plan_path:
+        state.save(exported)
 
 
 def exposures(
@@ -108,6 +224,10 @@ def exposures(
     output_name: str,
     include_personal_collections: bool = False,
     collection_excludes: Optional[Iterable] = None,
+    bulk_cards: bool = False,
+    state_path: Optional[str] = None,
+    sql_processes: int = 1,
+    match_models: bool = False,
 ):
     """Extracts and imports exposures from Metabase to dbt.
 
@@ -118,6 +238,10 @@ def exposures(
         output_name (str): URL to your dbt docs hosted catalog, a link will be appended to the model description (only works for manifest parsing). Defaults to None.
         include_personal_collections (bool, optional): Model names to limit processing to. Defaults to None.
         collection_excludes (Iterable, optional): Model names to exclude. Defaults to None.
+        bulk_cards (bool, optional): List all questions in one request instead of fetching them one by one. Defaults to False.
+        state_path (str, optional): Reuse exposures unchanged since the last run recorded in this JSON state file. Defaults to None.
+        sql_processes (int, optional): Parse long native queries in this many processes. Defaults to 1.
+        match_models (bool, optional): Find models anywhere in native queries, not only after FROM and JOIN. Defaults to False.
     """
 
     # Assertions
@@ -129,14 +253,6 @@ def exposures(
             "Must supply a schema if using YAML parser, it is used to resolve foreign key relations and which Metabase models to propagate documentation to"
         )
 
-    # Instantiate Metabase client
-    mbc = MetabaseClient(
-        host=metabase_config.host,
-        user=metabase_config.user,
-        password=metabase_config.password,
-        use_http=metabase_config.use_http,
-        verify=metabase_config.verify,
-    )
     reader: Union[DbtFolderReader, DbtManifestReader]
 
     # Resolve dbt reader being either YAML or manifest.json based
@@ -159,24 +275,36 @@ def exposures(
         excludes=dbt_config.excludes,
     )
 
-    # Sync and attempt schema alignment prior to execution; if timeout is not explicitly set, proceed regardless of success
-    if not metabase_config.sync_skip:
-        if metabase_config.sync_timeout is not None and not mbc.sync_and_wait(
-            metabase_config.database,
-            dbt_models,
-            metabase_config.sync_timeout,
-        ):
-            logging.critical("Sync timeout reached, models still not compatible")
-            return
-
-    # Process Metabase stuff
-    mbc.extract_exposures(
-        models=dbt_models,
-        output_path=output_path,
-        output_name=output_name,
-        include_personal_collections=include_personal_collections,
-        collection_excludes=collection_excludes,
-    )
+    # Instantiate Metabase client
+    with _build_client(metabase_config) as mbc:
+
+        # Sync and attempt schema alignment prior to execution; if timeout is not explicitly set, proceed regardless of success
+        if not metabase_config.sync_skip:
+            if metabase_config.sync_timeout is not None and not mbc.sync_and_wait(
+                metabase_config.database,
+                dbt_models,
+                metabase_config.sync_timeout,
+                tables_only=metabase_config.sync_tables_only,
+            ):
+                logging.critical("Sync timeout reached, models still not compatible")
+                return
+
+        # Process Metabase stuff, exposures are written as they are resolved and not kept
+        with ExposureWriter(output_path, output_name) as writer:
+            for exposure in mbc.iter_exposures(
+                models=dbt_models,
+                include_personal_collections=include_personal_collections,
+                collection_excludes=collection_excludes,
+                bulk_cards=bulk_cards,
+                state=(
+                    ExposureState(state_path, metabase_config.host)
+                    if state_path
+                    else None
+                ),
+                sql_processes=sql_processes,
+                match_models=match_models,
+            ):
+                writer.write(exposure)
 
 
 def main(args: List = None):
@@ -208,8 +336,7 @@ def main(args: List = None):
     parser_dbt.add_argument(
         "--dbt_database",
         metavar="DB",
-        required=True,
-        help="Target database name as specified in dbt",
+        help="Target database name as specified in dbt. Required unless --apply is set",
     )
     group = parser_dbt.add_mutually_exclusive_group()
     group.add_argument(
@@ -220,6 +347,11 @@ def main(args: List = None):
         "--dbt_manifest_path",
         help="Path to dbt manifest.json (typically located in the /target/ directory of the dbt project directory). Cannot be specified with --dbt_path",
     )
+    parser_dbt.add_argument(
+        "--dbt_state_manifest",
+        metavar="PATH",
+        help="Path to a previous dbt manifest.json, `models` only exports models changed since. Requires --dbt_manifest_path",
+    )
     parser_dbt.add_argument(
         "--dbt_schema",
         help="Target schema. Should be passed if using folder parser",
@@ -249,8 +381,13 @@ def main(args: List = None):
     parser_metabase.add_argument(
         "--metabase_database",
         metavar="DB",
-        required=True,
-        help="Target database name as set in Metabase (typically aliased)",
+        help="Target database name as set in Metabase (typically aliased). Required unless --metabase_database_id is set",
+    )
+    parser_metabase.add_argument(
+        "--metabase_database_id",
+        metavar="ID",
+        type=int,
+        help="Target database ID in Metabase, skips looking it up by name",
     )
     parser_metabase.add_argument(
         "--metabase_host", metavar="HOST", required=True, help="Metabase hostname"
@@ -271,11 +408,81 @@ def main(args: List = None):
         metavar="CERT",
         help="Path to certificate bundle used by Metabase client",
     )
+    parser_metabase.add_argument(
+        "--metabase_http_pool_size",
+        metavar="N",
+        type=int,
+        default=10,
+        help="Maximum number of pooled HTTP connections to Metabase (default 10)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_http_no_keep_alive",
+        action="store_true",
+        help="Open a new HTTP connection for every Metabase request instead of reusing them",
+    )
+    parser_metabase.add_argument(
+        "--metabase_http_connect_timeout",
+        metavar="SECS",
+        type=float,
+        default=10,
+        help="Seconds to wait for a connection to Metabase (default 10)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_http_read_timeout",
+        metavar="SECS",
+        type=float,
+        default=120,
+        help="Seconds to wait for a Metabase response (default 120)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_http_retries",
+        metavar="N",
+        type=int,
+        default=3,
+        help="Retries with backoff of idempotent Metabase requests failing with a connection error, 429 or 5xx (default 3)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_run_timeout",
+        metavar="SECS",
+        type=float,
+        help="Abandon all Metabase requests after this many seconds (default no deadline)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_concurrency",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of models exported to, or collections and exposures read from Metabase in parallel; export failures are reported at the end of the run (default 1)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_metadata_cache",
+        metavar="PATH",
+        help="SQLite file keeping database metadata between runs, downloaded again when Metabase reports changes (default no cache)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_metadata_cache_ttl",
+        metavar="SECS",
+        type=float,
+        default=3600,
+        help="Seconds after which cached database metadata is downloaded again, bounding how long field edits made in Metabase go unnoticed (default 3600)",
+    )
+    parser_metabase.add_argument(
+        "--metabase_metadata_cache_max_mb",
+        metavar="MB",
+        type=float,
+        default=512,
+        help="Compressed size of the metadata cache above which least recently used databases are evicted (default 512)",
+    )
     parser_metabase.add_argument(
         "--metabase_sync_skip",
         action="store_true",
         help="Skip synchronizing Metabase database before export",
     )
+    parser_metabase.add_argument(
+        "--metabase_sync_tables_only",
+        action="store_true",
+        help="Synchronize only tables backing the dbt models instead of the whole database, unless some are new to Metabase",
+    )
     parser_metabase.add_argument(
         "--metabase_sync_timeout",
         metavar="SECS",
@@ -295,6 +502,36 @@ def main(args: List = None):
         default=False,
         help="Append tags to Table descriptions in Metabase (default False)",
     )
+    group = parser_models.add_mutually_exclusive_group()
+    group.add_argument(
+        "--plan",
+        metavar="PATH",
+        help="Write the changes to Metabase to a JSON plan instead of applying them",
+    )
+    group.add_argument(
+        "--apply",
+        metavar="PATH",
+        help="Apply a JSON plan written with --plan, without reading dbt models again",
+    )
+
+    parser_models.add_argument(
+        "--state_reconcile_days",
+        metavar="DAYS",
+        type=float,
+        help="Export all models when the last full export recorded in --state_path is older than this (default never)",
+    )
+
+    parser_models.add_argument(
+        "--journal_path",
+        metavar="PATH",
+        help="Record every write to Metabase in this file, which is removed once the run succeeds",
+    )
+    parser_models.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Skip writes recorded in --journal_path by an interrupted run of the same export (default False)",
+    )
 
     # Exposures specific args
     parser_exposures.add_argument(
@@ -319,8 +556,32 @@ def main(args: List = None):
         default=[],
         help="Exclude a list of collections from exposure parsing (default [])",
     )
+    parser_exposures.add_argument(
+        "--bulk_cards",
+        action="store_true",
+        default=False,
+        help="List all questions in one request instead of fetching them one by one (default False)",
+    )
+    parser_exposures.add_argument(
+        "--sql_processes",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Parse long native queries in this many processes, best with --bulk_cards or --metabase_concurrency above 1 (default 1)",
+    )
+    parser_exposures.add_argument(
+        "--sql_match_models",
+        action="store_true",
+        default=False,
+        help="Find models anywhere in native queries, e.g. in functions taking table names, not only after FROM and JOIN (default False)",
+    )
 
     # Common/misc arguments
+    parser.add_argument(
+        "--state_path",
+        metavar="PATH",
+        help="JSON file recording exported models or resolved exposures; `models` skips models unchanged since the last export, `exposures` does not fetch cards and dashboards not edited since the last run",
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -330,6 +591,19 @@ def main(args: List = None):
 
     parsed = parser.parse_args(args=args)
 
+    # Plans are applied without reading dbt models, so dbt arguments are only needed otherwise
+    if parsed.dbt_database is None and not (
+        parsed.command == "models" and parsed.apply
+    ):
+        parser.error("the following arguments are required: --dbt_database")
+
+    if parsed.metabase_database is None:
+        if parsed.metabase_database_id is None:
+            parser.error(
+                "one of the arguments --metabase_database --metabase_database_id is required"
+            )
+        parsed.metabase_database = str(parsed.metabase_database_id)
+
     if parsed.verbose:
         logger = logging.getLogger()
         logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -342,13 +616,26 @@ def main(args: List = None):
         password=parsed.metabase_password,
         use_http=parsed.metabase_use_http,
         verify=parsed.metabase_verify,
+        http_pool_size=parsed.metabase_http_pool_size,
+        http_keep_alive=not parsed.metabase_http_no_keep_alive,
+        http_connect_timeout=parsed.metabase_http_connect_timeout,
+        http_read_timeout=parsed.metabase_http_read_timeout,
+        http_retries=parsed.metabase_http_retries,
+        run_timeout=parsed.metabase_run_timeout,
+        concurrency=parsed.metabase_concurrency,
+        metadata_cache_path=parsed.metabase_metadata_cache,
+        metadata_cache_ttl=parsed.metabase_metadata_cache_ttl,
+        metadata_cache_max_mb=parsed.metabase_metadata_cache_max_mb,
         database=parsed.metabase_database,
+        database_id=parsed.metabase_database_id,
         sync_skip=parsed.metabase_sync_skip,
         sync_timeout=parsed.metabase_sync_timeout,
+        sync_tables_only=parsed.metabase_sync_tables_only,
     )
     dbt_config = DbtConfig(
         path=parsed.dbt_path,
         manifest_path=parsed.dbt_manifest_path,
+        state_manifest_path=parsed.dbt_state_manifest,
         database=parsed.dbt_database,
         schema=parsed.dbt_schema,
         schema_excludes=parsed.dbt_schema_excludes,
@@ -362,6 +649,12 @@ def main(args: List = None):
             dbt_config,
             dbt_docs_url=parsed.dbt_docs_url,
             dbt_include_tags=parsed.dbt_include_tags,
+            plan_path=parsed.plan,
+            apply_path=parsed.apply,
+            state_path=parsed.state_path,
+            state_reconcile_days=parsed.state_reconcile_days,
+            journal_path=parsed.journal_path,
+            resume=parsed.resume,
         )
     elif parsed.command == "exposures":
         exposures(
@@ -371,6 +664,10 @@ def main(args: List = None):
             output_name=parsed.output_name,
             include_personal_collections=parsed.include_personal_collections,
             collection_excludes=parsed.collection_excludes,
+            bulk_cards=parsed.bulk_cards,
+            state_path=parsed.state_path,
+            sql_processes=parsed.sql_processes,
+            match_models=parsed.sql_match_models,
         )
     else:
         logging.error("Invalid command. Must be one of either 'models' or 'exposures'.")
@@ -1,6 +1,20 @@
+import hashlib
 import json
 import logging
+import random
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from email.utils import parsedate_to_datetime
 from typing import (
+    Any,
     Sequence,
     Optional,
     Tuple,
@@ -9,136 +23,448 @@ from typing import (
     Union,
     List,
     Mapping,
+    Set,
+    Iterator,
+    cast,
 )
 
 import requests
+from requests.adapters import HTTPAdapter
 import time
+from datetime import datetime, timezone
 
+from .state import ExportJournal, ExposureState, MetadataCache
 from .models.metabase import MetabaseModel, MetabaseColumn
+from .parsers.sql import ModelMatcher, extract_tables, parse_in_pool
 
-import re
 import yaml
 import os
 
 
-class MetabaseClient:
-    """Metabase API client."""
+class _WriteBuffer:
+    """Table and field updates gathered during an export.
+
+    Updates to the same object are merged so that each one is written at most once,
+    and only if the merged values differ from what Metabase held before the export.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: MutableMapping[Tuple[str, int], str] = {}
+        self._originals: MutableMapping[Tuple[str, int], dict] = {}
+        self._updates: MutableMapping[Tuple[str, int], dict] = {}
+
+    def add(self, kind: str, label: str, api_object: MutableMapping, update: Mapping):
+        """Records an update and applies it to the in-memory object.
+
+        Arguments:
+            kind {str} -- Metabase object type, either `table` or `field`.
+            label {str} -- Name of the object used for logging.
+            api_object {dict} -- Metabase object from the metadata snapshot.
+            update {dict} -- Attributes to update.
+        """
+
+        key = (kind, api_object["id"])
+        with self._lock:
+            if key not in self._originals:
+                self._originals[key] = dict(api_object)
+                self._labels[key] = label
+            self._updates.setdefault(key, {}).update(update)
+            api_object.update(update)
+
+    def pending(self) -> List[Tuple[str, int, str, dict]]:
+        """Lists merged updates that change Metabase.
+
+        Returns:
+            list -- Object type, ID, label and attributes to update, in recording order.
+        """
+
+        return [
+            (kind, object_id, self._labels[(kind, object_id)], update)
+            for (kind, object_id), update in self._updates.items()
+            if any(
+                self._originals[(kind, object_id)].get(attribute) != value
+                for attribute, value in update.items()
+            )
+        ]
+
+    def to_plan(self) -> List[dict]:
+        """Serializes pending updates with their previous values.
+
+        Returns:
+            list -- JSON-serializable updates, see from_plan().
+        """
+
+        return [
+            {
+                "type": kind,
+                "id": object_id,
+                "name": label,
+                "old": {
+                    attribute: self._originals[(kind, object_id)].get(attribute)
+                    for attribute in update
+                },
+                "new": update,
+            }
+            for kind, object_id, label, update in self.pending()
+        ]
+
+    @classmethod
+    def from_plan(cls, plan: Iterable[Mapping]) -> "_WriteBuffer":
+        """Restores updates serialized by to_plan().
+
+        Arguments:
+            plan {list} -- Serialized updates.
+
+        Returns:
+            _WriteBuffer -- Buffer ready to be flushed.
+        """
+
+        writes = cls()
+        for update in plan:
+            key = (update["type"], update["id"])
+            writes._labels[key] = update["name"]
+            writes._originals[key] = dict(update["old"])
+            writes._updates[key] = dict(update["new"])
+        return writes
+
+
+class _FkTargets:
+    """Metabase fields targeted by dbt foreign key columns."""
+
+    def __init__(self):
+        self.by_column: MutableMapping[Tuple[str, str], MutableMapping] = {}
+        self.labels: MutableMapping[int, str] = {}
+
+    def add(
+        self,
+        table_lookup_key: str,
+        column_name: str,
+        target: MutableMapping,
+        label: str,
+    ):
+        """Records the target of one foreign key column.
+
+        Arguments:
+            table_lookup_key {str} -- Metabase table name of the column.
+            column_name {str} -- Name of the foreign key column.
+            target {dict} -- Metabase field the column points to.
+            label {str} -- Name of the target used for logging.
+        """
+
+        self.by_column[(table_lookup_key, column_name)] = target
+        self.labels[target["id"]] = label
+
+
+class _ExposureNames:
+    """Exposure names already taken, made valid and unique for dbt."""
+
+    def __init__(self):
+        self.taken: Set[str] = set()
+        self.suffixes: Counter = Counter()
+
+    def unique(self, name: str) -> str:
+        """Makes exposure name valid and unique for dbt.
+
+        Arguments:
+            name {str} -- Name of the card or dashboard in Metabase.
+
+        Returns:
+            str -- Exposure name.
+        """
+
+        # No spaces allowed in model names in dbt docs DAG / No duplicate model names
+        name = name.replace(" ", "_")
+        unique_name = name
+        while unique_name in self.taken:
+            self.suffixes[name] += 1
+            unique_name = f"{name}_{self.suffixes[name]}"
+        self.taken.add(unique_name)
+        return unique_name
+
+
+class _DbtDumper(yaml.Dumper):
+    """Indents lists the way dbt documents YAML."""
+
+    def increase_indent(self, flow=False, indentless=False):
+        return super().increase_indent(flow, False)
+
+
+# Version of dbt resource files exposures are written to
+EXPOSURES_VERSION = 2
+
+
+class ExposureWriter:
+    """Streams exposures to dbt YAML as they are built.
+
+    Exposures go to a temporary file next to the output, which replaces the output
+    only once all were written, so a failed run leaves the previous file in place.
+    """
+
+    def __init__(self, output_path: str, output_name: str):
+        """Constructor.
+
+        Arguments:
+            output_path {str} -- The path to output the generated yaml.
+            output_name {str} -- The name of the generated yaml.
+        """
+
+        self.path = os.path.expanduser(os.path.join(output_path, f"{output_name}.yml"))
+        self.count = 0
+        fd, self._temp_path = tempfile.mkstemp(
+            suffix=".tmp",
+            prefix=f".{output_name}.yml.",
+            dir=os.path.dirname(self.path) or ".",
+        )
+        self._file = os.fdopen(fd, "w", encoding="utf-8")
+        self._file.write(f"version: {EXPOSURES_VERSION}\n")
+
+    def __enter__(self) -> "ExposureWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self._file.close()
+            os.remove(self._temp_path)
+            return
+
+        if not self.count:
+            self._file.write("exposures: []\n")
+        self._file.close()
+        # Temporary files are private, the output gets the permissions of any new file
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self._temp_path, 0o666 & ~umask)
+        os.replace(self._temp_path, self.path)
+
+    def write(self, exposure: Mapping):
+        """Appends one exposure to the YAML file.
+
+        Arguments:
+            exposure {dict} -- Exposure as built by _build_exposure.
+        """
+
+        # Dumped under the same key as the whole file, so long lines wrap at the same columns
+        document = yaml.dump(
+            {"exposures": [exposure]},
+            Dumper=_DbtDumper,
+            default_flow_style=False,
+            allow_unicode=True,
+            sort_keys=False,
+        )
+        if self.count:
+            document = document.split("\n", 1)[1]
+        self._file.write(document)
+        self.count += 1
+
+
+class _MetabaseClientBase:
+    """State and API-independent logic shared by Metabase clients."""
 
     _SYNC_PERIOD_SECS = 5
+    _SYNC_BACKOFF_SECS = 1.0
+    _SYNC_BACKOFF_MAX_SECS = 30.0
+    # Fields of a question exposures are built from, listed questions missing any are fetched
+    _CARD_FIELDS = ("id", "name", "created_at", "dataset_query")
+    # Users listed per request when indexing exposure creators
+    _USER_PAGE_SIZE = 1000
+    # Shorter native queries are parsed faster in place than in another process
+    _SQL_POOL_MIN_CHARS = 2000
+
+    # Only calls that can be repeated without side effects are retried, our PUTs
+    # always send the full target state of a table or field
+    _RETRY_METHODS = {"get", "head", "options", "put"}
+    _RETRY_STATUSES = {429, 500, 502, 503, 504}
+    _RETRY_BACKOFF_SECS = 1.0
+    _RETRY_BACKOFF_MAX_SECS = 60.0
 
     def __init__(
         self,
         host: str,
-        user: str,
-        password: str,
         use_http: bool = False,
         verify: Union[str, bool] = None,
+        http_connect_timeout: Optional[float] = 10,
+        http_read_timeout: Optional[float] = 120,
+        http_retries: int = 3,
+        run_timeout: Optional[float] = None,
+        metadata_cache: Optional[MetadataCache] = None,
     ):
         """Constructor.
 
         Arguments:
             host {str} -- Metabase hostname.
-            user {str} -- Metabase username.
-            password {str} -- Metabase password.
 
         Keyword Arguments:
             use_http {bool} -- Use HTTP instead of HTTPS. (default: {False})
             verify {Union[str, bool]} -- Path to certificate or disable verification. (default: {None})
+            http_connect_timeout {float} -- Seconds to wait for a connection, None waits forever. (default: {10})
+            http_read_timeout {float} -- Seconds to wait for a response, None waits forever. (default: {120})
+            http_retries {int} -- Retries of failed idempotent requests. (default: {3})
+            run_timeout {float} -- Seconds after which all requests are abandoned, None for no deadline. (default: {None})
+            metadata_cache {MetadataCache} -- Keeps database metadata on disk between runs. (default: {None})
         """
 
         self.host = host
         self.protocol = "http" if use_http else "https"
         self.verify = verify
-        self.session_id = self.get_session_id(user, password)
+        self.http_connect_timeout = http_connect_timeout
+        self.http_read_timeout = http_read_timeout
+        self.http_retries = max(http_retries, 0)
+        self.deadline = (
+            time.monotonic() + run_timeout if run_timeout is not None else None
+        )
+        self.retries: Counter = Counter()
+        self._retries_lock = threading.Lock()
+        self.metadata_cache = metadata_cache
+        # Database IDs indexed by upper-case name, seed it to skip the database listing
+        self.database_ids: MutableMapping[str, Any] = {}
         self.collections: Iterable = []
         self.tables: Iterable = []
         self.table_map: MutableMapping = {}
-        self.models_exposed: List = []
-        self.native_query: str = ""
-        self.exposure_parser = re.compile(r"[FfJj][RrOo][OoIi][MmNn]\s+\b(\w+)\b")
-        self.cte_parser = re.compile(
-            r"[Ww][Ii][Tt][Hh]\s+\b(\w+)\b\s+as|[)]\s*[,]\s*\b(\w+)\b\s+as"
-        )
-        logging.info("Session established successfully")
+        # Questions and users by kind and id, fetched once per exposure extraction
+        self._objects: MutableMapping[str, MutableMapping[int, Any]] = {
+            "card": {},
+            "user": {},
+        }
+        # Models and native query exposed by each question, resolved once per exposure extraction
+        self._card_lineage: MutableMapping[int, Tuple[List[str], str]] = {}
+        self._card_sources: MutableMapping[int, List[int]] = {}
+        self._card_tables: MutableMapping[int, List[int]] = {}
+        # Process pool parsing native queries during an exposure extraction, if any
+        self._sql_pool: Optional[Executor] = None
+        self._sql_processes = 1
+        # Tables of native queries parsed in the pool by cache key, during an exposure extraction
+        self._sql_parsed: MutableMapping[bytes, Tuple[str, ...]] = {}
+        # Finds models anywhere in native queries during an exposure extraction, if enabled
+        self._model_matcher: Optional[ModelMatcher] = None
+
+    def _remaining_secs(self) -> Optional[float]:
+        """Checks time left before the run deadline.
+
+        Raises:
+            TimeoutError: Run deadline has passed.
 
-    def get_session_id(self, user: str, password: str) -> str:
-        """Obtains new session ID from API.
+        Returns:
+            float -- Seconds left, None if there is no deadline.
+        """
 
-        Arguments:
-            user {str} -- Metabase username.
-            password {str} -- Metabase password.
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Metabase run deadline exceeded")
+        return remaining
+
+    def _request_timeouts(self) -> Tuple[Optional[float], Optional[float]]:
+        """Computes connect and read timeouts for the next request.
 
         Returns:
-            str -- Session ID.
+            float -- Connect timeout, capped by the run deadline.
+            float -- Read timeout, capped by the run deadline.
         """
 
-        return self.api(
-            "post",
-            "/api/session",
-            authenticated=False,
-            json={"username": user, "password": password},
-        )["id"]
+        remaining = self._remaining_secs()
+        if remaining is None:
+            return self.http_connect_timeout, self.http_read_timeout
+        return (
+            min(self.http_connect_timeout or remaining, remaining),
+            min(self.http_read_timeout or remaining, remaining),
+        )
 
-    def sync_and_wait(
+    def _retry_delay(
         self,
-        database: str,
-        models: Sequence,
-        timeout: Optional[int],
-    ) -> bool:
-        """Synchronize with the database and wait for schema compatibility.
+        method: str,
+        attempt: int,
+        status: Optional[int] = None,
+        retry_after: Optional[str] = None,
+    ) -> Optional[float]:
+        """Decides whether and when to retry a failed request.
 
         Arguments:
-            database {str} -- Metabase database name.
-            models {list} -- List of dbt models read from project.
+            method {str} -- HTTP verb of the request.
+            attempt {int} -- Number of retries already made.
 
         Keyword Arguments:
-            timeout {int} -- Timeout before giving up in seconds. (default: {30})
+            status {int} -- HTTP status of the response, None if no response was received. (default: {None})
+            retry_after {str} -- Retry-After header of the response. (default: {None})
 
         Returns:
-            bool -- True if schema compatible with models, false if still incompatible.
+            float -- Seconds to wait before retrying, None if request must not be retried.
         """
-        if timeout is None:
-            timeout = 30
 
-        if timeout < self._SYNC_PERIOD_SECS:
-            logging.critical(
-                "Timeout provided %d secs, must be at least %d",
-                timeout,
-                self._SYNC_PERIOD_SECS,
+        if status is not None and status not in self._RETRY_STATUSES:
+            return None
+        if method.lower() not in self._RETRY_METHODS or attempt >= self.http_retries:
+            return None
+
+        delay = self._parse_retry_after(retry_after)
+        if delay is None:
+            # Exponential backoff with full jitter
+            delay = random.uniform(
+                0,
+                min(
+                    self._RETRY_BACKOFF_MAX_SECS,
+                    self._RETRY_BACKOFF_SECS * 2**attempt,
+                ),
             )
-            return False
 
-        database_id = self.find_database_id(database)
-        if not database_id:
-            logging.critical("Cannot find database by name %s", database)
-            return False
+        remaining = self._remaining_secs()
+        if remaining is not None and delay >= remaining:
+            return None
 
-        self.api("post", f"/api/database/{database_id}/sync_schema")
+        with self._retries_lock:
+            self.retries[status or "connection"] += 1
+        return delay
 
-        deadline = int(time.time()) + timeout
-        sync_successful = False
-        while True:
-            sync_successful = self.models_compatible(database_id, models)
-            time_after_wait = int(time.time()) + self._SYNC_PERIOD_SECS
-            if not sync_successful and time_after_wait <= deadline:
-                time.sleep(self._SYNC_PERIOD_SECS)
-            else:
-                break
-        return sync_successful
+    @staticmethod
+    def _parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+        """Parses Retry-After header, given either in seconds or as HTTP date.
 
-    def models_compatible(self, database_id: str, models: Sequence) -> bool:
-        """Checks if models compatible with the Metabase database schema.
+        Arguments:
+            retry_after {str} -- Retry-After header value.
+
+        Returns:
+            float -- Seconds to wait, None if header is missing or invalid.
+        """
+
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    def _report_retries(self):
+        """Logs how many requests were retried during the run."""
+
+        if self.retries:
+            logging.info(
+                "Retried %d Metabase requests (%s)",
+                sum(self.retries.values()),
+                ", ".join(
+                    f"{reason}: {count}" for reason, count in self.retries.items()
+                ),
+            )
+
+    @staticmethod
+    def _check_models(field_lookup: Mapping, models: Sequence) -> bool:
+        """Checks if models are present in the field lookup.
 
         Arguments:
-            database_id {str} -- Metabase database ID.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
             models {list} -- List of dbt models read from project.
 
         Returns:
-            bool -- True if schema compatible with models, false otherwise.
+            bool -- True if all models and their columns are found, false otherwise.
         """
 
-        _, field_lookup = self.build_metadata_lookups(database_id)
-
         are_models_compatible = True
         for model in models:
 
@@ -164,55 +490,82 @@ class MetabaseClient:
 
         return are_models_compatible
 
-    def export_models(
-        self,
-        database: str,
-        models: Sequence[MetabaseModel],
-        aliases,
-    ):
-        """Exports dbt models to Metabase database schema.
+    @staticmethod
+    def _missing_models(field_lookup: Mapping, models: Sequence) -> List:
+        """Finds models whose table or columns are not in the field lookup yet.
 
         Arguments:
-            database {str} -- Metabase database name.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
             models {list} -- List of dbt models read from project.
-            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+
+        Returns:
+            list -- Models still missing a table or a column.
         """
 
-        database_id = self.find_database_id(database)
-        if not database_id:
-            logging.critical("Cannot find database by name %s", database)
-            return
+        missing = []
+        for model in models:
+            lookup_key = f"{model.schema.upper()}.{model.name.upper()}"
+            if lookup_key not in field_lookup or any(
+                column.name.upper() not in field_lookup[lookup_key]
+                for column in model.columns
+            ):
+                missing.append(model)
+        logging.debug("Waiting for %d models to appear in Metabase", len(missing))
+        return missing
+
+    @staticmethod
+    def _model_table_ids(table_lookup: Mapping, models: Sequence) -> List[Any]:
+        """Lists IDs of the Metabase tables backing models, once per table.
 
-        table_lookup, field_lookup = self.build_metadata_lookups(database_id)
+        Arguments:
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
+            models {list} -- List of dbt models read from project.
+
+        Returns:
+            list -- Metabase table IDs of models found in the lookup.
+        """
 
+        table_ids: List[Any] = []
         for model in models:
-            self.export_model(model, table_lookup, field_lookup, aliases)
+            table = table_lookup.get(f"{model.schema.upper()}.{model.name.upper()}")
+            if table and table["id"] not in table_ids:
+                table_ids.append(table["id"])
+        return table_ids
 
-    def export_model(
-        self,
-        model: MetabaseModel,
-        table_lookup: dict,
-        field_lookup: dict,
-        aliases: dict,
-    ):
-        """Exports one dbt model to Metabase database schema.
+    @staticmethod
+    def _missing_table_keys(table_lookup: Mapping, models: Sequence) -> List[str]:
+        """Finds models whose table is not in the table lookup yet.
 
         Arguments:
-            model {dict} -- One dbt model read from project.
             table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
-            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
-            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+            models {list} -- List of dbt models read from project.
+
+        Returns:
+            list -- Table names not found.
         """
 
-        schema_name = model.schema.upper()
-        model_name = model.name.upper()
+        return [
+            key
+            for key in (
+                f"{model.schema.upper()}.{model.name.upper()}" for model in models
+            )
+            if key not in table_lookup
+        ]
 
-        lookup_key = f"{schema_name}.{aliases.get(model_name, model_name)}"
+    @staticmethod
+    def _table_update(
+        lookup_key: str, model: MetabaseModel, api_table: Mapping
+    ) -> Optional[dict]:
+        """Compares one dbt model to its Metabase table.
 
-        api_table = table_lookup.get(lookup_key)
-        if not api_table:
-            logging.error("Table %s does not exist in Metabase", lookup_key)
-            return
+        Arguments:
+            lookup_key {str} -- Metabase table name, used for logging.
+            model {dict} -- One dbt model read from project.
+            api_table {dict} -- Metabase table as returned by the API.
+
+        Returns:
+            dict -- Table attributes to update, None if table is up-to-date.
+        """
 
         # Empty strings not accepted by Metabase
         if not model.description:
@@ -220,122 +573,236 @@ class MetabaseClient:
         else:
             model_description = model.description
 
-        table_id = api_table["id"]
         if api_table["description"] != model_description and model_description:
-            # Update with new values
-            self.api(
-                "put",
-                f"/api/table/{table_id}",
-                json={"description": model_description},
-            )
-            logging.info("Updated table %s successfully", lookup_key)
+            return {"description": model_description}
         elif not model_description:
             logging.info("No model description provided for table %s", lookup_key)
         else:
             logging.info("Table %s is up-to-date", lookup_key)
+        return None
 
-        for column in model.columns:
-            self.export_column(schema_name, model_name, column, field_lookup, aliases)
+    def _resolve_fk_targets(
+        self,
+        columns: Iterable[Tuple[str, MetabaseColumn]],
+        field_lookup: Mapping,
+        aliases: Mapping,
+    ) -> _FkTargets:
+        """Resolves the Metabase fields targeted by foreign key columns.
 
-    def export_column(
+        Arguments:
+            columns {list} -- Metabase table names and dbt columns to resolve.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Used to resolve FK refs against relations to aliased source tables
+
+        Returns:
+            _FkTargets -- Targets indexed by column.
+        """
+
+        fk_targets = _FkTargets()
+        for table_lookup_key, column in columns:
+            target = self._resolve_fk_target_field(
+                table_lookup_key, column, field_lookup, aliases
+            )
+            if target:
+                fk_targets.add(
+                    table_lookup_key,
+                    column.name.upper(),
+                    target,
+                    f"{column.fk_target_table}.{column.fk_target_field}".upper(),
+                )
+        return fk_targets
+
+    @staticmethod
+    def _promote_fk_targets(fk_targets: _FkTargets, writes: _WriteBuffer):
+        """Records promotion of every foreign key target to PK, once per field.
+
+        Arguments:
+            fk_targets {_FkTargets} -- Targets of the foreign key columns.
+            writes {_WriteBuffer} -- Gathers updates to be sent later.
+        """
+
+        promoted: Set[int] = set()
+        for (table_lookup_key, column_name), target in fk_targets.by_column.items():
+            if target["id"] in promoted:
+                continue
+            promoted.add(target["id"])
+
+            semantic_type = (
+                "special_type" if "special_type" in target else "semantic_type"
+            )
+            if target.get(semantic_type) == "type/PK":
+                logging.debug("Target field %s is already PK", target["id"])
+                continue
+
+            logging.info(
+                "Setting target field %s to PK in order to facilitate FK ref for %s.%s column",
+                target["id"],
+                table_lookup_key,
+                column_name,
+            )
+            writes.add(
+                "field",
+                fk_targets.labels[target["id"]],
+                target,
+                {semantic_type: "type/PK"},
+            )
+
+    def _diff_column(
         self,
-        schema_name: str,
+        table_lookup_key: str,
         model_name: str,
         column: MetabaseColumn,
-        field_lookup: dict,
-        aliases: dict,
+        field: MutableMapping,
+        fk_targets: _FkTargets,
+        writes: _WriteBuffer,
     ):
-        """Exports one dbt column to Metabase database schema.
+        """Records updates needed to align one Metabase field with its dbt column.
 
         Arguments:
+            table_lookup_key {str} -- Metabase table name of the column.
             model_name {str} -- One dbt model name read from project.
             column {dict} -- One dbt column read from project.
-            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
-            aliases {dict} -- Provided by reader class. Used to resolve FK refs against relations to aliased source tables
+            field {dict} -- Metabase field of the column from field lookup.
+            fk_targets {_FkTargets} -- Targets of the foreign key columns, see _resolve_fk_targets().
+            writes {_WriteBuffer} -- Gathers updates to be sent later.
         """
 
-        table_lookup_key = f"{schema_name}.{model_name}"
         column_name = column.name.upper()
 
-        field = field_lookup.get(table_lookup_key, {}).get(column_name)
-        if not field:
-            logging.error(
-                "Field %s.%s does not exist in Metabase", table_lookup_key, column_name
-            )
-            return
-
-        field_id = field["id"]
-
-        api_field = self.api("get", f"/api/field/{field_id}")
-
-        if "special_type" in api_field:
+        if "special_type" in field:
             semantic_type = "special_type"
         else:
             semantic_type = "semantic_type"
 
-        fk_target_field_id = None
-        if column.semantic_type == "type/FK":
-            # Target table could be aliased if we parse_ref() on a source, so we caught aliases during model parsing
-            # This way we can unpack any alias mapped to fk_target_table when using yml folder parser
-            target_table = (
-                column.fk_target_table.upper()
-                if column.fk_target_table is not None
-                else None
-            )
-            target_field = (
-                column.fk_target_field.upper()
-                if column.fk_target_field is not None
-                else None
-            )
-
-            if not target_table or not target_field:
-                logging.info(
-                    "Passing on fk resolution for %s. Target field %s was not resolved during dbt model parsing.",
-                    table_lookup_key,
-                    target_field,
-                )
+        fk_target_field = fk_targets.by_column.get((table_lookup_key, column_name))
+        fk_target_field_id = fk_target_field["id"] if fk_target_field else None
 
-            else:
-                # Now we can trust our parse_ref even if it is pointing to something like source("salesforce", "my_cool_table_alias")
-                # just as easily as a simple ref("stg_salesforce_cool_table") -> the dict is empty if parsing from manifest.json
-                was_aliased = (
-                    aliases.get(target_table.split(".", 1)[-1])
-                    if target_table
-                    else None
-                )
-                if was_aliased:
-                    target_table = ".".join(
-                        [target_table.split(".", 1)[0], was_aliased]
-                    )
+        field_update = self._field_update(
+            column,
+            field,
+            semantic_type,
+            fk_target_field_id,
+            is_fk_target=field["id"] in fk_targets.labels,
+        )
+        if field_update:
+            writes.add("field", f"{model_name}.{column_name}", field, field_update)
+        else:
+            logging.info("Field %s.%s is up-to-date", model_name, column_name)
 
-                logging.info(
-                    "Looking for field %s in table %s", target_field, target_table
-                )
-                fk_target_field_id = (
-                    field_lookup.get(target_table, {}).get(target_field, {}).get("id")
-                )
+    @staticmethod
+    def _is_field_complete(field: Mapping) -> bool:
+        """Checks if a field from the metadata snapshot has all attributes we diff.
 
-                if fk_target_field_id:
-                    logging.info(
-                        "Setting target field %s to PK in order to facilitate FK ref for %s column",
-                        fk_target_field_id,
-                        column_name,
-                    )
-                    self.api(
-                        "put",
-                        f"/api/field/{fk_target_field_id}",
-                        json={semantic_type: "type/PK"},
-                    )
-                else:
-                    logging.error(
-                        "Unable to find foreign key target %s.%s",
-                        target_table,
-                        target_field,
-                    )
+        Arguments:
+            field {dict} -- Metabase field from database metadata.
+
+        Returns:
+            bool -- True if field can be diffed without fetching it.
+        """
+
+        return ("semantic_type" in field or "special_type" in field) and all(
+            key in field
+            for key in ("description", "visibility_type", "fk_target_field_id")
+        )
+
+    @staticmethod
+    def _resolve_fk_target_field(
+        table_lookup_key: str,
+        column: MetabaseColumn,
+        field_lookup: Mapping,
+        aliases: Mapping,
+    ) -> Optional[MutableMapping]:
+        """Resolves the Metabase field a dbt foreign key column points to.
+
+        Arguments:
+            table_lookup_key {str} -- Metabase table name of the column, used for logging.
+            column {dict} -- One dbt column read from project.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Used to resolve FK refs against relations to aliased source tables
+
+        Returns:
+            dict -- Metabase field of the FK target from field lookup, None if column is not a resolvable FK.
+        """
+
+        if column.semantic_type != "type/FK":
+            return None
+
+        # Target table could be aliased if we parse_ref() on a source, so we caught aliases during model parsing
+        # This way we can unpack any alias mapped to fk_target_table when using yml folder parser
+        target_table = (
+            column.fk_target_table.upper()
+            if column.fk_target_table is not None
+            else None
+        )
+        target_field = (
+            column.fk_target_field.upper()
+            if column.fk_target_field is not None
+            else None
+        )
+
+        if not target_table or not target_field:
+            logging.info(
+                "Passing on fk resolution for %s. Target field %s was not resolved during dbt model parsing.",
+                table_lookup_key,
+                target_field,
+            )
+            return None
+
+        # Now we can trust our parse_ref even if it is pointing to something like source("salesforce", "my_cool_table_alias")
+        # just as easily as a simple ref("stg_salesforce_cool_table") -> the dict is empty if parsing from manifest.json
+        was_aliased = (
+            aliases.get(target_table.split(".", 1)[-1]) if target_table else None
+        )
+        if was_aliased:
+            target_table = ".".join([target_table.split(".", 1)[0], was_aliased])
+
+        logging.debug(
+            "Looking for field %s in table %s to resolve FK for %s.%s",
+            target_field,
+            target_table,
+            table_lookup_key,
+            column.name.upper(),
+        )
+        fk_target_field = field_lookup.get(target_table, {}).get(target_field)
+
+        if not fk_target_field or not fk_target_field.get("id"):
+            logging.error(
+                "Unable to find foreign key target %s.%s",
+                target_table,
+                target_field,
+            )
+            return None
+        return fk_target_field
+
+    @staticmethod
+    def _field_update(
+        column: MetabaseColumn,
+        api_field: Mapping,
+        semantic_type: str,
+        fk_target_field_id: Optional[int],
+        is_fk_target: bool = False,
+    ) -> Optional[dict]:
+        """Compares one dbt column to its Metabase field.
+
+        Arguments:
+            column {dict} -- One dbt column read from project.
+            api_field {dict} -- Metabase field as returned by the API.
+            semantic_type {str} -- Name of the semantic type attribute in this Metabase version.
+            fk_target_field_id {int} -- Resolved Metabase field ID of the FK target.
+
+        Keyword Arguments:
+            is_fk_target {bool} -- Field is targeted by a foreign key and is kept as PK unless dbt sets another semantic type. (default: {False})
+
+        Returns:
+            dict -- Field attributes to update, None if field is up-to-date.
+        """
+
+        column_semantic_type = column.semantic_type
+        if not column_semantic_type and is_fk_target:
+            column_semantic_type = "type/PK"
 
         # Nones are not accepted, default to normal
-        if not column.visibility_type:
-            column.visibility_type = "normal"
+        visibility_type = column.visibility_type or "normal"
 
         # Empty strings not accepted by Metabase
         if not column.description:
@@ -345,47 +812,80 @@ class MetabaseClient:
 
         if (
             api_field["description"] != column_description
-            or api_field[semantic_type] != column.semantic_type
-            or api_field["visibility_type"] != column.visibility_type
+            or api_field[semantic_type] != column_semantic_type
+            or api_field["visibility_type"] != visibility_type
             or api_field["fk_target_field_id"] != fk_target_field_id
         ):
-            # Update with new values
-            self.api(
-                "put",
-                f"/api/field/{field_id}",
-                json={
-                    "description": column_description,
-                    semantic_type: column.semantic_type,
-                    "visibility_type": column.visibility_type,
-                    "fk_target_field_id": fk_target_field_id,
-                },
-            )
-            logging.info("Updated field %s.%s successfully", model_name, column_name)
-        else:
-            logging.info("Field %s.%s is up-to-date", model_name, column_name)
+            return {
+                "description": column_description,
+                semantic_type: column_semantic_type,
+                "visibility_type": visibility_type,
+                "fk_target_field_id": fk_target_field_id,
+            }
+        return None
 
-    def find_database_id(self, name: str) -> Optional[str]:
-        """Finds Metabase database ID by name.
+    @staticmethod
+    def _match_database_id(databases: Iterable, name: str) -> Optional[str]:
+        """Finds Metabase database ID by name in a database listing.
 
         Arguments:
+            databases {list} -- Metabase databases as returned by the API.
             name {str} -- Metabase database name.
 
         Returns:
             str -- Metabase database ID.
         """
 
-        for database in self.api("get", "/api/database"):
+        for database in databases:
             if database["name"].upper() == name.upper():
                 return database["id"]
         return None
 
-    def build_metadata_lookups(
-        self, database_id: str, schemas_to_exclude: Iterable = None
-    ) -> Tuple[dict, dict]:
-        """Builds table and field lookups.
+    def _invalidate_metadata(self, database_id: Any, writes: _WriteBuffer):
+        """Drops cached metadata of a database about to be changed by writes.
 
         Arguments:
             database_id {str} -- Metabase database ID.
+            writes {_WriteBuffer} -- Updates about to be sent.
+        """
+
+        if self.metadata_cache and writes.pending():
+            self.metadata_cache.invalidate(self.host, database_id)
+
+    @staticmethod
+    def _metadata_fingerprint(database: Mapping) -> str:
+        """Summarizes when a database and its tables were last changed in Metabase.
+
+        Editing a field in Metabase changes neither, and listing fields with their
+        timestamps costs about as much as downloading the metadata. Such edits are only
+        picked up once the cached snapshot expires or a run writing to Metabase drops it.
+
+        Arguments:
+            database {dict} -- Metabase database with its tables as returned by the API.
+
+        Returns:
+            str -- Hex digest, changes whenever the database or one of its tables is updated.
+        """
+
+        content = json.dumps(
+            [
+                database.get("updated_at"),
+                sorted(
+                    (table["id"], table.get("updated_at"))
+                    for table in database.get("tables", [])
+                ),
+            ]
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _index_metadata(
+        metadata: Mapping, schemas_to_exclude: Iterable = None
+    ) -> Tuple[dict, dict]:
+        """Indexes database metadata into table and field lookups.
+
+        Arguments:
+            metadata {dict} -- Metabase database metadata as returned by the API.
 
         Returns:
             dict -- Dictionary of tables indexed by name.
@@ -398,11 +898,6 @@ class MetabaseClient:
         table_lookup = {}
         field_lookup = {}
 
-        metadata = self.api(
-            "get",
-            f"/api/database/{database_id}/metadata",
-            params=dict(include_hidden=True),
-        )
         for table in metadata.get("tables", []):
             table_schema = table.get("schema")
             table_schema = table_schema.upper() if table_schema else "PUBLIC"
@@ -434,243 +929,386 @@ class MetabaseClient:
 
         return table_lookup, field_lookup
 
-    def extract_exposures(
-        self,
-        models: List[MetabaseModel],
-        output_path: str = ".",
-        output_name: str = "metabase_exposures",
-        include_personal_collections: bool = True,
-        collection_excludes: Iterable = None,
-    ) -> Mapping:
-        """Extracts exposures in Metabase downstream of dbt models and sources as parsed by dbt reader
+    @staticmethod
+    def _filter_collections(
+        collections: Iterable,
+        include_personal_collections: bool,
+        collection_excludes: Iterable,
+    ) -> Iterable[Mapping]:
+        """Filters Metabase collections to explore for exposures.
 
         Arguments:
-            models {List[MetabaseModel]} -- List of models as output by dbt reader
+            collections {list} -- Metabase collections as returned by the API.
+            include_personal_collections {bool} -- Include personal collections in Metabase processing.
+            collection_excludes {list} -- List of collections to exclude by name.
 
-        Keyword Arguments:
-            output_path {str} -- The path to output the generated yaml. (default: ".")
-            output_name {str} -- The name of the generated yaml. (default: {"metabase_exposures"})
-            include_personal_collections {bool} -- Include personal collections in Metabase processing. (default: {True})
-            collection_excludes {str} -- List of collections to exclude by name. (default: {None})
+        Returns:
+            Iterable[Mapping] -- Collections to explore.
+        """
+
+        for collection in collections:
+
+            # Exclude collections by name
+            if collection["name"] in collection_excludes:
+                continue
+
+            # Optionally exclude personal collections
+            if not include_personal_collections and collection.get("personal_owner_id"):
+                continue
+
+            yield collection
+
+    @classmethod
+    def _is_card_complete(cls, card: Mapping) -> bool:
+        """Checks whether a question listed or embedded elsewhere can stand in for fetching it.
+
+        Arguments:
+            card {dict} -- Metabase question as returned by the API.
 
         Returns:
-            List[Mapping] -- JSON object representation of all exposures parsed.
+            bool -- True if the question has every field exposures are built from.
         """
 
-        _RESOURCE_VERSION = 2
+        return all(key in card for key in cls._CARD_FIELDS)
 
-        class DbtDumper(yaml.Dumper):
-            def increase_indent(self, flow=False, indentless=False):
-                indentless = False
-                return super(DbtDumper, self).increase_indent(flow, indentless)
+    @classmethod
+    def _complete_cards(cls, cards: Any) -> Iterable[Mapping]:
+        """Lists questions from a bulk listing that can stand in for fetching them one by one.
 
-        if collection_excludes is None:
-            collection_excludes = []
+        Arguments:
+            cards {list} -- Metabase questions as returned by the API, paginated or not.
 
-        refable_models = {node.name: node.ref for node in models}
+        Returns:
+            Iterable[Mapping] -- Questions with every field exposures are built from.
+        """
 
-        self.collections = self.api("get", "/api/collection")
-        self.tables = self.api("get", "/api/table")
-        self.table_map = {table["id"]: table["name"] for table in self.tables}
+        if isinstance(cards, Mapping):
+            cards = cards.get("data", [])
 
-        documented_exposure_names = []
-        parsed_exposures = []
+        return filter(cls._is_card_complete, cards)
 
-        for collection in self.collections:
+    @staticmethod
+    def _native_sql(card: Mapping) -> Optional[str]:
+        """Reads the SQL of a native question.
 
-            # Exclude collections by name
-            if collection["name"] in collection_excludes:
-                continue
+        Arguments:
+            card {dict} -- Metabase question as returned by the API.
 
-            # Optionally exclude personal collections
-            if not include_personal_collections and collection.get("personal_owner_id"):
-                continue
+        Returns:
+            str -- SQL query, None if the question is not native.
+        """
 
-            # Iter through collection
-            logging.info("Exploring collection %s", collection["name"])
-            for item in self.api("get", f"/api/collection/{collection['id']}/items"):
+        query = card.get("dataset_query", {})
+        if query.get("type") == "native":
+            return query.get("native", {}).get("query")
+        return None
 
-                # Ensure collection item is of parsable type
-                exposure_type = item["model"]
-                exposure_id = item["id"]
-                if exposure_type not in ("card", "dashboard"):
-                    continue
+    @contextmanager
+    def _parsing_pool(self, processes: int) -> Iterator[None]:
+        """Starts a process pool parsing long native queries, when more than one process is requested.
 
-                # Prepare attributes for population through _extract_card_exposures calls
-                self.models_exposed = []
-                self.native_query = ""
-                native_query = ""
+        Arguments:
+            processes {int} -- Number of processes.
+        """
 
-                exposure = self.api("get", f"/api/{exposure_type}/{exposure_id}")
-                exposure_name = exposure.get("name", "Exposure [Unresolved Name]")
-                logging.info("Introspecting exposure: %s", exposure_name)
+        if processes <= 1:
+            yield
+            return
 
-                # Process exposure
-                if exposure_type == "card":
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            self._sql_pool = pool
+            self._sql_processes = processes
+            self._sql_parsed = {}
+            try:
+                yield
+            finally:
+                self._sql_pool = None
+                self._sql_processes = 1
+                self._sql_parsed = {}
 
-                    # Build header for card and extract models to self.models_exposed
-                    header = "### Visualization: {}\n\n".format(
-                        exposure.get("display", "Unknown").title()
-                    )
+    def _parse_in_pool(self, cards: Iterable[Mapping]):
+        """Parses long native queries of questions in the process pool, if any.
 
-                    # Parse Metabase question
-                    self._extract_card_exposures(exposure_id, exposure)
-                    native_query = self.native_query
+        Arguments:
+            cards {list} -- Metabase questions as returned by the API.
+        """
 
-                elif exposure_type == "dashboard":
+        if self._sql_pool is None or self._model_matcher is not None:
+            return
 
-                    # We expect this dict key in order to iter through questions
-                    if "ordered_cards" not in exposure:
-                        continue
+        queries = (self._native_sql(card) for card in cards)
+        parsed = parse_in_pool(
+            [sql for sql in queries if sql and len(sql) >= self._SQL_POOL_MIN_CHARS],
+            self._sql_pool,
+            self._sql_processes,
+        )
+        self._sql_parsed.update(parsed)
 
-                    # Build header for dashboard and extract models for each question to self.models_exposed
-                    header = "### Dashboard Cards: {}\n\n".format(
-                        str(len(exposure["ordered_cards"]))
-                    )
+    @classmethod
+    def _dashboard_cards(
+        cls, dashboard: Mapping
+    ) -> Iterable[Tuple[int, Optional[Mapping]]]:
+        """Lists questions on a Metabase dashboard, including series added to them.
 
-                    # Iterate through dashboard questions
-                    for dashboard_item in exposure["ordered_cards"]:
-                        dashboard_item_reference = dashboard_item.get("card", {})
-                        if "id" not in dashboard_item_reference:
-                            continue
-                        # Parse Metabase question
-                        self._extract_card_exposures(dashboard_item_reference["id"])
-
-                # Extract creator info
-                if "creator" in exposure:
-                    creator_email = exposure["creator"]["email"]
-                    creator_name = exposure["creator"]["common_name"]
-                elif "creator_id" in exposure:
-                    creator = self.api("get", f"/api/user/{exposure['creator_id']}")
-                    creator_email = creator["email"]
-                    creator_name = creator["common_name"]
-
-                # No spaces allowed in model names in dbt docs DAG / No duplicate model names
-                exposure_name = exposure_name.replace(" ", "_")
-                enumer = 1
-                while exposure_name in documented_exposure_names:
-                    exposure_name = f"{exposure_name}_{enumer}"
-                    enumer += 1
-
-                # Construct exposure
-                parsed_exposures.append(
-                    self._build_exposure(
-                        exposure_type=exposure_type,
-                        exposure_id=exposure_id,
-                        name=exposure_name,
-                        header=header,
-                        created_at=exposure["created_at"],
-                        creator_name=creator_name,
-                        creator_email=creator_email,
-                        refable_models=refable_models,
-                        description=exposure.get("description", ""),
-                        native_query=native_query,
-                    )
-                )
+        Arguments:
+            dashboard {dict} -- Metabase dashboard as returned by the API.
+
+        Returns:
+            Iterable[Tuple[int, Optional[Mapping]]] -- Question IDs in dashboard order,
+                with the embedded question when complete enough to skip fetching it.
+        """
+
+        for dashboard_item in dashboard["ordered_cards"]:
+            for card in [dashboard_item.get("card", {})] + list(
+                dashboard_item.get("series", [])
+            ):
+                if "id" in card:
+                    yield card["id"], card if cls._is_card_complete(card) else None
+
+    @staticmethod
+    def _exposure_header(exposure_type: str, exposure: Mapping) -> str:
+        """Builds the header prefixing an exposure description.
+
+        Arguments:
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure {dict} -- Card or dashboard as returned by the API.
 
-                documented_exposure_names.append(exposure_name)
+        Returns:
+            str -- Markdown header.
+        """
 
-        # Output dbt YAML
-        with open(
-            os.path.expanduser(os.path.join(output_path, f"{output_name}.yml")),
-            "w",
-            encoding="utf-8",
-        ) as docs:
-            yaml.dump(
-                {"version": _RESOURCE_VERSION, "exposures": parsed_exposures},
-                docs,
-                Dumper=DbtDumper,
-                default_flow_style=False,
-                allow_unicode=True,
-                sort_keys=False,
+        if exposure_type == "card":
+            return "### Visualization: {}\n\n".format(
+                exposure.get("display", "Unknown").title()
             )
+        return "### Dashboard Cards: {}\n\n".format(str(len(exposure["ordered_cards"])))
+
+    @staticmethod
+    def _edited_at(item: Mapping) -> Optional[str]:
+        """Reads when a card or dashboard listed in a collection was last edited.
+
+        Arguments:
+            item {dict} -- Collection item as returned by the API.
+
+        Returns:
+            str -- Timestamp of the last edit, None if unknown.
+        """
+
+        return item.get("updated_at") or item.get("last-edit-info", {}).get("timestamp")
+
+    def _exposures_fingerprint(self) -> str:
+        """Hashes models matched anywhere in native queries, which all exposures are resolved against.
+
+        Metabase tables are not part of it, each exposure records the ones it reads from.
+
+        Returns:
+            str -- Hex digest of matched model names, if any.
+        """
 
-        # Return object
-        return {"version": _RESOURCE_VERSION, "exposures": parsed_exposures}
+        content = json.dumps(
+            sorted(self._model_matcher.qualified.items())
+            if self._model_matcher is not None
+            else None
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-    def _extract_card_exposures(self, card_id: int, exposure: Optional[Mapping] = None):
-        """Extracts exposures from Metabase questions populating `self.models_exposed`
+    def _exposure_dependencies(
+        self, exposure_type: str, exposure_id: int, exposure: Mapping
+    ) -> Set[int]:
+        """Lists questions a card or dashboard was resolved from, including the ones they are based on.
 
         Arguments:
-            card_id {int} -- Id of Metabase question used to pull question from api
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure_id {int} -- Card or Dashboard id in Metabase
+            exposure {dict} -- Card or dashboard as returned by the API.
+
+        Returns:
+            Set[int] -- Question IDs.
+        """
+
+        if exposure_type == "card":
+            pending = [exposure_id]
+        else:
+            pending = [card_id for card_id, _ in self._dashboard_cards(exposure)]
+
+        dependencies: Set[int] = set()
+        while pending:
+            card_id = pending.pop()
+            if card_id not in dependencies:
+                dependencies.add(card_id)
+                pending.extend(self._card_sources.get(card_id, []))
+        return dependencies
+
+    def _exposure_summary(
+        self,
+        exposure_type: str,
+        exposure_id: int,
+        resolution: Tuple[Mapping, List[str], str, Mapping],
+        edits: Mapping[str, Optional[str]],
+        state: Optional[ExposureState] = None,
+    ) -> Mapping:
+        """Keeps what exposures are built from out of a card or dashboard resolved by _resolve_exposure.
+
+        Arguments:
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure_id {int} -- Card or Dashboard id in Metabase
+            resolution {tuple} -- Card or dashboard, models exposed, native query and creator.
+            edits {dict} -- When each listed card and dashboard was last edited, by kind and id.
 
         Keyword Arguments:
-            exposure {str} -- JSON api response from a question in Metabase, allows us to use the object if already in memory
+            state {ExposureState} -- Records the summary for later runs. (default: {None})
+
+        Returns:
+            Mapping -- JSON-serializable summary of the exposure.
+        """
+
+        exposure, models_exposed, native_query, creator = resolution
+
+        summary = {
+            "name": exposure.get("name", "Exposure [Unresolved Name]"),
+            "header": self._exposure_header(exposure_type, exposure),
+            "created_at": exposure["created_at"],
+            "creator_name": creator.get("common_name", ""),
+            "creator_email": creator.get("email", ""),
+            "models_exposed": models_exposed,
+            "description": exposure.get("description", ""),
+            "native_query": native_query,
+        }
+
+        if state is not None:
+            key = f"{exposure_type}/{exposure_id}"
+            dependencies = self._exposure_dependencies(
+                exposure_type, exposure_id, exposure
+            )
+            state.record(
+                key,
+                edits.get(key),
+                {
+                    f"card/{card_id}": edits.get(f"card/{card_id}")
+                    for card_id in dependencies
+                },
+                summary,
+                {
+                    table_id: self.table_map.get(table_id)
+                    for card_id in dependencies
+                    for table_id in self._card_tables.get(card_id, [])
+                },
+            )
+
+        return summary
+
+    def _exposure_from(
+        self,
+        exposure_type: str,
+        exposure_id: int,
+        summary: Mapping,
+        refable_models: Mapping,
+        names: _ExposureNames,
+    ) -> Mapping:
+        """Builds one exposure from a card or dashboard summarized by _exposure_summary.
+
+        Arguments:
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure_id {int} -- Card or Dashboard id in Metabase
+            summary {dict} -- What the exposure is built from.
+            refable_models {dict} -- Refs of dbt models by name.
+            names {_ExposureNames} -- Exposure names already taken.
+
+        Returns:
+            Mapping -- Exposure for dbt YAML.
+        """
+
+        return self._build_exposure(
+            exposure_type=exposure_type,
+            exposure_id=exposure_id,
+            name=names.unique(summary["name"]),
+            header=summary["header"],
+            created_at=summary["created_at"],
+            creator_name=summary["creator_name"],
+            creator_email=summary["creator_email"],
+            refable_models=refable_models,
+            models_exposed=summary["models_exposed"],
+            description=summary["description"],
+            native_query=summary["native_query"],
+        )
+
+    def _parse_card(self, card: Mapping) -> Tuple[List[str], List[int], List[int], str]:
+        """Parses models referenced directly by one Metabase question.
+
+        Arguments:
+            card {dict} -- JSON api response from a question in Metabase
 
         Returns:
-            None -- self.models_exposed is populated through this method.
+            List[str] -- Names of models extracted from the question.
+            List[int] -- Ids of questions the question is based on, to be parsed in turn.
+            List[int] -- Ids of Metabase tables the question reads from, known or not.
+            str -- Native query of the question if it exposes any model, else empty.
         """
 
-        # If an exposure is not passed, pull from id
-        if not exposure:
-            exposure = self.api("get", f"/api/card/{card_id}")
+        models_exposed: List[str] = []
+        source_card_ids: List[int] = []
+        source_table_ids: List[int] = []
+        native_query = ""
 
-        query = exposure.get("dataset_query", {})
+        query = card.get("dataset_query", {})
 
         if query.get("type") == "query":
             # Metabase GUI derived query
             source_table_id = query.get("query", {}).get(
-                "source-table", exposure.get("table_id")
+                "source-table", card.get("table_id")
             )
 
             if str(source_table_id).startswith("card__"):
                 # Handle questions based on other question in virtual db
-                self._extract_card_exposures(int(source_table_id.split("__")[-1]))
-            else:
+                source_card_ids.append(int(source_table_id.split("__")[-1]))
+            elif source_table_id is not None:
                 # Normal question
+                source_table_ids.append(source_table_id)
                 source_table = self.table_map.get(source_table_id)
                 if source_table:
                     logging.info(
                         "Model extracted from Metabase question: %s",
                         source_table,
                     )
-                    self.models_exposed.append(source_table)
+                    models_exposed.append(source_table)
 
             # Find models exposed through joins
             for query_join in query.get("query", {}).get("joins", []):
 
                 # Handle questions based on other question in virtual db
                 if str(query_join.get("source-table", "")).startswith("card__"):
-                    self._extract_card_exposures(
+                    source_card_ids.append(
                         int(query_join.get("source-table").split("__")[-1])
                     )
                     continue
 
                 # Joined model parsed
+                if query_join.get("source-table") is not None:
+                    source_table_ids.append(query_join["source-table"])
                 joined_table = self.table_map.get(query_join.get("source-table"))
                 if joined_table:
                     logging.info(
                         "Model extracted from Metabase question join: %s",
                         joined_table,
                     )
-                    self.models_exposed.append(joined_table)
+                    models_exposed.append(joined_table)
 
         elif query.get("type") == "native":
             # Metabase native query
-            native_query = query.get("native").get("query")
-            ctes = []
-
-            # Parse common table expressions for exclusion
-            for cte in re.findall(self.cte_parser, native_query):
-                ctes.extend(cte)
+            sql = query.get("native").get("query")
 
-            # Parse SQL for exposures through FROM or JOIN clauses
-            for sql_ref in re.findall(self.exposure_parser, native_query):
-
-                # Grab just the table / model name
-                clean_exposure = sql_ref.split(".")[-1].strip('"')
-
-                # Scrub CTEs for cleanliness sake
-                if clean_exposure in ctes:
-                    continue
+            # Parse SQL for exposures through FROM or JOIN clauses, CTEs excluded,
+            # or anywhere in the query when matching models
+            if self._model_matcher is not None:
+                tables = self._model_matcher.match(sql)
+            else:
+                tables = extract_tables(sql, self._sql_parsed)
+            for table in tables:
+                logging.info("Model extracted from native query: %s", table)
+                models_exposed.append(table)
+                native_query = sql
 
-                if clean_exposure:
-                    logging.info(
-                        "Model extracted from native query: %s",
-                        clean_exposure,
-                    )
-                    self.models_exposed.append(clean_exposure)
-                    self.native_query = native_query
+        return models_exposed, source_card_ids, source_table_ids, native_query
 
     def _build_exposure(
         self,
@@ -682,6 +1320,7 @@ class MetabaseClient:
         creator_name: str,
         creator_email: str,
         refable_models: Mapping,
+        models_exposed: Iterable[str],
         description: str = "",
         native_query: str = "",
     ) -> Mapping:
@@ -696,6 +1335,7 @@ class MetabaseClient:
             creator_name {str} -- Creator name derived from Metabase
             creator_email {str} -- Creator email derived from Metabase
             refable_models {str} -- List of dbt models from dbt parser which can validly be referenced, parsed exposures are always checked against this list to avoid generating invalid yaml
+            models_exposed {list} -- Names of models extracted from the card or dashboard questions
 
         Keyword Arguments:
             description {str} -- The description of the exposure as documented in Metabase. (default: No description provided in Metabase)
@@ -716,7 +1356,7 @@ class MetabaseClient:
             native_query = "#### Query\n\n```\n{}\n```\n\n".format(
                 "\n".join(
                     sql_line
-                    for sql_line in self.native_query.strip().split("\n")
+                    for sql_line in native_query.strip().split("\n")
                     if sql_line.strip() != ""
                 )
             )
@@ -749,56 +1389,1163 @@ class MetabaseClient:
             },
             "depends_on": [
                 refable_models[exposure.upper()]
-                for exposure in list({m for m in self.models_exposed})
+                # Deduplicate in order of appearance, keeps the output stable
+                for exposure in dict.fromkeys(models_exposed)
                 if exposure.upper() in refable_models
             ],
         }
 
-    def api(
+
+class MetabaseClient(_MetabaseClientBase):
+    """Metabase API client."""
+
+    def __init__(
         self,
-        method: str,
-        path: str,
-        authenticated: bool = True,
-        critical: bool = True,
-        **kwargs,
-    ) -> Mapping:
-        """Unified way of calling Metabase API.
+        host: str,
+        user: str,
+        password: str,
+        use_http: bool = False,
+        verify: Union[str, bool] = None,
+        http_pool_size: int = 10,
+        http_keep_alive: bool = True,
+        http_connect_timeout: Optional[float] = 10,
+        http_read_timeout: Optional[float] = 120,
+        http_retries: int = 3,
+        run_timeout: Optional[float] = None,
+        concurrency: int = 1,
+        metadata_cache: Optional[MetadataCache] = None,
+    ):
+        """Constructor.
 
         Arguments:
-            method {str} -- HTTP verb, e.g. get, post, put.
-            path {str} -- Relative path of endpoint, e.g. /api/database.
+            host {str} -- Metabase hostname.
+            user {str} -- Metabase username.
+            password {str} -- Metabase password.
 
         Keyword Arguments:
-            authenticated {bool} -- Includes session ID when true. (default: {True})
-            critical {bool} -- Raise on any HTTP errors. (default: {True})
+            use_http {bool} -- Use HTTP instead of HTTPS. (default: {False})
+            verify {Union[str, bool]} -- Path to certificate or disable verification. (default: {None})
+            http_pool_size {int} -- Maximum number of pooled connections to Metabase. (default: {10})
+            http_keep_alive {bool} -- Reuse connections between requests. (default: {True})
+            http_connect_timeout {float} -- Seconds to wait for a connection, None waits forever. (default: {10})
+            http_read_timeout {float} -- Seconds to wait for a response, None waits forever. (default: {120})
+            http_retries {int} -- Retries of failed idempotent requests. (default: {3})
+            run_timeout {float} -- Seconds after which all requests are abandoned, None for no deadline. (default: {None})
+            concurrency {int} -- Maximum number of models exported in parallel. (default: {1})
+            metadata_cache {MetadataCache} -- Keeps database metadata on disk between runs. (default: {None})
+        """
+
+        super().__init__(
+            host,
+            use_http=use_http,
+            verify=verify,
+            http_connect_timeout=http_connect_timeout,
+            http_read_timeout=http_read_timeout,
+            http_retries=http_retries,
+            run_timeout=run_timeout,
+            metadata_cache=metadata_cache,
+        )
+        self.concurrency = max(concurrency, 1)
+        self._objects_lock = threading.Lock()
+        self.session = self._build_session(
+            max(http_pool_size, self.concurrency), http_keep_alive
+        )
+        self.session_id = self.get_session_id(user, password)
+        logging.info("Session established successfully")
+
+    def __enter__(self) -> "MetabaseClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes pooled HTTP connections to Metabase."""
+
+        self.session.close()
+        self._report_retries()
+
+    @staticmethod
+    def _build_session(pool_size: int, keep_alive: bool) -> requests.Session:
+        """Builds HTTP session with a connection pool shared by all API calls.
+
+        Arguments:
+            pool_size {int} -- Maximum number of pooled connections.
+            keep_alive {bool} -- Reuse connections between requests.
 
         Returns:
-            Any -- JSON payload of the endpoint.
+            requests.Session -- Session to issue API calls through.
         """
 
-        headers: MutableMapping = {}
-        if "headers" not in kwargs:
-            kwargs["headers"] = headers
-        else:
-            headers = kwargs["headers"].copy()
-
-        if authenticated:
-            headers["X-Metabase-Session"] = self.session_id
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
 
-        response = requests.request(
-            method, f"{self.protocol}://{self.host}{path}", verify=self.verify, **kwargs
+    def get_session_id(self, user: str, password: str) -> str:
+        """Obtains new session ID from API.
+
+        Arguments:
+            user {str} -- Metabase username.
+            password {str} -- Metabase password.
+
+        Returns:
+            str -- Session ID.
+        """
+
+        return self.api(
+            "post",
+            "/api/session",
+            authenticated=False,
+            json={"username": user, "password": password},
+        )["id"]
+
+    def sync_and_wait(
+        self,
+        database: str,
+        models: Sequence,
+        timeout: Optional[int],
+        tables_only: bool = False,
+    ) -> bool:
+        """Synchronize with the database and wait for schema compatibility.
+
+        Arguments:
+            database {str} -- Metabase database name.
+            models {list} -- List of dbt models read from project.
+
+        Keyword Arguments:
+            timeout {int} -- Timeout before giving up in seconds. (default: {30})
+            tables_only {bool} -- Only synchronize tables backing the models, see _sync_tables(). (default: {False})
+
+        Returns:
+            bool -- True if schema compatible with models, false if still incompatible.
+        """
+        if timeout is None:
+            timeout = 30
+
+        if timeout < self._SYNC_PERIOD_SECS:
+            logging.critical(
+                "Timeout provided %d secs, must be at least %d",
+                timeout,
+                self._SYNC_PERIOD_SECS,
+            )
+            return False
+
+        database_id = self.find_database_id(database)
+        if not database_id:
+            logging.critical("Cannot find database by name %s", database)
+            return False
+
+        if not tables_only:
+            self.api("post", f"/api/database/{database_id}/sync_schema")
+
+        deadline = time.monotonic() + timeout
+
+        # Download metadata once, then only poll tables of models still missing
+        table_lookup, field_lookup = self.build_metadata_lookups(
+            database_id, cached=False
+        )
+        if tables_only:
+            self._sync_tables(database_id, models, table_lookup)
+        missing = self._missing_models(field_lookup, models)
+        delay = self._SYNC_BACKOFF_SECS
+        while missing and time.monotonic() < deadline:
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, self._SYNC_BACKOFF_MAX_SECS)
+            self._refresh_tables(database_id, missing, table_lookup, field_lookup)
+            missing = self._missing_models(field_lookup, missing)
+
+        return self._check_models(field_lookup, models)
+
+    def _sync_tables(self, database_id: str, models: Sequence, table_lookup: Mapping):
+        """Synchronizes only the tables backing some models.
+
+        Falls back to synchronizing the whole database when some tables are not in
+        Metabase yet, or when this Metabase version cannot synchronize single tables.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models read from project.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
+        """
+
+        new_tables = self._missing_table_keys(table_lookup, models)
+        if new_tables:
+            logging.info(
+                "Tables %s not in Metabase yet, synchronizing database",
+                ", ".join(new_tables),
+            )
+            self.api("post", f"/api/database/{database_id}/sync_schema")
+            return
+
+        for table_id in self._model_table_ids(table_lookup, models):
+            if not self.api(
+                "post", f"/api/table/{table_id}/sync_schema", critical=False
+            ):
+                logging.info(
+                    "Metabase cannot synchronize single tables, synchronizing database"
+                )
+                self.api("post", f"/api/database/{database_id}/sync_schema")
+                return
+
+    def _refresh_tables(
+        self,
+        database_id: str,
+        models: Sequence,
+        table_lookup: MutableMapping,
+        field_lookup: MutableMapping,
+    ):
+        """Downloads metadata of the tables backing some models only.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models to refresh.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name, updated in place.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name, updated in place.
+        """
+
+        if self._missing_table_keys(table_lookup, models):
+            # Tables are listed without their fields to learn IDs of new ones
+            new_tables, _ = self._index_metadata(
+                self.api(
+                    "get", f"/api/database/{database_id}", params={"include": "tables"}
+                )
+            )
+            table_lookup.update(new_tables)
+
+        for table_id in self._model_table_ids(table_lookup, models):
+            _, fields = self._index_metadata(
+                {
+                    "tables": [
+                        self.api(
+                            "get",
+                            f"/api/table/{table_id}/query_metadata",
+                            params=dict(include_hidden_fields=True),
+                        )
+                    ]
+                }
+            )
+            field_lookup.update(fields)
+
+    def models_compatible(self, database_id: str, models: Sequence) -> bool:
+        """Checks if models compatible with the Metabase database schema.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models read from project.
+
+        Returns:
+            bool -- True if schema compatible with models, false otherwise.
+        """
+
+        # Sync is in progress, the cached metadata is about to change
+        _, field_lookup = self.build_metadata_lookups(database_id, cached=False)
+        return self._check_models(field_lookup, models)
+
+    def export_models(
+        self,
+        database: str,
+        models: Sequence[MetabaseModel],
+        aliases,
+        plan_path: Optional[str] = None,
+        journal: Optional[ExportJournal] = None,
+        all_models: Optional[Sequence[MetabaseModel]] = None,
+        exported: Optional[List[MetabaseModel]] = None,
+    ) -> bool:
+        """Exports dbt models to Metabase database schema.
+
+        Models are exported in parallel when the client concurrency is above 1, in which
+        case failures are collected and reported at the end instead of aborting the run.
+
+        Arguments:
+            database {str} -- Metabase database name.
+            models {list} -- List of dbt models read from project.
+            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            plan_path {str} -- Write changes to this JSON plan instead of Metabase, see apply_plan(). (default: {None})
+            journal {ExportJournal} -- Records completed writes, resuming a previous run of the same export. (default: {None})
+            all_models {list} -- All dbt models read from project, FK targets are resolved across them so that targets of models not exported stay PK. (default: {models})
+            exported {list} -- Collects models whose table and columns were all found in Metabase, emptied if any write failed. (default: {None})
+
+        Returns:
+            bool -- True if all models were found in Metabase and exported, false otherwise.
+        """
+
+        database_id = self.find_database_id(database)
+        if not database_id:
+            logging.critical("Cannot find database by name %s", database)
+            return False
+
+        table_lookup, field_lookup = self.build_metadata_lookups(database_id)
+
+        writes = _WriteBuffer()
+
+        # Resolve FK targets up front so each one is promoted to PK exactly once,
+        # including targets of unchanged models, which only the changed target would reset
+        fk_targets = self._resolve_fk_targets(
+            (
+                (f"{model.schema.upper()}.{model.name.upper()}", column)
+                for model in (all_models if all_models is not None else models)
+                for column in model.columns
+            ),
+            field_lookup,
+            aliases,
+        )
+        self._promote_fk_targets(fk_targets, writes)
+
+        if journal and not plan_path:
+            journal.start(journal.fingerprint(self.host, database, *models))
+
+        found = True
+
+        if self.concurrency == 1:
+            for model in models:
+                if self.export_model(
+                    model,
+                    table_lookup,
+                    field_lookup,
+                    aliases,
+                    writes=writes,
+                    fk_targets=fk_targets,
+                ):
+                    if exported is not None:
+                        exported.append(model)
+                else:
+                    found = False
+            if plan_path:
+                self._save_plan(plan_path, database, writes)
+                return found
+
+            self._invalidate_metadata(database_id, writes)
+            try:
+                self._flush_writes(writes, journal=journal)
+            except Exception as error:  # pylint: disable=broad-except
+                logging.critical("Failed to write to Metabase: %s", error)
+                if exported is not None:
+                    exported.clear()
+                return False
+            return found
+
+        errors: List[Tuple[str, Exception]] = []
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="dbtmetabase"
+        ) as executor:
+            futures = [
+                (
+                    model,
+                    executor.submit(
+                        self.export_model,
+                        model,
+                        table_lookup,
+                        field_lookup,
+                        aliases,
+                        errors,
+                        writes,
+                        fk_targets,
+                    ),
+                )
+                for model in models
+            ]
+            for model, future in futures:
+                try:
+                    if not future.result():
+                        found = False
+                    elif exported is not None:
+                        exported.append(model)
+                except Exception as error:  # pylint: disable=broad-except
+                    errors.append(
+                        (f"{model.schema.upper()}.{model.name.upper()}", error)
+                    )
+
+        if plan_path:
+            self._save_plan(plan_path, database, writes)
+        else:
+            self._invalidate_metadata(database_id, writes)
+            self._flush_writes(writes, errors, journal)
+
+        for key, failure in errors:
+            logging.error("Failed to export %s: %s", key, failure)
+        if errors:
+            logging.critical(
+                "Export finished with %d failures out of %d models",
+                len(errors),
+                len(models),
+            )
+            if exported is not None:
+                exported.clear()
+        return found and not errors
+
+    def apply_plan(
+        self, plan_path: str, journal: Optional[ExportJournal] = None
+    ) -> bool:
+        """Sends changes from a plan written by export_models() to Metabase.
+
+        The plan is applied as is, models are neither read nor compared again.
+
+        Arguments:
+            plan_path {str} -- Path to JSON plan.
+
+        Keyword Arguments:
+            journal {ExportJournal} -- Records completed writes, resuming a previous run of the same plan. (default: {None})
+
+        Returns:
+            bool -- True if all changes were applied, false otherwise.
+        """
+
+        with open(os.path.expanduser(plan_path), "r", encoding="utf-8") as plan_file:
+            plan = json.load(plan_file)
+
+        if plan["host"] != self.host:
+            logging.critical(
+                "Plan was computed against %s, refusing to apply it to %s",
+                plan["host"],
+                self.host,
+            )
+            return False
+
+        logging.info(
+            "Applying plan for database %s computed at %s",
+            plan["database"],
+            plan["created_at"],
+        )
+        writes = _WriteBuffer.from_plan(plan["updates"])
+
+        if journal:
+            journal.start(journal.fingerprint(self.host, plan))
+
+        # The plan only names the database, drop cached metadata of all of them
+        if self.metadata_cache:
+            self.metadata_cache.invalidate(self.host)
+
+        errors: Optional[List[Tuple[str, Exception]]] = (
+            [] if self.concurrency > 1 else None
         )
+        self._flush_writes(writes, errors, journal)
+        for key, failure in errors or []:
+            logging.error("Failed to export %s: %s", key, failure)
+        return not errors
+
+    def _save_plan(self, plan_path: str, database: str, writes: _WriteBuffer):
+        """Writes pending changes to a JSON plan instead of Metabase.
+
+        Arguments:
+            plan_path {str} -- Path to JSON plan.
+            database {str} -- Metabase database name.
+            writes {_WriteBuffer} -- Updates gathered during the export.
+        """
+
+        updates = writes.to_plan()
+        with open(os.path.expanduser(plan_path), "w", encoding="utf-8") as plan_file:
+            json.dump(
+                {
+                    "host": self.host,
+                    "database": database,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "updates": updates,
+                },
+                plan_file,
+                indent=2,
+            )
+        logging.info("Planned %d updates to Metabase in %s", len(updates), plan_path)
+
+    def _flush_writes(
+        self,
+        writes: _WriteBuffer,
+        errors: Optional[List[Tuple[str, Exception]]] = None,
+        journal: Optional[ExportJournal] = None,
+    ):
+        """Sends one PUT per table or field changed by an export.
+
+        Arguments:
+            writes {_WriteBuffer} -- Updates gathered during the export.
+
+        Keyword Arguments:
+            errors {list} -- Collects failures and sends in parallel instead of raising when provided. (default: {None})
+            journal {ExportJournal} -- Skips writes completed by a previous run and records new ones. (default: {None})
+        """
+
+        def write(kind: str, object_id: int, label: str, update: Mapping):
+            self.api("put", f"/api/{kind}/{object_id}", json=update)
+            if journal:
+                journal.record(kind, object_id)
+            logging.info("Updated %s %s successfully", kind, label)
+
+        pending = writes.pending()
+        if journal:
+            pending = [
+                (kind, object_id, label, update)
+                for kind, object_id, label, update in pending
+                if not journal.done(kind, object_id)
+            ]
+        logging.info("Writing %d updates to Metabase", len(pending))
+
+        if errors is None:
+            for kind, object_id, label, update in pending:
+                write(kind, object_id, label, update)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="dbtmetabase"
+        ) as executor:
+            futures = [
+                (label, executor.submit(write, kind, object_id, label, update))
+                for kind, object_id, label, update in pending
+            ]
+            for label, future in futures:
+                try:
+                    future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    errors.append((label, error))
+
+    def export_model(
+        self,
+        model: MetabaseModel,
+        table_lookup: dict,
+        field_lookup: dict,
+        aliases: dict,
+        errors: Optional[List[Tuple[str, Exception]]] = None,
+        writes: Optional[_WriteBuffer] = None,
+        fk_targets: Optional[_FkTargets] = None,
+    ) -> bool:
+        """Exports one dbt model to Metabase database schema.
+
+        Arguments:
+            model {dict} -- One dbt model read from project.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            errors {list} -- Collects column export failures instead of raising when provided. (default: {None})
+            writes {_WriteBuffer} -- Gathers updates to be sent later, sent immediately when not provided. (default: {None})
+            fk_targets {_FkTargets} -- FK targets resolved for all exported models, resolved for this model when not provided. (default: {None})
+
+        Returns:
+            bool -- True if the table and all columns exist in Metabase, false otherwise.
+        """
+
+        flush = writes is None
+        if writes is None:
+            writes = _WriteBuffer()
+
+        schema_name = model.schema.upper()
+        model_name = model.name.upper()
+
+        if fk_targets is None:
+            fk_targets = self._resolve_fk_targets(
+                ((f"{schema_name}.{model_name}", column) for column in model.columns),
+                field_lookup,
+                aliases,
+            )
+            self._promote_fk_targets(fk_targets, writes)
+
+        lookup_key = f"{schema_name}.{aliases.get(model_name, model_name)}"
+
+        api_table = table_lookup.get(lookup_key)
+        if not api_table:
+            logging.error("Table %s does not exist in Metabase", lookup_key)
+            return False
+
+        table_update = self._table_update(lookup_key, model, api_table)
+        if table_update:
+            writes.add("table", lookup_key, api_table, table_update)
+
+        found = True
+        for column in model.columns:
+            try:
+                found &= self.export_column(
+                    schema_name,
+                    model_name,
+                    column,
+                    field_lookup,
+                    aliases,
+                    writes,
+                    fk_targets,
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                if errors is None:
+                    raise
+                errors.append((f"{lookup_key}.{column.name.upper()}", error))
+
+        if flush:
+            self._flush_writes(writes, errors)
+        return found
+
+    def export_column(
+        self,
+        schema_name: str,
+        model_name: str,
+        column: MetabaseColumn,
+        field_lookup: dict,
+        aliases: dict,
+        writes: Optional[_WriteBuffer] = None,
+        fk_targets: Optional[_FkTargets] = None,
+    ) -> bool:
+        """Exports one dbt column to Metabase database schema.
+
+        Arguments:
+            model_name {str} -- One dbt model name read from project.
+            column {dict} -- One dbt column read from project.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Used to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            writes {_WriteBuffer} -- Gathers updates to be sent later, sent immediately when not provided. (default: {None})
+            fk_targets {_FkTargets} -- FK targets resolved for all exported models, resolved for this column when not provided. (default: {None})
+
+        Returns:
+            bool -- True if the field exists in Metabase, false otherwise.
+        """
+
+        flush = writes is None
+        if writes is None:
+            writes = _WriteBuffer()
+
+        table_lookup_key = f"{schema_name}.{model_name}"
+        column_name = column.name.upper()
+
+        if fk_targets is None:
+            fk_targets = self._resolve_fk_targets(
+                [(table_lookup_key, column)], field_lookup, aliases
+            )
+            self._promote_fk_targets(fk_targets, writes)
+
+        field = field_lookup.get(table_lookup_key, {}).get(column_name)
+        if not field:
+            logging.error(
+                "Field %s.%s does not exist in Metabase", table_lookup_key, column_name
+            )
+            return False
+
+        field_id = field["id"]
+
+        # Diff against the metadata snapshot, only fetch the field if it lacks attributes
+        if not self._is_field_complete(field):
+            field.update(self.api("get", f"/api/field/{field_id}"))
+
+        self._diff_column(
+            table_lookup_key, model_name, column, field, fk_targets, writes
+        )
+
+        if flush:
+            self._flush_writes(writes)
+        return True
+
+    def find_database_id(self, name: str) -> Optional[str]:
+        """Finds Metabase database ID by name.
+
+        Arguments:
+            name {str} -- Metabase database name.
+
+        Returns:
+            str -- Metabase database ID.
+        """
+
+        database_id = self.database_ids.get(name.upper())
+        if database_id is None:
+            database_id = self._match_database_id(
+                self.api("get", "/api/database"), name
+            )
+            if database_id is not None:
+                self.database_ids[name.upper()] = database_id
+        return database_id
+
+    def build_metadata_lookups(
+        self,
+        database_id: str,
+        schemas_to_exclude: Iterable = None,
+        cached: bool = True,
+    ) -> Tuple[dict, dict]:
+        """Builds table and field lookups.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+
+        Keyword Arguments:
+            cached {bool} -- Use the metadata cache of the client, if any. (default: {True})
+
+        Returns:
+            dict -- Dictionary of tables indexed by name.
+            dict -- Dictionary of fields indexed by name, indexed by table name.
+        """
+
+        metadata: Optional[Mapping] = None
+        if self.metadata_cache and cached:
+            fingerprint = self._metadata_fingerprint(
+                self.api(
+                    "get", f"/api/database/{database_id}", params={"include": "tables"}
+                )
+            )
+            metadata = self.metadata_cache.get(self.host, database_id, fingerprint)
+
+        if metadata is None:
+            fetched = self.api(
+                "get",
+                f"/api/database/{database_id}/metadata",
+                params=dict(include_hidden=True),
+            )
+            if self.metadata_cache and cached:
+                self.metadata_cache.put(self.host, database_id, fingerprint, fetched)
+            metadata = fetched
+
+        return self._index_metadata(metadata, schemas_to_exclude)
+
+    def extract_exposures(
+        self,
+        models: List[MetabaseModel],
+        output_path: str = ".",
+        output_name: str = "metabase_exposures",
+        include_personal_collections: bool = True,
+        collection_excludes: Iterable = None,
+        bulk_cards: bool = False,
+        state: Optional[ExposureState] = None,
+        sql_processes: int = 1,
+        match_models: bool = False,
+    ) -> Mapping:
+        """Extracts exposures in Metabase downstream of dbt models and sources as parsed by dbt reader
+
+        Exposures are written to YAML as they are resolved, but also kept in memory to be
+        returned. Use iter_exposures to write or process them without keeping them.
+
+        Arguments:
+            models {List[MetabaseModel]} -- List of models as output by dbt reader
+
+        Keyword Arguments:
+            output_path {str} -- The path to output the generated yaml. (default: ".")
+            output_name {str} -- The name of the generated yaml. (default: {"metabase_exposures"})
+            include_personal_collections {bool} -- Include personal collections in Metabase processing. (default: {True})
+            collection_excludes {str} -- List of collections to exclude by name. (default: {None})
+            bulk_cards {bool} -- List all questions in one request instead of fetching them one by one. (default: {False})
+            state {ExposureState} -- Reuse exposures resolved by a previous run when their cards and dashboards were not edited since. (default: {None})
+            sql_processes {int} -- Parse long native queries in this many processes, 1 to parse them in place. (default: {1})
+            match_models {bool} -- Find models anywhere in native queries, not only after FROM and JOIN. (default: {False})
+
+        Returns:
+            List[Mapping] -- JSON object representation of all exposures parsed.
+        """
+
+        parsed_exposures = []
+
+        with ExposureWriter(output_path, output_name) as writer:
+            for exposure in self.iter_exposures(
+                models,
+                include_personal_collections=include_personal_collections,
+                collection_excludes=collection_excludes,
+                bulk_cards=bulk_cards,
+                state=state,
+                sql_processes=sql_processes,
+                match_models=match_models,
+            ):
+                writer.write(exposure)
+                parsed_exposures.append(exposure)
+
+        return {
+            "version": EXPOSURES_VERSION,
+            "exposures": parsed_exposures,
+        }
+
+    def iter_exposures(
+        self,
+        models: List[MetabaseModel],
+        include_personal_collections: bool = True,
+        collection_excludes: Iterable = None,
+        bulk_cards: bool = False,
+        state: Optional[ExposureState] = None,
+        sql_processes: int = 1,
+        match_models: bool = False,
+    ) -> Iterator[Mapping]:
+        """Generates exposures in Metabase downstream of dbt models and sources as parsed by dbt reader
+
+        Collections, cards and dashboards are fetched in parallel when the client concurrency
+        is above 1, exposures are generated in the same order either way. Unlike
+        extract_exposures, exposures are not kept in memory once consumed.
+
+        Arguments:
+            models {List[MetabaseModel]} -- List of models as output by dbt reader
+
+        Keyword Arguments:
+            include_personal_collections {bool} -- Include personal collections in Metabase processing. (default: {True})
+            collection_excludes {str} -- List of collections to exclude by name. (default: {None})
+            bulk_cards {bool} -- List all questions in one request instead of fetching them one by one. (default: {False})
+            state {ExposureState} -- Reuse exposures resolved by a previous run when their cards and dashboards were not edited since. (default: {None})
+            sql_processes {int} -- Parse long native queries in this many processes, 1 to parse them in place. (default: {1})
+            match_models {bool} -- Find models anywhere in native queries, not only after FROM and JOIN. (default: {False})
+
+        Returns:
+            Iterator[Mapping] -- JSON object representation of each exposure parsed.
+        """
+
+        if collection_excludes is None:
+            collection_excludes = []
+
+        refable_models = {node.name: node.ref for node in models}
+
+        self.collections = self.api("get", "/api/collection")
+        self.tables = self.api("get", "/api/table")
+        self.table_map = {table["id"]: table["name"] for table in self.tables}
+        self._objects = {"card": {}, "user": {}}
+        self._card_lineage = {}
+        self._card_sources = {}
+        self._card_tables = {}
+        self._model_matcher = ModelMatcher(models) if match_models else None
+        self._list_users()
+
+        cards: List[Mapping] = []
+        if bulk_cards:
+            cards = list(self._complete_cards(self.api("get", "/api/card")))
+            for card in cards:
+                self._put_object("card", card)
+            logging.info("Listed %d questions in bulk", len(self._objects["card"]))
+
+        collections = list(
+            self._filter_collections(
+                self.collections, include_personal_collections, collection_excludes
+            )
+        )
+
+        def collection_items(collection: Mapping) -> List[Mapping]:
+            logging.info("Exploring collection %s", collection["name"])
+            return cast(
+                List[Mapping],
+                self.api("get", f"/api/collection/{collection['id']}/items"),
+            )
+
+        if state is not None:
+            state.start(self._exposures_fingerprint())
+
+        def summarize(item: Mapping) -> Optional[Mapping]:
+            exposure_type, exposure_id = item["model"], item["id"]
+            key = f"{exposure_type}/{exposure_id}"
+            if state is not None:
+                summary = state.get(key, edits.get(key), edits, self.table_map)
+                if summary is not None:
+                    return summary
+            resolution = self._resolve_exposure(exposure_type, exposure_id)
+            if resolution is None:
+                return None
+            return self._exposure_summary(
+                exposure_type, exposure_id, resolution, edits, state
+            )
+
+        names = _ExposureNames()
+
+        if sql_processes > 1 and self.concurrency == 1 and not bulk_cards:
+            logging.warning(
+                "Only questions embedded in dashboards are parsed in %d processes, "
+                "use bulk_cards or a concurrency above 1 to parse the others in parallel",
+                sql_processes,
+            )
+
+        with self._parsing_pool(sql_processes), ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="dbtmetabase"
+        ) as executor:
+            # Questions listed in bulk are parsed at once, in chunks
+            self._parse_in_pool(cards)
+
+            # Ensure collection item is of parsable type
+            items = [
+                item
+                for collection_items in executor.map(collection_items, collections)
+                for item in collection_items
+                if item["model"] in ("card", "dashboard")
+            ]
+            edits = {
+                f"{item['model']}/{item['id']}": self._edited_at(item) for item in items
+            }
+
+            for item, summary in zip(items, executor.map(summarize, items)):
+                if summary is not None:
+                    yield self._exposure_from(
+                        item["model"], item["id"], summary, refable_models, names
+                    )
+
+        if state is not None:
+            state.save()
+
+    def _resolve_exposure(
+        self, exposure_type: str, exposure_id: int
+    ) -> Optional[Tuple[Mapping, List[str], str, Mapping]]:
+        """Fetches one card or dashboard and extracts the models it exposes.
+
+        Arguments:
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure_id {int} -- Card or Dashboard id in Metabase
+
+        Returns:
+            Mapping -- JSON api response of the card or dashboard.
+            List[str] -- Names of models exposed.
+            str -- Native query of the card, if any.
+            Mapping -- Creator of the card or dashboard.
+        """
+
+        if exposure_type == "card":
+            exposure = self._get_object("card", exposure_id)
+        else:
+            exposure = self.api("get", f"/api/{exposure_type}/{exposure_id}")
+        logging.info(
+            "Introspecting exposure: %s",
+            exposure.get("name", "Exposure [Unresolved Name]"),
+        )
+
+        models_exposed: List[str] = []
+        native_query = ""
+
+        if exposure_type == "card":
+            # Parse Metabase question
+            models_exposed, native_query = self._extract_card_exposures(
+                exposure_id, exposure
+            )
+        else:
+            # We expect this dict key in order to iter through questions
+            if "ordered_cards" not in exposure:
+                return None
+
+            # Questions embedded in the dashboard are parsed at once, in chunks
+            dashboard_cards = list(self._dashboard_cards(exposure))
+            self._parse_in_pool(card for _, card in dashboard_cards if card)
+
+            # Iterate through dashboard questions
+            for card_id, card in dashboard_cards:
+                card_models, _ = self._extract_card_exposures(card_id, card)
+                models_exposed.extend(card_models)
+
+        # Extract creator info
+        creator: Mapping = {}
+        if "creator" in exposure:
+            creator = exposure["creator"]
+        elif "creator_id" in exposure:
+            creator = self._get_object("user", exposure["creator_id"])
+
+        return exposure, models_exposed, native_query, creator
+
+    def _list_users(self):
+        """Indexes all Metabase users, so that exposure creators are not fetched one by one.
+
+        Deactivated users are only listed by admins, others fall back to active users.
+        When users cannot be listed at all, they are fetched one by one instead.
+        """
+
+        for status in ("all", "active"):
+            users: MutableMapping[int, Mapping] = {}
+            while True:
+                page = self.api(
+                    "get",
+                    "/api/user",
+                    critical=False,
+                    params={
+                        "status": status,
+                        "limit": self._USER_PAGE_SIZE,
+                        "offset": len(users),
+                    },
+                )
+                if not isinstance(page, list):
+                    break
+                listed = len(users)
+                users.update((user["id"], user) for user in page)
+                # Versions without pagination return all users on every page
+                if len(page) < self._USER_PAGE_SIZE or len(users) == listed:
+                    for user in users.values():
+                        self._put_object("user", user)
+                    logging.info("Listed %d users", len(users))
+                    return
+            logging.info("Users with status %s cannot be listed", status)
+
+    def _get_object(self, kind: str, object_id: int) -> Mapping:
+        """Fetches one Metabase question or user, only once even when requested by several threads.
+
+        Arguments:
+            kind {str} -- Metabase object kind, card or user.
+            object_id {int} -- Metabase object ID.
+
+        Returns:
+            Mapping -- JSON api response of the object.
+        """
+
+        with self._objects_lock:
+            cached: Optional[Future] = self._objects[kind].get(object_id)
+            fetch = cached is None
+            if cached is None:
+                cached = self._objects[kind][object_id] = Future()
+            future: Future = cached
+
+        if fetch:
+            try:
+                future.set_result(self.api("get", f"/api/{kind}/{object_id}"))
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+
+        return future.result()
+
+    def _put_object(self, kind: str, api_object: Mapping):
+        """Caches a Metabase question or user already in memory, so it is not fetched again.
+
+        Arguments:
+            kind {str} -- Metabase object kind, card or user.
+            api_object {dict} -- JSON api response of the object.
+        """
+
+        with self._objects_lock:
+            if api_object["id"] not in self._objects[kind]:
+                future: Future = Future()
+                future.set_result(api_object)
+                self._objects[kind][api_object["id"]] = future
+
+    def _extract_card_exposures(
+        self,
+        card_id: int,
+        exposure: Optional[Mapping] = None,
+        visiting: Tuple[int, ...] = (),
+        cut: Optional[Set[int]] = None,
+    ) -> Tuple[List[str], str]:
+        """Extracts exposures from Metabase questions, resolving each question once per run
+
+        Arguments:
+            card_id {int} -- Id of Metabase question used to pull question from api
+
+        Keyword Arguments:
+            exposure {str} -- JSON api response from a question in Metabase, allows us to use the object if already in memory
+            visiting {tuple} -- Ids of questions being resolved down to this one, used to break cycles. (default: {()})
+            cut {set} -- Collects ids of questions in visiting at which a cycle was broken. (default: {None})
+
+        Returns:
+            List[str] -- Names of models exposed by the question and the questions it is based on.
+            str -- Last native query found in the question or the questions it is based on.
+        """
+
+        lineage = self._card_lineage.get(card_id)
+        if lineage is None:
+            if card_id in visiting:
+                logging.warning("Question %s is based on itself, skipping", card_id)
+                if cut is not None:
+                    cut.add(card_id)
+                return [], ""
+
+            # If an exposure is not passed, pull from id. Questions embedded in
+            # dashboards lack their creator, so they are not cached for reuse.
+            if not exposure:
+                exposure = self._get_object("card", card_id)
+
+            # A lone query only gains from the pool while other threads keep it busy
+            if self.concurrency > 1:
+                self._parse_in_pool([exposure])
+            (
+                models_exposed,
+                source_card_ids,
+                self._card_tables[card_id],
+                native_query,
+            ) = self._parse_card(exposure)
+            self._card_sources[card_id] = source_card_ids
+
+            # Handle questions based on other question in virtual db
+            source_cut: Set[int] = set()
+            for source_card_id in source_card_ids:
+                source_models, source_native_query = self._extract_card_exposures(
+                    source_card_id, visiting=visiting + (card_id,), cut=source_cut
+                )
+                models_exposed.extend(source_models)
+                if source_native_query:
+                    native_query = source_native_query
+
+            # Lineage misses the questions of a cycle broken above this one, it is
+            # only complete once resolved from the first question of the cycle
+            source_cut.discard(card_id)
+            if source_cut:
+                if cut is not None:
+                    cut.update(source_cut)
+                return models_exposed, native_query
+
+            lineage = self._card_lineage[card_id] = (models_exposed, native_query)
+
+        return list(lineage[0]), lineage[1]
+
+    def api(
+        self,
+        method: str,
+        path: str,
+        authenticated: bool = True,
+        critical: bool = True,
+        **kwargs,
+    ) -> Mapping:
+        """Unified way of calling Metabase API.
+
+        Arguments:
+            method {str} -- HTTP verb, e.g. get, post, put.
+            path {str} -- Relative path of endpoint, e.g. /api/database.
+
+        Keyword Arguments:
+            authenticated {bool} -- Includes session ID when true. (default: {True})
+            critical {bool} -- Raise on any HTTP errors. (default: {True})
+
+        Returns:
+            Any -- JSON payload of the endpoint.
+        """
+
+        headers: MutableMapping = {}
+        if "headers" not in kwargs:
+            kwargs["headers"] = headers
+        else:
+            headers = kwargs["headers"].copy()
+
+        if authenticated:
+            headers["X-Metabase-Session"] = self.session_id
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(
+                    method,
+                    f"{self.protocol}://{self.host}{path}",
+                    verify=self.verify,
+                    timeout=self._request_timeouts(),
+                    **kwargs,
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as error:
+                delay = self._retry_delay(method, attempt)
+                if delay is None:
+                    raise
+                logging.warning(
+                    "HTTP request %s %s failed (%s), retrying in %.1f secs",
+                    method.upper(),
+                    path,
+                    error,
+                    delay,
+                )
+            else:
+                delay = self._retry_delay(
+                    method,
+                    attempt,
+                    status=response.status_code,
+                    retry_after=response.headers.get("Retry-After"),
+                )
+                if delay is None:
+                    break
+                logging.warning(
+                    "HTTP request %s %s returned %d, retrying in %.1f secs",
+                    method.upper(),
+                    path,
+                    response.status_code,
+                    delay,
+                )
+            time.sleep(delay)
+            attempt += 1
 
         if critical:
             try:
                 response.raise_for_status()
             except requests.exceptions.HTTPError:
-                if "password" in kwargs["json"]:
+                if "password" in (kwargs.get("json") or {}):
                     logging.error("HTTP request failed. Response: %s", response.text)
                 else:
                     logging.error(
                         "HTTP request failed. Payload: %s. Response: %s",
-                        kwargs["json"],
+                        kwargs.get("json"),
                         response.text,
                     )
                 raise
@@ -0,0 +1,1085 @@
+import asyncio
+import json
+import logging
+import ssl
+from typing import (
+    Sequence,
+    Optional,
+    Tuple,
+    Iterable,
+    MutableMapping,
+    Union,
+    List,
+    Mapping,
+    Set,
+    AsyncIterator,
+)
+
+import aiohttp
+
+from .metabase import (
+    EXPOSURES_VERSION,
+    ExposureWriter,
+    _ExposureNames,
+    _FkTargets,
+    _MetabaseClientBase,
+    _WriteBuffer,
+)
+from .parsers.sql import ModelMatcher
+from .state import ExportJournal, ExposureState, MetadataCache
+from .models.metabase import MetabaseModel, MetabaseColumn
+
+
+class AsyncMetabaseClient(_MetabaseClientBase):
+    """Asyncio Metabase API client.
+
+    Mirrors the public surface of MetabaseClient with coroutines. The session is
+    established when entering the client as an async context manager:
+
+        async with AsyncMetabaseClient(host, user, password) as mbc:
+            await mbc.export_models(database, models, aliases)
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        use_http: bool = False,
+        verify: Union[str, bool] = None,
+        http_connect_timeout: Optional[float] = 10,
+        http_read_timeout: Optional[float] = 120,
+        http_retries: int = 3,
+        run_timeout: Optional[float] = None,
+        concurrency: int = 10,
+        metadata_cache: Optional[MetadataCache] = None,
+    ):
+        """Constructor.
+
+        Arguments:
+            host {str} -- Metabase hostname.
+            user {str} -- Metabase username.
+            password {str} -- Metabase password.
+
+        Keyword Arguments:
+            use_http {bool} -- Use HTTP instead of HTTPS. (default: {False})
+            verify {Union[str, bool]} -- Path to certificate or disable verification. (default: {None})
+            http_connect_timeout {float} -- Seconds to wait for a connection, None waits forever. (default: {10})
+            http_read_timeout {float} -- Seconds to wait for a response, None waits forever. (default: {120})
+            http_retries {int} -- Retries of failed idempotent requests. (default: {3})
+            run_timeout {float} -- Seconds after which all requests are abandoned, None for no deadline. (default: {None})
+            concurrency {int} -- Maximum number of requests in flight. (default: {10})
+            metadata_cache {MetadataCache} -- Keeps database metadata on disk between runs. (default: {None})
+        """
+
+        super().__init__(
+            host,
+            use_http=use_http,
+            verify=verify,
+            http_connect_timeout=http_connect_timeout,
+            http_read_timeout=http_read_timeout,
+            http_retries=http_retries,
+            run_timeout=run_timeout,
+            metadata_cache=metadata_cache,
+        )
+        self.concurrency = max(concurrency, 1)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.session_id: Optional[str] = None
+        self._credentials = (user, password)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncMetabaseClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """Opens pooled HTTP connections to Metabase and establishes the session."""
+
+        # Created here rather than in the constructor to bind to the running loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ssl=self._ssl())
+        )
+        self.session_id = await self.get_session_id(*self._credentials)
+        logging.info("Session established successfully")
+
+    async def close(self):
+        """Closes pooled HTTP connections to Metabase."""
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self._report_retries()
+
+    def _ssl(self) -> Union[ssl.SSLContext, bool]:
+        """Translates certificate verification setting for aiohttp.
+
+        Returns:
+            Union[ssl.SSLContext, bool] -- SSL context, or False to disable verification.
+        """
+
+        if self.verify is False:
+            return False
+        if isinstance(self.verify, str):
+            return ssl.create_default_context(cafile=self.verify)
+        return True
+
+    async def get_session_id(self, user: str, password: str) -> str:
+        """Obtains new session ID from API.
+
+        Arguments:
+            user {str} -- Metabase username.
+            password {str} -- Metabase password.
+
+        Returns:
+            str -- Session ID.
+        """
+
+        response = await self.api(
+            "post",
+            "/api/session",
+            authenticated=False,
+            json={"username": user, "password": password},
+        )
+        return response["id"]
+
+    async def sync_and_wait(
+        self,
+        database: str,
+        models: Sequence,
+        timeout: Optional[int],
+        tables_only: bool = False,
+    ) -> bool:
+        """Synchronize with the database and wait for schema compatibility.
+
+        Arguments:
+            database {str} -- Metabase database name.
+            models {list} -- List of dbt models read from project.
+
+        Keyword Arguments:
+            timeout {int} -- Timeout before giving up in seconds. (default: {30})
+            tables_only {bool} -- Only synchronize tables backing the models, see _sync_tables(). (default: {False})
+
+        Returns:
+            bool -- True if schema compatible with models, false if still incompatible.
+        """
+        if timeout is None:
+            timeout = 30
+
+        if timeout < self._SYNC_PERIOD_SECS:
+            logging.critical(
+                "Timeout provided %d secs, must be at least %d",
+                timeout,
+                self._SYNC_PERIOD_SECS,
+            )
+            return False
+
+        database_id = await self.find_database_id(database)
+        if not database_id:
+            logging.critical("Cannot find database by name %s", database)
+            return False
+
+        if not tables_only:
+            await self.api("post", f"/api/database/{database_id}/sync_schema")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        # Download metadata once, then only poll tables of models still missing
+        table_lookup, field_lookup = await self.build_metadata_lookups(
+            database_id, cached=False
+        )
+        if tables_only:
+            await self._sync_tables(database_id, models, table_lookup)
+        missing = self._missing_models(field_lookup, models)
+        delay = self._SYNC_BACKOFF_SECS
+        while missing and loop.time() < deadline:
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            delay = min(delay * 2, self._SYNC_BACKOFF_MAX_SECS)
+            await self._refresh_tables(database_id, missing, table_lookup, field_lookup)
+            missing = self._missing_models(field_lookup, missing)
+
+        return self._check_models(field_lookup, models)
+
+    async def _sync_tables(
+        self, database_id: str, models: Sequence, table_lookup: Mapping
+    ):
+        """Synchronizes only the tables backing some models, concurrently.
+
+        Falls back to synchronizing the whole database when some tables are not in
+        Metabase yet, or when this Metabase version cannot synchronize single tables.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models read from project.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
+        """
+
+        new_tables = self._missing_table_keys(table_lookup, models)
+        if new_tables:
+            logging.info(
+                "Tables %s not in Metabase yet, synchronizing database",
+                ", ".join(new_tables),
+            )
+            await self.api("post", f"/api/database/{database_id}/sync_schema")
+            return
+
+        results = await asyncio.gather(
+            *(
+                self.api("post", f"/api/table/{table_id}/sync_schema", critical=False)
+                for table_id in self._model_table_ids(table_lookup, models)
+            )
+        )
+        if not all(results):
+            logging.info(
+                "Metabase cannot synchronize single tables, synchronizing database"
+            )
+            await self.api("post", f"/api/database/{database_id}/sync_schema")
+
+    async def _refresh_tables(
+        self,
+        database_id: str,
+        models: Sequence,
+        table_lookup: MutableMapping,
+        field_lookup: MutableMapping,
+    ):
+        """Downloads metadata of the tables backing some models only, concurrently.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models to refresh.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name, updated in place.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name, updated in place.
+        """
+
+        if self._missing_table_keys(table_lookup, models):
+            # Tables are listed without their fields to learn IDs of new ones
+            new_tables, _ = self._index_metadata(
+                await self.api(
+                    "get", f"/api/database/{database_id}", params={"include": "tables"}
+                )
+            )
+            table_lookup.update(new_tables)
+
+        tables = await asyncio.gather(
+            *(
+                self.api(
+                    "get",
+                    f"/api/table/{table_id}/query_metadata",
+                    params=dict(include_hidden_fields=True),
+                )
+                for table_id in self._model_table_ids(table_lookup, models)
+            )
+        )
+        _, fields = self._index_metadata({"tables": tables})
+        field_lookup.update(fields)
+
+    async def models_compatible(self, database_id: str, models: Sequence) -> bool:
+        """Checks if models compatible with the Metabase database schema.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+            models {list} -- List of dbt models read from project.
+
+        Returns:
+            bool -- True if schema compatible with models, false otherwise.
+        """
+
+        # Sync is in progress, the cached metadata is about to change
+        _, field_lookup = await self.build_metadata_lookups(database_id, cached=False)
+        return self._check_models(field_lookup, models)
+
+    async def export_models(
+        self,
+        database: str,
+        models: Sequence[MetabaseModel],
+        aliases,
+        journal: Optional[ExportJournal] = None,
+        all_models: Optional[Sequence[MetabaseModel]] = None,
+        exported: Optional[List[MetabaseModel]] = None,
+    ) -> bool:
+        """Exports dbt models to Metabase database schema.
+
+        Models are exported concurrently, failures are collected and reported at the end.
+
+        Arguments:
+            database {str} -- Metabase database name.
+            models {list} -- List of dbt models read from project.
+            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            journal {ExportJournal} -- Records completed writes, resuming a previous run of the same export. (default: {None})
+            all_models {list} -- All dbt models read from project, FK targets are resolved across them so that targets of models not exported stay PK. (default: {models})
+            exported {list} -- Collects models whose table and columns were all found in Metabase, emptied if any write failed. (default: {None})
+
+        Returns:
+            bool -- True if all models were found in Metabase and exported, false otherwise.
+        """
+
+        database_id = await self.find_database_id(database)
+        if not database_id:
+            logging.critical("Cannot find database by name %s", database)
+            return False
+
+        table_lookup, field_lookup = await self.build_metadata_lookups(database_id)
+
+        writes = _WriteBuffer()
+
+        # Resolve FK targets up front so each one is promoted to PK exactly once,
+        # including targets of unchanged models, which only the changed target would reset
+        fk_targets = self._resolve_fk_targets(
+            (
+                (f"{model.schema.upper()}.{model.name.upper()}", column)
+                for model in (all_models if all_models is not None else models)
+                for column in model.columns
+            ),
+            field_lookup,
+            aliases,
+        )
+        self._promote_fk_targets(fk_targets, writes)
+
+        if journal:
+            journal.start(journal.fingerprint(self.host, database, *models))
+
+        errors: List[Tuple[str, BaseException]] = []
+        results = await asyncio.gather(
+            *(
+                self.export_model(
+                    model,
+                    table_lookup,
+                    field_lookup,
+                    aliases,
+                    errors,
+                    writes,
+                    fk_targets,
+                )
+                for model in models
+            ),
+            return_exceptions=True,
+        )
+        found = True
+        for model, result in zip(models, results):
+            if isinstance(result, BaseException):
+                errors.append((f"{model.schema.upper()}.{model.name.upper()}", result))
+            elif not result:
+                found = False
+            elif exported is not None:
+                exported.append(model)
+
+        self._invalidate_metadata(database_id, writes)
+        await self._flush_writes(writes, errors, journal)
+
+        for key, failure in errors:
+            logging.error("Failed to export %s: %s", key, failure)
+        if errors:
+            logging.critical(
+                "Export finished with %d failures out of %d models",
+                len(errors),
+                len(models),
+            )
+            if exported is not None:
+                exported.clear()
+        return found and not errors
+
+    async def _flush_writes(
+        self,
+        writes: _WriteBuffer,
+        errors: Optional[List[Tuple[str, BaseException]]] = None,
+        journal: Optional[ExportJournal] = None,
+    ):
+        """Sends one PUT per table or field changed by an export, concurrently.
+
+        Arguments:
+            writes {_WriteBuffer} -- Updates gathered during the export.
+
+        Keyword Arguments:
+            errors {list} -- Collects failures instead of raising when provided. (default: {None})
+            journal {ExportJournal} -- Skips writes completed by a previous run and records new ones. (default: {None})
+        """
+
+        async def write(kind: str, object_id: int, label: str, update: Mapping):
+            await self.api("put", f"/api/{kind}/{object_id}", json=update)
+            if journal:
+                journal.record(kind, object_id)
+            logging.info("Updated %s %s successfully", kind, label)
+
+        pending = writes.pending()
+        if journal:
+            pending = [
+                (kind, object_id, label, update)
+                for kind, object_id, label, update in pending
+                if not journal.done(kind, object_id)
+            ]
+        logging.info("Writing %d updates to Metabase", len(pending))
+
+        results = await asyncio.gather(
+            *(write(*args) for args in pending), return_exceptions=errors is not None
+        )
+        for (_, _, label, _), result in zip(pending, results):
+            if isinstance(result, BaseException) and errors is not None:
+                errors.append((label, result))
+
+    async def export_model(
+        self,
+        model: MetabaseModel,
+        table_lookup: dict,
+        field_lookup: dict,
+        aliases: dict,
+        errors: Optional[List[Tuple[str, BaseException]]] = None,
+        writes: Optional[_WriteBuffer] = None,
+        fk_targets: Optional[_FkTargets] = None,
+    ) -> bool:
+        """Exports one dbt model to Metabase database schema.
+
+        Arguments:
+            model {dict} -- One dbt model read from project.
+            table_lookup {dict} -- Dictionary of Metabase tables indexed by name.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Shuttled down to column exports to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            errors {list} -- Collects column export failures instead of raising when provided. (default: {None})
+            writes {_WriteBuffer} -- Gathers updates to be sent later, sent immediately when not provided. (default: {None})
+            fk_targets {_FkTargets} -- FK targets resolved for all exported models, resolved for this model when not provided. (default: {None})
+
+        Returns:
+            bool -- True if the table and all columns exist in Metabase, false otherwise.
+        """
+
+        flush = writes is None
+        if writes is None:
+            writes = _WriteBuffer()
+
+        schema_name = model.schema.upper()
+        model_name = model.name.upper()
+
+        if fk_targets is None:
+            fk_targets = self._resolve_fk_targets(
+                ((f"{schema_name}.{model_name}", column) for column in model.columns),
+                field_lookup,
+                aliases,
+            )
+            self._promote_fk_targets(fk_targets, writes)
+
+        lookup_key = f"{schema_name}.{aliases.get(model_name, model_name)}"
+
+        api_table = table_lookup.get(lookup_key)
+        if not api_table:
+            logging.error("Table %s does not exist in Metabase", lookup_key)
+            return False
+
+        table_update = self._table_update(lookup_key, model, api_table)
+        if table_update:
+            writes.add("table", lookup_key, api_table, table_update)
+
+        found = True
+        for column in model.columns:
+            try:
+                found &= await self.export_column(
+                    schema_name,
+                    model_name,
+                    column,
+                    field_lookup,
+                    aliases,
+                    writes,
+                    fk_targets,
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                if errors is None:
+                    raise
+                errors.append((f"{lookup_key}.{column.name.upper()}", error))
+
+        if flush:
+            await self._flush_writes(writes, errors)
+        return found
+
+    async def export_column(
+        self,
+        schema_name: str,
+        model_name: str,
+        column: MetabaseColumn,
+        field_lookup: dict,
+        aliases: dict,
+        writes: Optional[_WriteBuffer] = None,
+        fk_targets: Optional[_FkTargets] = None,
+    ) -> bool:
+        """Exports one dbt column to Metabase database schema.
+
+        Arguments:
+            model_name {str} -- One dbt model name read from project.
+            column {dict} -- One dbt column read from project.
+            field_lookup {dict} -- Dictionary of Metabase fields indexed by name, indexed by table name.
+            aliases {dict} -- Provided by reader class. Used to resolve FK refs against relations to aliased source tables
+
+        Keyword Arguments:
+            writes {_WriteBuffer} -- Gathers updates to be sent later, sent immediately when not provided. (default: {None})
+            fk_targets {_FkTargets} -- FK targets resolved for all exported models, resolved for this column when not provided. (default: {None})
+
+        Returns:
+            bool -- True if the field exists in Metabase, false otherwise.
+        """
+
+        flush = writes is None
+        if writes is None:
+            writes = _WriteBuffer()
+
+        table_lookup_key = f"{schema_name}.{model_name}"
+        column_name = column.name.upper()
+
+        if fk_targets is None:
+            fk_targets = self._resolve_fk_targets(
+                [(table_lookup_key, column)], field_lookup, aliases
+            )
+            self._promote_fk_targets(fk_targets, writes)
+
+        field = field_lookup.get(table_lookup_key, {}).get(column_name)
+        if not field:
+            logging.error(
+                "Field %s.%s does not exist in Metabase", table_lookup_key, column_name
+            )
+            return False
+
+        field_id = field["id"]
+
+        # Diff against the metadata snapshot, only fetch the field if it lacks attributes
+        if not self._is_field_complete(field):
+            field.update(await self.api("get", f"/api/field/{field_id}"))
+
+        self._diff_column(
+            table_lookup_key, model_name, column, field, fk_targets, writes
+        )
+
+        if flush:
+            await self._flush_writes(writes)
+        return True
+
+    async def find_database_id(self, name: str) -> Optional[str]:
+        """Finds Metabase database ID by name.
+
+        Arguments:
+            name {str} -- Metabase database name.
+
+        Returns:
+            str -- Metabase database ID.
+        """
+
+        database_id = self.database_ids.get(name.upper())
+        if database_id is None:
+            database_id = self._match_database_id(
+                await self.api("get", "/api/database"), name
+            )
+            if database_id is not None:
+                self.database_ids[name.upper()] = database_id
+        return database_id
+
+    async def build_metadata_lookups(
+        self,
+        database_id: str,
+        schemas_to_exclude: Iterable = None,
+        cached: bool = True,
+    ) -> Tuple[dict, dict]:
+        """Builds table and field lookups.
+
+        Arguments:
+            database_id {str} -- Metabase database ID.
+
+        Keyword Arguments:
+            cached {bool} -- Use the metadata cache of the client, if any. (default: {True})
+
+        Returns:
+            dict -- Dictionary of tables indexed by name.
+            dict -- Dictionary of fields indexed by name, indexed by table name.
+        """
+
+        metadata: Optional[Mapping] = None
+        if self.metadata_cache and cached:
+            fingerprint = self._metadata_fingerprint(
+                await self.api(
+                    "get", f"/api/database/{database_id}", params={"include": "tables"}
+                )
+            )
+            metadata = self.metadata_cache.get(self.host, database_id, fingerprint)
+
+        if metadata is None:
+            fetched = await self.api(
+                "get",
+                f"/api/database/{database_id}/metadata",
+                params=dict(include_hidden=True),
+            )
+            if self.metadata_cache and cached:
+                self.metadata_cache.put(self.host, database_id, fingerprint, fetched)
+            metadata = fetched
+
+        return self._index_metadata(metadata, schemas_to_exclude)
+
+    async def extract_exposures(
+        self,
+        models: List[MetabaseModel],
+        output_path: str = ".",
+        output_name: str = "metabase_exposures",
+        include_personal_collections: bool = True,
+        collection_excludes: Iterable = None,
+        bulk_cards: bool = False,
+        state: Optional[ExposureState] = None,
+        sql_processes: int = 1,
+        match_models: bool = False,
+    ) -> Mapping:
+        """Extracts exposures in Metabase downstream of dbt models and sources as parsed by dbt reader
+
+        Exposures are written to YAML as they are resolved, but also kept in memory to be
+        returned. Use iter_exposures to write or process them without keeping them.
+
+        Arguments:
+            models {List[MetabaseModel]} -- List of models as output by dbt reader
+
+        Keyword Arguments:
+            output_path {str} -- The path to output the generated yaml. (default: ".")
+            output_name {str} -- The name of the generated yaml. (default: {"metabase_exposures"})
+            include_personal_collections {bool} -- Include personal collections in Metabase processing. (default: {True})
+            collection_excludes {str} -- List of collections to exclude by name. (default: {None})
+            bulk_cards {bool} -- List all questions in one request instead of fetching them one by one. (default: {False})
+            state {ExposureState} -- Reuse exposures resolved by a previous run when their cards and dashboards were not edited since. (default: {None})
+            sql_processes {int} -- Parse long native queries in this many processes, 1 to parse them in place. (default: {1})
+            match_models {bool} -- Find models anywhere in native queries, not only after FROM and JOIN. (default: {False})
+
+        Returns:
+            List[Mapping] -- JSON object representation of all exposures parsed.
+        """
+
+        parsed_exposures = []
+
+        with ExposureWriter(output_path, output_name) as writer:
+            async for exposure in self.iter_exposures(
+                models,
+                include_personal_collections=include_personal_collections,
+                collection_excludes=collection_excludes,
+                bulk_cards=bulk_cards,
+                state=state,
+                sql_processes=sql_processes,
+                match_models=match_models,
+            ):
+                writer.write(exposure)
+                parsed_exposures.append(exposure)
+
+        return {
+            "version": EXPOSURES_VERSION,
+            "exposures": parsed_exposures,
+        }
+
+    async def iter_exposures(
+        self,
+        models: List[MetabaseModel],
+        include_personal_collections: bool = True,
+        collection_excludes: Iterable = None,
+        bulk_cards: bool = False,
+        state: Optional[ExposureState] = None,
+        sql_processes: int = 1,
+        match_models: bool = False,
+    ) -> AsyncIterator[Mapping]:
+        """Generates exposures in Metabase downstream of dbt models and sources as parsed by dbt reader
+
+        Collections, cards and dashboards are fetched concurrently, exposures are
+        generated in the same order as MetabaseClient.iter_exposures.
+
+        Arguments:
+            models {List[MetabaseModel]} -- List of models as output by dbt reader
+
+        Keyword Arguments:
+            include_personal_collections {bool} -- Include personal collections in Metabase processing. (default: {True})
+            collection_excludes {str} -- List of collections to exclude by name. (default: {None})
+            bulk_cards {bool} -- List all questions in one request instead of fetching them one by one. (default: {False})
+            state {ExposureState} -- Reuse exposures resolved by a previous run when their cards and dashboards were not edited since. (default: {None})
+            sql_processes {int} -- Parse long native queries in this many processes, 1 to parse them in place. (default: {1})
+            match_models {bool} -- Find models anywhere in native queries, not only after FROM and JOIN. (default: {False})
+
+        Returns:
+            AsyncIterator[Mapping] -- JSON object representation of each exposure parsed.
+        """
+        if collection_excludes is None:
+            collection_excludes = []
+
+        refable_models = {node.name: node.ref for node in models}
+
+        self.collections, self.tables = await asyncio.gather(
+            self.api("get", "/api/collection"), self.api("get", "/api/table")
+        )
+        self.table_map = {table["id"]: table["name"] for table in self.tables}
+        self._objects = {"card": {}, "user": {}}
+        self._card_lineage = {}
+        self._card_sources = {}
+        self._card_tables = {}
+        self._model_matcher = ModelMatcher(models) if match_models else None
+        await self._list_users()
+
+        cards: List[Mapping] = []
+        if bulk_cards:
+            cards = list(self._complete_cards(await self.api("get", "/api/card")))
+            for card in cards:
+                self._put_object("card", card)
+            logging.info("Listed %d questions in bulk", len(self._objects["card"]))
+
+        collections = list(
+            self._filter_collections(
+                self.collections, include_personal_collections, collection_excludes
+            )
+        )
+        for collection in collections:
+            logging.info("Exploring collection %s", collection["name"])
+        collection_items = await asyncio.gather(
+            *(
+                self.api("get", f"/api/collection/{collection['id']}/items")
+                for collection in collections
+            )
+        )
+
+        # Ensure collection item is of parsable type
+        items = [
+            item
+            for items in collection_items
+            for item in items
+            if item["model"] in ("card", "dashboard")
+        ]
+        edits = {
+            f"{item['model']}/{item['id']}": self._edited_at(item) for item in items
+        }
+
+        if state is not None:
+            state.start(self._exposures_fingerprint())
+
+        async def summarize(item: Mapping) -> Optional[Mapping]:
+            exposure_type, exposure_id = item["model"], item["id"]
+            key = f"{exposure_type}/{exposure_id}"
+            if state is not None:
+                summary = state.get(key, edits.get(key), edits, self.table_map)
+                if summary is not None:
+                    return summary
+            resolution = await self._resolve_exposure(exposure_type, exposure_id)
+            if resolution is None:
+                return None
+            return self._exposure_summary(
+                exposure_type, exposure_id, resolution, edits, state
+            )
+
+        with self._parsing_pool(sql_processes):
+            # Questions listed in bulk are parsed at once, in chunks
+            if self._sql_pool is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._parse_in_pool, cards
+                )
+
+            tasks = [asyncio.ensure_future(summarize(item)) for item in items]
+
+            names = _ExposureNames()
+
+            try:
+                for item, task in zip(items, tasks):
+                    summary = await task
+                    if summary is not None:
+                        yield self._exposure_from(
+                            item["model"], item["id"], summary, refable_models, names
+                        )
+            finally:
+                # Consumers may stop early, do not leave requests behind
+                for task in tasks:
+                    task.cancel()
+
+        if state is not None:
+            state.save()
+
+    async def _resolve_exposure(
+        self, exposure_type: str, exposure_id: int
+    ) -> Optional[Tuple[Mapping, List[str], str, Mapping]]:
+        """Fetches one card or dashboard and extracts the models it exposes.
+
+        Arguments:
+            exposure_type {str} -- Model type in Metabase being either `card` or `dashboard`
+            exposure_id {int} -- Card or Dashboard id in Metabase
+
+        Returns:
+            Mapping -- JSON api response of the card or dashboard.
+            List[str] -- Names of models exposed.
+            str -- Native query of the card, if any.
+            Mapping -- Creator of the card or dashboard.
+        """
+
+        if exposure_type == "card":
+            exposure = await self._get_object("card", exposure_id)
+        else:
+            exposure = await self.api("get", f"/api/{exposure_type}/{exposure_id}")
+        logging.info(
+            "Introspecting exposure: %s",
+            exposure.get("name", "Exposure [Unresolved Name]"),
+        )
+
+        models_exposed: List[str] = []
+        native_query = ""
+
+        if exposure_type == "card":
+            models_exposed, native_query = await self._extract_card_exposures(
+                exposure_id, exposure
+            )
+        else:
+            # We expect this dict key in order to iter through questions
+            if "ordered_cards" not in exposure:
+                return None
+            # Results are gathered in order, so models keep the serial order
+            for card_models, _ in await asyncio.gather(
+                *(
+                    self._extract_card_exposures(card_id, card)
+                    for card_id, card in self._dashboard_cards(exposure)
+                )
+            ):
+                models_exposed.extend(card_models)
+
+        # Extract creator info
+        creator: Mapping = {}
+        if "creator" in exposure:
+            creator = exposure["creator"]
+        elif "creator_id" in exposure:
+            creator = await self._get_object("user", exposure["creator_id"])
+
+        return exposure, models_exposed, native_query, creator
+
+    async def _list_users(self):
+        """Indexes all Metabase users, so that exposure creators are not fetched one by one.
+
+        Deactivated users are only listed by admins, others fall back to active users.
+        When users cannot be listed at all, they are fetched one by one instead.
+        """
+
+        for status in ("all", "active"):
+            users: MutableMapping[int, Mapping] = {}
+            while True:
+                page = await self.api(
+                    "get",
+                    "/api/user",
+                    critical=False,
+                    params={
+                        "status": status,
+                        "limit": self._USER_PAGE_SIZE,
+                        "offset": len(users),
+                    },
+                )
+                if not isinstance(page, list):
+                    break
+                listed = len(users)
+                users.update((user["id"], user) for user in page)
+                # Versions without pagination return all users on every page
+                if len(page) < self._USER_PAGE_SIZE or len(users) == listed:
+                    for user in users.values():
+                        self._put_object("user", user)
+                    logging.info("Listed %d users", len(users))
+                    return
+            logging.info("Users with status %s cannot be listed", status)
+
+    async def _get_object(self, kind: str, object_id: int) -> Mapping:
+        """Fetches one Metabase question or user, only once even when requested concurrently.
+
+        Arguments:
+            kind {str} -- Metabase object kind, card or user.
+            object_id {int} -- Metabase object ID.
+
+        Returns:
+            Mapping -- JSON api response of the object.
+        """
+
+        if object_id not in self._objects[kind]:
+            self._objects[kind][object_id] = asyncio.ensure_future(
+                self.api("get", f"/api/{kind}/{object_id}")
+            )
+        return await self._objects[kind][object_id]
+
+    def _put_object(self, kind: str, api_object: Mapping):
+        """Caches a Metabase question or user already in memory, so it is not fetched again.
+
+        Arguments:
+            kind {str} -- Metabase object kind, card or user.
+            api_object {dict} -- JSON api response of the object.
+        """
+
+        if api_object["id"] not in self._objects[kind]:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(api_object)
+            self._objects[kind][api_object["id"]] = future
+
+    async def _extract_card_exposures(
+        self,
+        card_id: int,
+        exposure: Optional[Mapping] = None,
+        visiting: Tuple[int, ...] = (),
+        cut: Optional[Set[int]] = None,
+    ) -> Tuple[List[str], str]:
+        """Extracts exposures from Metabase questions, resolving each question once per run
+
+        Arguments:
+            card_id {int} -- Id of Metabase question used to pull question from api
+
+        Keyword Arguments:
+            exposure {str} -- JSON api response from a question in Metabase, allows us to use the object if already in memory
+            visiting {tuple} -- Ids of questions being resolved down to this one, used to break cycles. (default: {()})
+            cut {set} -- Collects ids of questions in visiting at which a cycle was broken. (default: {None})
+
+        Returns:
+            List[str] -- Names of models exposed by the question and the questions it is based on.
+            str -- Last native query found in the question or the questions it is based on.
+        """
+
+        lineage = self._card_lineage.get(card_id)
+        if lineage is None:
+            if card_id in visiting:
+                logging.warning("Question %s is based on itself, skipping", card_id)
+                if cut is not None:
+                    cut.add(card_id)
+                return [], ""
+
+            # If an exposure is not passed, pull from id. Questions embedded in
+            # dashboards lack their creator, so they are not cached for reuse.
+            if not exposure:
+                exposure = await self._get_object("card", card_id)
+
+            # Waits for the process pool without blocking other requests
+            if self._sql_pool is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._parse_in_pool, [exposure]
+                )
+            (
+                models_exposed,
+                source_card_ids,
+                self._card_tables[card_id],
+                native_query,
+            ) = self._parse_card(exposure)
+            self._card_sources[card_id] = source_card_ids
+
+            # Handle questions based on other question in virtual db
+            source_cut: Set[int] = set()
+            for source_card_id in source_card_ids:
+                (
+                    source_models,
+                    source_native_query,
+                ) = await self._extract_card_exposures(
+                    source_card_id, visiting=visiting + (card_id,), cut=source_cut
+                )
+                models_exposed.extend(source_models)
+                if source_native_query:
+                    native_query = source_native_query
+
+            # Lineage misses the questions of a cycle broken above this one, it is
+            # only complete once resolved from the first question of the cycle
+            source_cut.discard(card_id)
+            if source_cut:
+                if cut is not None:
+                    cut.update(source_cut)
+                return models_exposed, native_query
+
+            lineage = self._card_lineage[card_id] = (models_exposed, native_query)
+
+        return list(lineage[0]), lineage[1]
+
+    async def api(
+        self,
+        method: str,
+        path: str,
+        authenticated: bool = True,
+        critical: bool = True,
+        **kwargs,
+    ) -> Mapping:
+        """Unified way of calling Metabase API.
+
+        Arguments:
+            method {str} -- HTTP verb, e.g. get, post, put.
+            path {str} -- Relative path of endpoint, e.g. /api/database.
+
+        Keyword Arguments:
+            authenticated {bool} -- Includes session ID when true. (default: {True})
+            critical {bool} -- Raise on any HTTP errors. (default: {True})
+
+        Returns:
+            Any -- JSON payload of the endpoint.
+        """
+
+        assert (
+            self.session is not None and self._semaphore is not None
+        ), "Client must be connected before calling API"
+
+        headers: MutableMapping = dict(kwargs.pop("headers", {}))
+        if authenticated:
+            headers["X-Metabase-Session"] = self.session_id
+
+        # aiohttp only accepts strings in query parameters
+        if "params" in kwargs:
+            kwargs["params"] = {
+                key: str(value).lower() if isinstance(value, bool) else value
+                for key, value in kwargs["params"].items()
+            }
+
+        attempt = 0
+        while True:
+            connect_timeout, read_timeout = self._request_timeouts()
+            try:
+                async with self._semaphore:
+                    async with self.session.request(
+                        method,
+                        f"{self.protocol}://{self.host}{path}",
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(
+                            connect=connect_timeout, sock_read=read_timeout
+                        ),
+                        **kwargs,
+                    ) as response:
+                        response_text = await response.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                delay = self._retry_delay(method, attempt)
+                if delay is None:
+                    raise
+                logging.warning(
+                    "HTTP request %s %s failed (%s), retrying in %.1f secs",
+                    method.upper(),
+                    path,
+                    error,
+                    delay,
+                )
+            else:
+                delay = self._retry_delay(
+                    method,
+                    attempt,
+                    status=response.status,
+                    retry_after=response.headers.get("Retry-After"),
+                )
+                if delay is None:
+                    break
+                logging.warning(
+                    "HTTP request %s %s returned %d, retrying in %.1f secs",
+                    method.upper(),
+                    path,
+                    response.status,
+                    delay,
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if critical:
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError:
+                if "password" in (kwargs.get("json") or {}):
+                    logging.error("HTTP request failed. Response: %s", response_text)
+                else:
+                    logging.error(
+                        "HTTP request failed. Payload: %s. Response: %s",
+                        kwargs.get("json"),
+                        response_text,
+                    )
+                raise
+        elif not response.ok:
+            return {}
+
+        response_json = json.loads(response_text)
+
+        # Since X.40.0 responses are encapsulated in "data" with pagination parameters
+        if "data" in response_json:
+            return response_json["data"]
+
+        return response_json
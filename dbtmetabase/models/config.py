@@ -9,12 +9,24 @@ class MetabaseConfig:
     host: str
     user: str
     password: str
+    database_id: Optional[int] = None
     # Metabase additional connection opts
     use_http: bool = False
     verify: Union[str, bool] = True
+    http_pool_size: int = 10
+    http_keep_alive: bool = True
+    http_connect_timeout: Optional[float] = 10
+    http_read_timeout: Optional[float] = 120
+    http_retries: int = 3
+    run_timeout: Optional[float] = None
+    concurrency: int = 1
+    metadata_cache_path: Optional[str] = None
+    metadata_cache_ttl: Optional[float] = 3600
+    metadata_cache_max_mb: Optional[float] = 512
     # Metabase Sync
     sync_skip: bool = False
     sync_timeout: Optional[int] = None
+    sync_tables_only: bool = False
 
 
 @dataclass
@@ -22,6 +34,7 @@ class DbtConfig:
     # dbt Reader
     database: str
     manifest_path: Optional[str] = None
+    state_manifest_path: Optional[str] = None
     path: Optional[str] = None
     # dbt Target Models
     schema: Optional[str] = None
@@ -12,16 +12,24 @@ class DbtManifestReader:
     Reader for dbt manifest artifact.
     """
 
-    def __init__(self, project_path: str):
+    def __init__(self, project_path: str, state_manifest_path: Optional[str] = None):
         """Constructor.
 
         Arguments:
             manifest_path {str} -- Path to dbt manifest.json.
+
+        Keyword Arguments:
+            state_manifest_path {str} -- Path to a previous dbt manifest.json, only models changed since are read. (default: {None})
         """
 
         self.manifest_path = os.path.expanduser(project_path)
+        self.state_manifest_path = (
+            os.path.expanduser(state_manifest_path) if state_manifest_path else None
+        )
         self.manifest: Mapping = {}
         self.catch_aliases: MutableMapping = {}
+        # Models read before keeping the ones changed since the state manifest
+        self.all_models: List[MetabaseModel] = []
 
     def read_models(
         self,
@@ -151,8 +159,56 @@ class DbtManifestReader:
                 )
             )
 
+        self.all_models = mb_models
+        if self.state_manifest_path:
+            mb_models = self._modified_models(
+                mb_models,
+                DbtManifestReader(self.state_manifest_path).read_models(
+                    database=database,
+                    schema=schema,
+                    schema_excludes=schema_excludes,
+                    includes=includes,
+                    excludes=excludes,
+                    include_tags=include_tags,
+                    docs_url=docs_url,
+                ),
+            )
+
         return mb_models
 
+    @staticmethod
+    def _modified_models(
+        models: List[MetabaseModel], state_models: Iterable[MetabaseModel]
+    ) -> List[MetabaseModel]:
+        """Filters models down to the ones that changed since a previous manifest.
+
+        Models are compared in Metabase-friendly format, so only changes that affect
+        Metabase count: descriptions, tags, column meta and relationship tests,
+        including relationships whose target was renamed or moved.
+
+        Arguments:
+            models {list} -- Models read from the current manifest.
+            state_models {list} -- Models read from the previous manifest.
+
+        Returns:
+            list -- Models new or modified since the previous manifest.
+        """
+
+        previous = {
+            (model.model_key, model.schema, model.name): model for model in state_models
+        }
+
+        modified = [
+            model
+            for model in models
+            if previous.get((model.model_key, model.schema, model.name)) != model
+        ]
+        logging.info(
+            "Skipping %d models unchanged since state manifest",
+            len(models) - len(modified),
+        )
+        return modified
+
     def _read_model(
         self,
         model: dict,
@@ -0,0 +1,380 @@
+import hashlib
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from ..models.metabase import MetabaseModel
+
+# Token kinds
+_WORD = "word"
+_QUOTED = "quoted"
+_PUNCT = "punct"
+_OTHER = "other"
+
+_TOKENIZER = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<line_comment>--[^\n]*)
+    | (?P<block_comment>/\*.*?(?:\*/|\Z))
+    | (?P<template>\{\{.*?(?:\}\}|\Z))
+    | (?P<optional>\[\[|\]\])
+    | (?P<string>[EeNn]?'(?:[^']|'')*(?:'|\Z))
+    | (?P<dollar_string>\$(?P<tag>[A-Za-z_]\w*)?\$.*?(?:\$(?P=tag)?\$|\Z))
+    | (?P<double_quoted>"(?:[^"]|"")*(?:"|\Z))
+    | (?P<backtick_quoted>`(?:[^`]|``)*(?:`|\Z))
+    | (?P<bracket_quoted>\[[^\]]*(?:\]|\Z))
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<number>\d+(?:\.\d*)?(?:[Ee][+-]?\d+)?)
+    | (?P<punct>[(),.;])
+    | (?P<other>.)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+# Keywords ending a FROM clause at the same depth, join conditions (ON, USING) do not
+# as more comma-separated tables may follow them
+_FROM_END = {
+    "WHERE",
+    "GROUP",
+    "HAVING",
+    "ORDER",
+    "LIMIT",
+    "OFFSET",
+    "UNION",
+    "INTERSECT",
+    "EXCEPT",
+    "MINUS",
+    "WINDOW",
+    "QUALIFY",
+    "FETCH",
+    "FOR",
+    "SELECT",
+    "RETURNING",
+}
+# Keywords following ON that start an upsert clause, e.g. ON CONFLICT ... DO UPDATE SET a = 1, b = 2
+_UPSERT_STARTS = {"CONFLICT", "DUPLICATE"}
+# Keywords ending a WITH clause at the same depth
+_WITH_END = {"SELECT", "INSERT", "UPDATE", "DELETE", "MERGE", "VALUES"}
+# Keywords that may precede the table name after FROM or JOIN
+_TABLE_PREFIXES = {"LATERAL", "ONLY"}
+
+_CACHE_SIZE = 4096
+_cache: "OrderedDict[bytes, Tuple[str, ...]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _tokenize(sql: str) -> Iterator[Tuple[str, str]]:
+    """Splits SQL into tokens, dropping whitespace, comments and Metabase optional clause brackets.
+
+    Arguments:
+        sql {str} -- SQL query.
+
+    Returns:
+        Iterator[Tuple[str, str]] -- Kind and text of each token, quoted identifiers unquoted and backtick-quoted paths split.
+    """
+
+    for match in _TOKENIZER.finditer(sql):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "word":
+            yield _WORD, text
+        elif kind == "double_quoted":
+            yield _QUOTED, text[1:-1].replace('""', '"')
+        elif kind == "backtick_quoted":
+            # BigQuery quotes whole paths, e.g. `project.dataset.table`, split like unquoted ones
+            for i, part in enumerate(text[1:-1].replace("``", "`").split(".")):
+                if i:
+                    yield _PUNCT, "."
+                yield _QUOTED, part
+        elif kind == "bracket_quoted":
+            yield _QUOTED, text[1:-1]
+        elif kind == "punct":
+            yield _PUNCT, text
+        elif kind in ("template", "string", "dollar_string", "number", "other"):
+            yield _OTHER, text
+
+
+def _parse(sql: str) -> Tuple[str, ...]:
+    """Extracts tables referenced in FROM and JOIN clauses, see extract_tables."""
+
+    tokens = list(_tokenize(sql))
+    tables: List[str] = []
+    ctes: Set[str] = set()
+
+    depth = 0
+    # Depths at which a query, FROM clause or WITH clause is open
+    query_depths: Set[int] = set()
+    from_depths: Set[int] = set()
+    with_depths: Set[int] = set()
+    expect_table = False
+    expect_cte = False
+
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        keyword = text.upper() if kind == _WORD else None
+        i += 1
+
+        if expect_cte and kind in (_WORD, _QUOTED):
+            if keyword != "RECURSIVE":
+                ctes.add(text.upper())
+                expect_cte = False
+            continue
+
+        if expect_table:
+            expect_table = False
+            if keyword in _TABLE_PREFIXES:
+                expect_table = True
+                continue
+            if kind in (_WORD, _QUOTED):
+                # Qualified name, e.g. database.schema.table, last part is the table
+                name = text
+                while (
+                    i + 1 < len(tokens)
+                    and tokens[i] == (_PUNCT, ".")
+                    and tokens[i + 1][0] in (_WORD, _QUOTED)
+                ):
+                    name = tokens[i + 1][1]
+                    i += 2
+                # Function calls, e.g. FROM generate_series(...), are not tables
+                if i >= len(tokens) or tokens[i] != (_PUNCT, "("):
+                    tables.append(name)
+                continue
+
+        if kind == _PUNCT:
+            if text == "(":
+                # Subqueries are walked like the rest of the query
+                depth += 1
+            elif text == ")":
+                query_depths.discard(depth)
+                from_depths.discard(depth)
+                with_depths.discard(depth)
+                depth -= 1
+            elif text == ",":
+                if depth in from_depths:
+                    expect_table = True
+                elif depth in with_depths:
+                    expect_cte = True
+            elif text == ";":
+                query_depths.clear()
+                from_depths.clear()
+                with_depths.clear()
+                depth = 0
+            continue
+
+        if keyword == "WITH":
+            with_depths.add(depth)
+            expect_cte = True
+        elif keyword in ("FROM", "JOIN") and depth in query_depths:
+            # Not e.g. EXTRACT(YEAR FROM ...), which is outside of any query
+            from_depths.add(depth)
+            expect_table = True
+        elif keyword is not None:
+            if keyword == "SELECT":
+                query_depths.add(depth)
+            if keyword in _FROM_END or (
+                keyword == "ON"
+                and i < len(tokens)
+                and tokens[i][1].upper() in _UPSERT_STARTS
+            ):
+                from_depths.discard(depth)
+            if keyword in _WITH_END:
+                with_depths.discard(depth)
+
+    return tuple(name for name in tables if name.upper() not in ctes)
+
+
+def _cached(sql: str) -> Tuple[bytes, Optional[Tuple[str, ...]]]:
+    """Looks up tables extracted from a query before.
+
+    Arguments:
+        sql {str} -- SQL query.
+
+    Returns:
+        bytes -- Cache key of the query.
+        Tuple[str, ...] -- Tables extracted, None if the query was not parsed yet.
+    """
+
+    key = hashlib.sha256(sql.encode("utf-8")).digest()
+    with _cache_lock:
+        tables = _cache.get(key)
+        if tables is not None:
+            _cache.move_to_end(key)
+    return key, tables
+
+
+def _store(key: bytes, tables: Tuple[str, ...]):
+    """Caches tables extracted from a query, evicting the least recently used ones.
+
+    Arguments:
+        key {bytes} -- Cache key of the query.
+        tables {Tuple[str, ...]} -- Tables extracted.
+    """
+
+    with _cache_lock:
+        _cache[key] = tables
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def extract_tables(
+    sql: str, parsed: Optional[Mapping[bytes, Tuple[str, ...]]] = None
+) -> List[str]:
+    """Extracts names of tables a native query reads from, in order of appearance.
+
+    Comments, string literals, quoted identifiers, common table expressions and
+    Metabase template tags are understood. Results are cached by a hash of the query,
+    so copies of the same question are parsed once.
+
+    Arguments:
+        sql {str} -- SQL query.
+
+    Keyword Arguments:
+        parsed {dict} -- Tables by cache key as returned by parse_in_pool, looked up before the cache. (default: {None})
+
+    Returns:
+        List[str] -- Table names without schema, duplicates included.
+    """
+
+    key = hashlib.sha256(sql.encode("utf-8")).digest()
+    tables = parsed.get(key) if parsed else None
+    if tables is None:
+        key, tables = _cached(sql)
+    if tables is None:
+        tables = _parse(sql)
+        _store(key, tables)
+    return list(tables)
+
+
+def parse_in_pool(
+    queries: Sequence[str], pool: Executor, workers: int
+) -> Mapping[bytes, Tuple[str, ...]]:
+    """Parses queries not cached yet in a process pool.
+
+    Queries are sent in chunks, a few per worker, to keep inter-process overhead
+    below the parse cost. Results are cached too, but the cache may evict them
+    before they are read when there are many queries, so they should be passed
+    on to extract_tables.
+
+    Arguments:
+        queries {list} -- SQL queries.
+        pool {Executor} -- Process pool to parse in.
+        workers {int} -- Number of processes in the pool.
+
+    Returns:
+        dict -- Tables extracted by cache key, for all queries.
+    """
+
+    parsed: MutableMapping[bytes, Tuple[str, ...]] = {}
+    pending: MutableMapping[bytes, str] = {}
+    for sql in queries:
+        key, tables = _cached(sql)
+        if tables is None:
+            pending[key] = sql
+        else:
+            parsed[key] = tables
+    if not pending:
+        return parsed
+
+    chunksize = max(1, len(pending) // (workers * 4))
+    for key, tables in zip(
+        pending, pool.map(_parse, pending.values(), chunksize=chunksize)
+    ):
+        _store(key, tables)
+        parsed[key] = tables
+    return parsed
+
+
+class ModelMatcher:
+    """
+    Finds every dbt model a native query refers to, anywhere in the query.
+    """
+
+    _REF_NAME = re.compile(r"['\"]([^'\"]+)['\"]\s*\)\s*\}*\s*$")
+
+    def __init__(self, models: Iterable[MetabaseModel]):
+        """Constructor, indexes names of all models once.
+
+        Arguments:
+            models {list} -- dbt models as read from the project.
+        """
+
+        # Model names by referenced name and by referenced schema and name, upper case
+        self.names: MutableMapping[str, str] = {}
+        self.qualified: MutableMapping[Tuple[str, str], str] = {}
+
+        for model in models:
+            aliases = {model.name.upper()}
+            # Name in ref('...') or source('...', '...') may differ from the table name
+            ref_name = self._REF_NAME.search(model.ref or "")
+            if ref_name:
+                aliases.add(ref_name.group(1).upper())
+            for alias in aliases:
+                self.names.setdefault(alias, model.name)
+                self.qualified.setdefault((model.schema.upper(), alias), model.name)
+
+        self._cache: MutableMapping[bytes, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    def match(self, sql: str) -> List[str]:
+        """Finds models referenced by a query in one pass over its tokens.
+
+        Unqualified names match any model with that name, qualified names only match
+        on schema and name, so that e.g. alias.column is not taken for a model. Names
+        in comments and string literals are ignored.
+
+        Arguments:
+            sql {str} -- SQL query.
+
+        Returns:
+            List[str] -- Names of models in order of appearance, duplicates included.
+        """
+
+        key = hashlib.sha256(sql.encode("utf-8")).digest()
+        with self._lock:
+            models = self._cache.get(key)
+        if models is None:
+            models = tuple(self._match(sql))
+            with self._lock:
+                self._cache[key] = models
+        return list(models)
+
+    def _match(self, sql: str) -> Iterator[str]:
+        """Finds models referenced by a query, see match."""
+
+        parts: List[str] = []
+        dotted = False
+
+        for kind, text in itertools.chain(_tokenize(sql), [(_OTHER, "")]):
+            if kind in (_WORD, _QUOTED) and (dotted or not parts):
+                parts.append(text.upper())
+                dotted = False
+                continue
+            if kind == _PUNCT and text == "." and parts and not dotted:
+                dotted = True
+                continue
+
+            # End of a possibly qualified name, e.g. database.schema.table,
+            # unless it is a function call
+            if (kind, text) == (_PUNCT, "("):
+                pass
+            elif len(parts) == 1 and parts[0] in self.names:
+                yield self.names[parts[0]]
+            elif len(parts) > 1 and (parts[-2], parts[-1]) in self.qualified:
+                yield self.qualified[(parts[-2], parts[-1])]
+
+            parts = [text.upper()] if kind in (_WORD, _QUOTED) else []
+            dotted = False
@@ -0,0 +1,580 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+from .models.metabase import MetabaseModel
+
+
+class ExportState:
+    """
+    Content hashes of models exported to Metabase by a previous run.
+    """
+
+    def __init__(
+        self,
+        state_path: str,
+        host: str,
+        database: str,
+        reconcile_days: Optional[float] = None,
+    ):
+        """Constructor, loads the state file if present.
+
+        Arguments:
+            state_path {str} -- Path to JSON state file.
+            host {str} -- Metabase hostname models are exported to.
+            database {str} -- Metabase database name models are exported to.
+
+        Keyword Arguments:
+            reconcile_days {float} -- Export all models again when the last full export is older. (default: {None})
+        """
+
+        self.state_path = os.path.expanduser(state_path)
+        self.host = host
+        self.database = database
+        self.hashes: MutableMapping[str, str] = {}
+        self.reconciled_at: Optional[float] = None
+        self.full = True
+
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            logging.info("No state found at %s, exporting all models", state_path)
+            return
+
+        if state.get("host") != host or state.get("database") != database:
+            logging.info(
+                "State was recorded for database %s on %s, exporting all models",
+                state.get("database"),
+                state.get("host"),
+            )
+            return
+
+        self.hashes = state.get("models", {})
+        self.reconciled_at = state["reconciled_at"]
+
+        if (
+            reconcile_days is not None
+            and time.time() - state["reconciled_at"] >= reconcile_days * 86400
+        ):
+            logging.info(
+                "Last full export is older than %s days, exporting all models",
+                reconcile_days,
+            )
+            return
+
+        self.full = False
+
+    @staticmethod
+    def model_hash(model: MetabaseModel) -> str:
+        """Hashes everything exported from one dbt model, including its columns.
+
+        Arguments:
+            model {MetabaseModel} -- One dbt model read from project.
+
+        Returns:
+            str -- Hex digest of the model content.
+        """
+
+        content = json.dumps(dataclasses.asdict(model), sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def model_key(model: MetabaseModel) -> str:
+        """Key of one dbt model in the state file.
+
+        Arguments:
+            model {MetabaseModel} -- One dbt model read from project.
+
+        Returns:
+            str -- Schema and name of the model.
+        """
+
+        return f"{model.schema.upper()}.{model.name.upper()}"
+
+    def changed(self, models: Sequence[MetabaseModel]) -> List[MetabaseModel]:
+        """Filters models down to the ones changed since the last export.
+
+        Arguments:
+            models {list} -- List of dbt models read from project.
+
+        Returns:
+            list -- Models to export, all of them on a full export.
+        """
+
+        if self.full:
+            return list(models)
+
+        changed = [
+            model
+            for model in models
+            if self.hashes.get(self.model_key(model)) != self.model_hash(model)
+        ]
+        logging.info(
+            "Skipping %d models unchanged since last export",
+            len(models) - len(changed),
+        )
+        return changed
+
+    def save(self, models: Iterable[MetabaseModel]):
+        """Records models as exported and writes the state file.
+
+        Arguments:
+            models {list} -- Models successfully exported to Metabase.
+        """
+
+        if self.full:
+            self.hashes = {}
+            self.reconciled_at = time.time()
+
+        for model in models:
+            self.hashes[self.model_key(model)] = self.model_hash(model)
+
+        state = {
+            "host": self.host,
+            "database": self.database,
+            "reconciled_at": self.reconciled_at,
+            "models": self.hashes,
+        }
+
+        with open(self.state_path, "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+
+        logging.info(
+            "Saved state of %d models to %s", len(self.hashes), self.state_path
+        )
+
+
+class ExposureState:
+    """
+    Exposures resolved by a previous run, keyed on when their cards and dashboards were last edited.
+    """
+
+    def __init__(self, state_path: str, host: str):
+        """Constructor, loads the state file if present.
+
+        Arguments:
+            state_path {str} -- Path to JSON state file.
+            host {str} -- Metabase hostname exposures are extracted from.
+        """
+
+        self.state_path = os.path.expanduser(state_path)
+        self.host = host
+        self.fingerprint: Optional[str] = None
+        self.previous: Mapping[str, Mapping] = {}
+        self.current: MutableMapping[str, Mapping] = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            logging.info("No state found at %s, resolving all exposures", state_path)
+            return
+
+        if state.get("host") != host:
+            logging.info(
+                "State was recorded for %s, resolving all exposures", state.get("host")
+            )
+            return
+
+        self.fingerprint = state.get("fingerprint")
+        self.previous = state.get("exposures", {})
+
+    def start(self, fingerprint: str):
+        """Drops resolved exposures when what they were resolved against has changed.
+
+        Arguments:
+            fingerprint {str} -- Fingerprint of models matched in native queries, if any.
+        """
+
+        if self.previous and fingerprint != self.fingerprint:
+            logging.info("Matched models changed, resolving all exposures")
+            self.previous = {}
+        self.fingerprint = fingerprint
+        self.current = {}
+
+    def get(
+        self,
+        key: str,
+        edited_at: Optional[str],
+        edits: Mapping[str, Optional[str]],
+        table_names: Mapping[int, str],
+    ) -> Optional[Mapping]:
+        """Reads an exposure resolved by a previous run, if neither it, the questions it is based on nor their tables changed since.
+
+        Arguments:
+            key {str} -- Kind and ID of the card or dashboard, e.g. card/1.
+            edited_at {str} -- When the card or dashboard was last edited.
+            edits {dict} -- When each listed card was last edited, by key.
+            table_names {dict} -- Names of Metabase tables by ID.
+
+        Returns:
+            Mapping -- Exposure as recorded, None if it must be resolved again.
+        """
+
+        entry = self.previous.get(key)
+        if (
+            entry is None
+            or edited_at is None
+            or entry["edited_at"] != edited_at
+            or "tables" not in entry
+            or any(
+                edited is None or edits.get(dependency) != edited
+                for dependency, edited in entry["dependencies"].items()
+            )
+            or any(
+                table_names.get(int(table_id)) != name
+                for table_id, name in entry["tables"].items()
+            )
+        ):
+            return None
+
+        with self._lock:
+            self.current[key] = entry
+        return entry["exposure"]
+
+    def record(
+        self,
+        key: str,
+        edited_at: Optional[str],
+        dependencies: Mapping[str, Optional[str]],
+        exposure: Mapping,
+        tables: Mapping[int, Optional[str]],
+    ):
+        """Records one resolved exposure.
+
+        Arguments:
+            key {str} -- Kind and ID of the card or dashboard, e.g. card/1.
+            edited_at {str} -- When the card or dashboard was last edited.
+            dependencies {dict} -- When each question it is based on was last edited, by key.
+            exposure {dict} -- Exposure as resolved, JSON-serializable.
+            tables {dict} -- Names of the Metabase tables its questions read from by ID, None if unknown.
+        """
+
+        with self._lock:
+            self.current[key] = {
+                "edited_at": edited_at,
+                "dependencies": dependencies,
+                "exposure": exposure,
+                # Keys become strings in JSON, like the ones loaded from the state file
+                "tables": {str(table_id): name for table_id, name in tables.items()},
+            }
+
+    def save(self):
+        """Writes exposures resolved or reused by this run, others were deleted from Metabase."""
+
+        reused = sum(
+            1 for key, entry in self.current.items() if self.previous.get(key) is entry
+        )
+        logging.info(
+            "Reused %d of %d exposures unchanged since last run",
+            reused,
+            len(self.current),
+        )
+
+        state = {
+            "host": self.host,
+            "fingerprint": self.fingerprint,
+            "exposures": self.current,
+        }
+
+        with open(self.state_path, "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+
+        logging.info(
+            "Saved state of %d exposures to %s", len(self.current), self.state_path
+        )
+
+
+class ExportJournal:
+    """
+    Tables and fields already written to Metabase by an interrupted run.
+    """
+
+    def __init__(self, journal_path: str, resume: bool = False):
+        """Constructor.
+
+        Arguments:
+            journal_path {str} -- Path to journal file, one JSON record per line.
+
+        Keyword Arguments:
+            resume {bool} -- Skip writes recorded by a previous run of the same export. (default: {False})
+        """
+
+        self.journal_path = os.path.expanduser(journal_path)
+        self.resume = resume
+        self.completed: Set[Tuple[str, int]] = set()
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        """Hashes what identifies an export, so that a journal is only resumed by the same one.
+
+        Arguments:
+            parts {list} -- JSON-serializable inputs of the export, e.g. host, database and models.
+
+        Returns:
+            str -- Hex digest of the inputs.
+        """
+
+        content = json.dumps(
+            [
+                (
+                    dataclasses.asdict(part)
+                    if dataclasses.is_dataclass(part) and not isinstance(part, type)
+                    else part
+                )
+                for part in parts
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def start(self, fingerprint: str):
+        """Loads writes completed by a previous run of the same export, starts a new journal otherwise.
+
+        Arguments:
+            fingerprint {str} -- Fingerprint of the export, see fingerprint().
+        """
+
+        if self.resume:
+            try:
+                with open(self.journal_path, "r", encoding="utf-8") as journal_file:
+                    header = json.loads(journal_file.readline() or "{}")
+                    if header.get("fingerprint") == fingerprint:
+                        for line in journal_file:
+                            # A run killed mid-write may leave a truncated last line
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                break
+                            self.completed.add((record["kind"], record["id"]))
+                    else:
+                        logging.info(
+                            "Journal %s is for a different export, starting over",
+                            self.journal_path,
+                        )
+            except FileNotFoundError:
+                logging.info("No journal found at %s, starting over", self.journal_path)
+
+        if self.completed:
+            logging.info(
+                "Resuming export, skipping %d completed writes", len(self.completed)
+            )
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+        else:
+            self._file = open(self.journal_path, "w", encoding="utf-8")
+            self._file.write(json.dumps({"fingerprint": fingerprint}) + "\n")
+            self._file.flush()
+
+    def done(self, kind: str, object_id: int) -> bool:
+        """Checks whether a write was completed by a previous run.
+
+        Arguments:
+            kind {str} -- Metabase object kind, table or field.
+            object_id {int} -- Metabase object ID.
+
+        Returns:
+            bool -- True if the write can be skipped.
+        """
+
+        return (kind, object_id) in self.completed
+
+    def record(self, kind: str, object_id: int):
+        """Appends one completed write to the journal.
+
+        Arguments:
+            kind {str} -- Metabase object kind, table or field.
+            object_id {int} -- Metabase object ID.
+        """
+
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps({"kind": kind, "id": object_id}) + "\n")
+                self._file.flush()
+
+    def close(self, success: bool):
+        """Closes the journal, removing it once the export has fully succeeded.
+
+        Arguments:
+            success {bool} -- Whether all writes were completed.
+        """
+
+        if not self._file:
+            return
+        self._file.close()
+        self._file = None
+        if success:
+            os.remove(self.journal_path)
+
+
+class MetadataCache:
+    """
+    Database metadata snapshots of Metabase kept on disk between runs.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        ttl: Optional[float] = 3600,
+        max_bytes: Optional[int] = 512 * 1024 * 1024,
+    ):
+        """Constructor.
+
+        Arguments:
+            cache_path {str} -- Path to SQLite cache file, created if missing.
+
+        Keyword Arguments:
+            ttl {float} -- Seconds after which a snapshot is downloaded again, None to only rely on freshness. (default: {3600})
+            max_bytes {int} -- Compressed size above which least recently used snapshots are evicted, None for no limit. (default: {512 MiB})
+        """
+
+        self.cache_path = os.path.expanduser(cache_path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Opens the cache file in a transaction, committed on success.
+
+        Returns:
+            sqlite3.Connection -- Connection to the cache file.
+        """
+
+        with self._lock:
+            connection = sqlite3.connect(self.cache_path, timeout=30)
+            try:
+                with connection:
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS metadata (
+                            host TEXT NOT NULL,
+                            database_id TEXT NOT NULL,
+                            fingerprint TEXT NOT NULL,
+                            created_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL,
+                            payload BLOB NOT NULL,
+                            PRIMARY KEY (host, database_id)
+                        )
+                        """)
+                    yield connection
+            finally:
+                connection.close()
+
+    def get(self, host: str, database_id: Any, fingerprint: str) -> Optional[dict]:
+        """Reads a database metadata snapshot if still fresh.
+
+        Arguments:
+            host {str} -- Metabase hostname.
+            database_id {str} -- Metabase database ID.
+            fingerprint {str} -- Freshness signal of the database, snapshots with another one are stale.
+
+        Returns:
+            dict -- Metabase database metadata, None if missing or stale.
+        """
+
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT fingerprint, created_at, payload FROM metadata WHERE host = ? AND database_id = ?",
+                (host, str(database_id)),
+            ).fetchone()
+            if row is None:
+                logging.info("No cached metadata for database %s", database_id)
+                return None
+
+            cached_fingerprint, created_at, payload = row
+            if cached_fingerprint != fingerprint:
+                logging.info("Cached metadata for database %s is stale", database_id)
+                return None
+            if self.ttl is not None and time.time() - created_at >= self.ttl:
+                logging.info("Cached metadata for database %s expired", database_id)
+                return None
+
+            connection.execute(
+                "UPDATE metadata SET accessed_at = ? WHERE host = ? AND database_id = ?",
+                (time.time(), host, str(database_id)),
+            )
+
+        logging.info("Using cached metadata for database %s", database_id)
+        return json.loads(zlib.decompress(payload))
+
+    def put(self, host: str, database_id: Any, fingerprint: str, metadata: Mapping):
+        """Stores a database metadata snapshot, evicting old ones above the size limit.
+
+        Arguments:
+            host {str} -- Metabase hostname.
+            database_id {str} -- Metabase database ID.
+            fingerprint {str} -- Freshness signal of the database when the snapshot was taken.
+            metadata {dict} -- Metabase database metadata as returned by the API.
+        """
+
+        payload = zlib.compress(
+            json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+        )
+        now = time.time()
+
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                (host, str(database_id), fingerprint, now, now, payload),
+            )
+
+            if self.max_bytes is None:
+                return
+
+            # Evict least recently used snapshots until the cache fits
+            total = 0
+            for row_host, row_database_id, size in connection.execute(
+                "SELECT host, database_id, LENGTH(payload) FROM metadata ORDER BY accessed_at DESC"
+            ).fetchall():
+                total += size
+                if total > self.max_bytes:
+                    logging.info(
+                        "Evicting cached metadata for database %s", row_database_id
+                    )
+                    connection.execute(
+                        "DELETE FROM metadata WHERE host = ? AND database_id = ?",
+                        (row_host, row_database_id),
+                    )
+
+    def invalidate(self, host: str, database_id: Optional[Any] = None):
+        """Drops snapshots changed by writes to Metabase.
+
+        Arguments:
+            host {str} -- Metabase hostname.
+
+        Keyword Arguments:
+            database_id {str} -- Metabase database ID, all databases of the host when not provided. (default: {None})
+        """
+
+        with self._transaction() as connection:
+            if database_id is None:
+                connection.execute("DELETE FROM metadata WHERE host = ?", (host,))
+            else:
+                connection.execute(
+                    "DELETE FROM metadata WHERE host = ? AND database_id = ?",
+                    (host, str(database_id)),
+                )
@@ -1,3 +1,4 @@
 from .test_dbt_folder_reader import *
 from .test_dbt_manifest_reader import *
 from .test_metabase import *
+from .test_sql import *
@@ -0,0 +1,88 @@
+"""Benchmarks extraction of tables from native queries.
+
+Run from the repository root: python -m tests.benchmark_sql
+
+The corpus mimics an instance where questions are copies of a few hundred
+distinct queries, which is common on Metabase instances with many users.
+"""
+
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+from dbtmetabase.models.metabase import MetabaseModel
+from dbtmetabase.parsers import sql
+
+QUESTIONS = 20000
+DISTINCT = 500
+PROCESSES = 4
+MODELS = 10000
+
+# Regular expressions used before the tokenizer, as a baseline
+REGEX_TABLES = re.compile(r"[FfJj][RrOo][OoIi][MmNn]\s+\b(\w+)\b")
+REGEX_CTES = re.compile(r"[Ww][Ii][Tt][Hh]\s+\b(\w+)\b\s+as|[)]\s*[,]\s*\b(\w+)\b\s+as")
+
+
+def regex_tables(query: str) -> List[str]:
+    ctes = [cte for match in REGEX_CTES.findall(query) for cte in match]
+    return [
+        table.split(".")[-1].strip('"')
+        for table in REGEX_TABLES.findall(query)
+        if table not in ctes
+    ]
+
+
+def corpus() -> List[str]:
+    with open("tests/fixtures/sql/native_queries.sql", "r", encoding="utf-8") as f:
+        queries = [query.strip() for query in f.read().split(";") if query.strip()]
+    # Distinct copies differ by a comment, as edited copies of a question would
+    distinct = [f"{queries[i % len(queries)]}\n-- copy {i}" for i in range(DISTINCT)]
+    return [distinct[i % DISTINCT] for i in range(QUESTIONS)]
+
+
+def bench(name: str, extract: Callable[[str], List[str]], queries: List[str]):
+    start = time.perf_counter()
+    for query in queries:
+        extract(query)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<24} {elapsed * 1000:8.1f} ms  {len(queries) / elapsed:10.0f} queries/s"
+    )
+
+
+def main():
+    queries = corpus()
+    print(f"{len(queries)} questions, {DISTINCT} distinct queries")
+    bench("regex", regex_tables, queries)
+    bench("tokenizer", sql._parse, queries)
+    sql._cache.clear()
+    bench("tokenizer, cached", sql.extract_tables, queries)
+
+    sql._cache.clear()
+    with ProcessPoolExecutor(max_workers=PROCESSES) as pool:
+        # Workers are started up front, as they are for a whole extraction
+        list(pool.map(sql._parse, ["select 1"] * PROCESSES))
+        start = time.perf_counter()
+        sql.parse_in_pool(queries, pool, PROCESSES)
+        elapsed = time.perf_counter() - start
+    print(
+        f"{'tokenizer, ' + str(PROCESSES) + ' processes':<24} {elapsed * 1000:8.1f} ms"
+    )
+
+    # Model names of the corpus among many others, as in a large dbt project
+    names = ["customers", "orders", "payments", "stg_customers", "stg_orders"]
+    names += [f"model_{i}" for i in range(MODELS - len(names))]
+    start = time.perf_counter()
+    matcher = sql.ModelMatcher(
+        MetabaseModel(name=name.upper(), schema="PUBLIC", ref=f"ref('{name}')")
+        for name in names
+    )
+    elapsed = time.perf_counter() - start
+    print(f"{'matcher, ' + str(MODELS) + ' models':<24} {elapsed * 1000:8.1f} ms")
+    bench("matcher", lambda query: list(matcher._match(query)), queries)
+    bench("matcher, cached", matcher.match, queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+-- Queries in the style of Metabase native questions, separated by semicolons.
+-- Expected tables are listed in the "tables:" comment above each query.
+
+-- tables: customers
+select * from customers;
+
+-- tables: orders, customers
+SELECT o.order_id, c.first_name
+FROM analytics.orders AS o
+LEFT JOIN analytics.customers c ON c.customer_id = o.customer_id
+WHERE o.status = 'shipped'
+[[AND o.order_date >= {{start_date}}]];
+
+-- tables: payments, orders
+WITH order_payments AS (
+    SELECT order_id, sum(amount) AS amount
+    FROM "PUBLIC"."payments"
+    GROUP BY 1
+), big_orders AS (
+    SELECT * FROM order_payments WHERE amount > 100
+)
+SELECT date_trunc('month', o.order_date) AS month, count(*)
+FROM "orders" o
+JOIN big_orders b ON b.order_id = o.order_id
+GROUP BY 1
+ORDER BY 1;
+
+-- tables: stg_payments
+select
+    payment_method,
+    extract(year from created_at) as year, -- from a comment
+    /* join another_table */
+    'from a string' as label
+from stg_payments
+group by 1, 2;
+
+-- tables: customers, orders
+SELECT c.*
+FROM customers c
+WHERE c.customer_id IN (
+    SELECT customer_id FROM orders WHERE amount > {{min_amount}}
+);
+
+-- tables: orders
+select *
+from {{#12-orders-question}} q
+join orders using (order_id);
+
+-- tables: stg_customers, stg_orders
+SELECT customer_id FROM `staging`.`stg_customers`
+UNION ALL
+SELECT customer_id FROM `staging`.`stg_orders`
+ORDER BY 1
+LIMIT 100;
+
+-- tables: orders, customers
+select *
+from orders o, customers c, generate_series(1, 10) g
+where o.customer_id = c.customer_id;
+
+-- tables: customers
+with recursive numbers (n) as (
+    select 1
+    union all
+    select n + 1 from numbers where n < 10
+)
+select * from numbers cross join customers;
+
+-- tables: orders
+SELECT *
+FROM [dbo].[orders]
+WHERE [status] = N'completed';
+
+-- tables: orders, customers
+SELECT o.order_id, c.first_name
+FROM `my-project.analytics.orders` o
+JOIN `my-project`.analytics.`customers` c USING (customer_id);
+
+-- tables: orders, stg_payments
+select o.order_id, p.amount
+from orders o
+inner join lateral (
+    select amount from stg_payments sp where sp.order_id = o.order_id limit 1
+) p on true;
+
+-- tables: orders, customers, stg_payments
+SELECT *
+FROM orders o
+JOIN customers c ON c.customer_id = o.customer_id, stg_payments p
+WHERE p.order_id = o.order_id;
+
+-- tables: orders, customers, stg_payments
+select * from orders join customers using (customer_id), stg_payments;
+
+-- tables: orders
+insert into order_totals (order_id, amount)
+select order_id, amount from orders
+on conflict (order_id) do update set amount = excluded.amount, updated_at = now();
+
+-- tables: orders
+INSERT INTO order_totals (order_id, amount)
+SELECT order_id, amount FROM orders
+ON DUPLICATE KEY UPDATE amount = VALUES(amount), updated_at = NOW();
@@ -1,4 +1,7 @@
+import json
 import logging
+import os
+import tempfile
 import unittest
 
 from dbtmetabase.models.metabase import ModelKey
@@ -264,3 +267,23 @@ class TestDbtManifestReader(unittest.TestCase):
         ]
         self.assertEqual(models, expectation)
         logging.info("Done")
+
+    def test_read_modified_models(self):
+        manifest_path = "tests/fixtures/sample_project/target/manifest.json"
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        manifest["nodes"]["model.jaffle_shop.customers"]["description"] = "Previous"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_manifest_path = os.path.join(tmpdir, "manifest.json")
+            with open(state_manifest_path, "w", encoding="utf-8") as manifest_file:
+                json.dump(manifest, manifest_file)
+
+            reader = DbtManifestReader(
+                manifest_path, state_manifest_path=state_manifest_path
+            )
+            models = reader.read_models(database="test", schema="public")
+
+        self.assertEqual(["CUSTOMERS"], [model.name for model in models])
+        # Unchanged models pointing at CUSTOMERS are kept to resolve FK targets
+        self.assertIn("ORDERS", [model.name for model in reader.all_models])
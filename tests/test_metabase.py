@@ -1,10 +1,26 @@
+import asyncio
+import copy
 import json
 import logging
 import os
+import tempfile
 import unittest
 import yaml
+from typing import List
+from unittest import mock
 
-from dbtmetabase.metabase import MetabaseClient
+import requests
+
+import dbtmetabase
+from dbtmetabase.metabase import MetabaseClient, _ExposureNames
+from dbtmetabase.metabase_async import AsyncMetabaseClient
+from dbtmetabase.models.config import DbtConfig, MetabaseConfig
+from dbtmetabase.state import (
+    ExportJournal,
+    ExportState,
+    ExposureState,
+    MetadataCache,
+)
 from dbtmetabase.models.metabase import (
     MetabaseModel,
     MetabaseColumn,
@@ -249,18 +265,63 @@ MODELS = [
 ]
 
 
+def fk_models() -> List[MetabaseModel]:
+    """Customers dimension and orders fact pointing at it, without other columns."""
+
+    return [
+        MetabaseModel(
+            name="CUSTOMERS",
+            schema="PUBLIC",
+            columns=[MetabaseColumn(name="CUSTOMER_ID")],
+        ),
+        MetabaseModel(
+            name="ORDERS",
+            schema="PUBLIC",
+            columns=[
+                MetabaseColumn(
+                    name="CUSTOMER_ID",
+                    semantic_type="type/FK",
+                    fk_target_table="PUBLIC.CUSTOMERS",
+                    fk_target_field="CUSTOMER_ID",
+                )
+            ],
+        ),
+    ]
+
+
 class MockMetabaseClient(MetabaseClient):
+    def __init__(self, *args, **kwargs):
+        self.reads: list = []
+        self.writes: list = []
+        super().__init__(*args, **kwargs)
+
     def get_session_id(self, user: str, password: str) -> str:
         return "dummy"
 
     def api(self, method: str, path: str, **kwargs):
         BASE_PATH = "tests/fixtures/mock_api/"
         if method == "get":
+            self.reads.append(path)
             if os.path.exists(f"{BASE_PATH}/{path.lstrip('/')}.json"):
                 with open(f"{BASE_PATH}/{path.lstrip('/')}.json") as f:
                     return json.load(f)
             else:
                 return {}
+        self.writes.append((method, path, kwargs.get("json")))
+        return {}
+
+
+class MockAsyncMetabaseClient(AsyncMetabaseClient):
+    def __init__(self, *args, **kwargs):
+        self.reads: list = []
+        self.writes: list = []
+        super().__init__(*args, **kwargs)
+
+    async def get_session_id(self, user: str, password: str) -> str:
+        return "dummy"
+
+    async def api(self, method: str, path: str, **kwargs):
+        return MockMetabaseClient.api(self, method, path, **kwargs)
 
 
 class TestMetabaseClient(unittest.TestCase):
@@ -293,6 +354,638 @@ class TestMetabaseClient(unittest.TestCase):
 
         self.assertEqual(baseline_exposures, sample_exposures)
 
+    def test_exposures_command(self):
+        with tempfile.TemporaryDirectory() as tmpdir, mock.patch(
+            "dbtmetabase._build_client", return_value=self.client
+        ), mock.patch(
+            "dbtmetabase.DbtManifestReader.read_models", return_value=MODELS
+        ), mock.patch.object(
+            self.client, "extract_exposures"
+        ) as extract_exposures:
+            dbtmetabase.exposures(
+                MetabaseConfig(
+                    database="unit_testing",
+                    host="localhost:3000",
+                    user="dummy",
+                    password="dummy",
+                    sync_skip=True,
+                ),
+                DbtConfig(database="test", manifest_path="manifest.json"),
+                output_path=tmpdir,
+                output_name="exposures",
+            )
+            # Exposures are streamed to YAML, not collected in a list first
+            extract_exposures.assert_not_called()
+            with open(os.path.join(tmpdir, "exposures.yml"), "r") as f:
+                written = f.read()
+
+        with open("tests/fixtures/exposure/baseline_test_exposures.yml", "r") as f:
+            baseline = yaml.safe_load(f)
+        self.assertEqual(
+            sorted(baseline["exposures"], key=lambda ele: ele["name"]),
+            sorted(yaml.safe_load(written)["exposures"], key=lambda ele: ele["name"]),
+        )
+
+    def test_exposures_concurrent(self):
+        concurrent = MockMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+            concurrency=4,
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.extract_exposures(MODELS, tmpdir, "serial")
+            concurrent.extract_exposures(MODELS, tmpdir, "concurrent")
+            with open(os.path.join(tmpdir, "serial.yml"), "rb") as f:
+                serial_output = f.read()
+            with open(os.path.join(tmpdir, "concurrent.yml"), "rb") as f:
+                self.assertEqual(serial_output, f.read())
+
+        # Questions on several dashboards or reused by other questions are fetched once
+        card_reads = [
+            path for path in concurrent.reads if path.startswith("/api/card/")
+        ]
+        self.assertEqual(len(set(card_reads)), len(card_reads))
+
+        # Questions based on each other do not recurse forever
+        for card_id, source_id in ((901, 902), (902, 901)):
+            concurrent._put_object(
+                "card",
+                {
+                    "id": card_id,
+                    "dataset_query": {
+                        "type": "query",
+                        "query": {"source-table": f"card__{source_id}"},
+                    },
+                },
+            )
+        self.assertEqual(concurrent._extract_card_exposures(901), ([], ""))
+
+    def test_exposures_cycle(self):
+        cards = [
+            {
+                "id": card_id,
+                "dataset_query": {
+                    "type": "query",
+                    "query": {
+                        "source-table": table_id,
+                        "joins": [{"source-table": f"card__{source_id}"}],
+                    },
+                },
+            }
+            for card_id, table_id, source_id in ((901, 1, 902), (902, 2, 901))
+        ]
+        expected = {901: ["ORDERS", "CUSTOMERS"], 902: ["CUSTOMERS", "ORDERS"]}
+
+        async def resolve(mbc: AsyncMetabaseClient, order):
+            for card in cards:
+                mbc._put_object("card", card)
+            return [(await mbc._extract_card_exposures(i))[0] for i in order]
+
+        # Lineages do not depend on which question of a cycle is resolved first
+        for order in ((901, 902), (902, 901)):
+            for mbc in (
+                MockMetabaseClient(
+                    host="localhost:3000", user="dummy", password="dummy"
+                ),
+                MockAsyncMetabaseClient(
+                    host="localhost:3000", user="dummy", password="dummy"
+                ),
+            ):
+                mbc.table_map = {1: "ORDERS", 2: "CUSTOMERS"}
+                if isinstance(mbc, AsyncMetabaseClient):
+                    resolved = asyncio.run(resolve(mbc, order))
+                else:
+                    for card in cards:
+                        mbc._put_object("card", card)
+                    resolved = [mbc._extract_card_exposures(i)[0] for i in order]
+                self.assertEqual(
+                    [list(dict.fromkeys(models)) for models in resolved],
+                    [expected[i] for i in order],
+                )
+
+    def test_exposures_bulk_cards(self):
+        bulk = MockMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Questions fetched one by one are not sent to the pool one by one
+            with self.assertLogs(level="WARNING") as logs:
+                self.client.extract_exposures(MODELS, tmpdir, "single", sql_processes=2)
+            self.assertIn("embedded in dashboards", logs.output[0])
+            bulk.extract_exposures(
+                MODELS, tmpdir, "bulk", bulk_cards=True, sql_processes=2
+            )
+            with open(os.path.join(tmpdir, "single.yml"), "rb") as f:
+                single_output = f.read()
+            with open(os.path.join(tmpdir, "bulk.yml"), "rb") as f:
+                self.assertEqual(single_output, f.read())
+
+        self.assertIn("/api/card", bulk.reads)
+        self.assertFalse([path for path in bulk.reads if path.startswith("/api/card/")])
+
+    def test_dashboard_embedded_cards(self):
+        self.client.tables = self.client.api("get", "/api/table")
+        self.client.table_map = {
+            table["id"]: table["name"] for table in self.client.tables
+        }
+        self.client.reads.clear()
+        dashboard, models_exposed, _, _ = self.client._resolve_exposure("dashboard", 1)
+        self.assertTrue(models_exposed)
+        self.assertFalse(
+            [path for path in self.client.reads if path.startswith("/api/card/")]
+        )
+
+        # Incomplete embedded questions are fetched
+        del dashboard["ordered_cards"][1]["card"]["dataset_query"]
+        self.assertEqual(
+            list(self.client._dashboard_cards(dashboard))[0:2],
+            [(3, None), (4, dashboard["ordered_cards"][2]["card"])],
+        )
+
+    def test_exposure_creators(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.extract_exposures(MODELS, tmpdir)
+        users = [path for path in self.client.reads if path.startswith("/api/user")]
+        self.assertEqual(users, ["/api/user"])
+
+        # Users are fetched one by one, once each, when they cannot be listed
+        forbidden = MockMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+        )
+        api = forbidden.api
+        forbidden.api = lambda method, path, **kwargs: (
+            {} if path == "/api/user" else api(method, path, **kwargs)
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            forbidden.extract_exposures(MODELS, tmpdir)
+        users = [path for path in forbidden.reads if path.startswith("/api/user")]
+        self.assertEqual(users, ["/api/user/1"])
+
+    def test_iter_exposures(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            extracted = self.client.extract_exposures(MODELS, tmpdir)
+        self.assertEqual(
+            list(self.client.iter_exposures(MODELS)), extracted["exposures"]
+        )
+
+        names = _ExposureNames()
+        self.assertEqual(
+            [names.unique(name) for name in ("a b", "a b", "a_b", "a_b_1", "c")],
+            ["a_b", "a_b_1", "a_b_2", "a_b_1_1", "c"],
+        )
+
+    def test_extract_exposures_failed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.extract_exposures(MODELS, tmpdir)
+            path = os.path.join(tmpdir, "metabase_exposures.yml")
+            with open(path, encoding="utf-8") as f:
+                written = f.read()
+
+            with mock.patch.object(
+                self.client, "_build_exposure", side_effect=RuntimeError
+            ), self.assertRaises(RuntimeError):
+                self.client.extract_exposures(MODELS, tmpdir)
+
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(f.read(), written)
+            self.assertEqual(os.listdir(tmpdir), ["metabase_exposures.yml"])
+
+    def test_exposure_state(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = os.path.join(tmpdir, "state.json")
+            first = self.client.extract_exposures(
+                MODELS, tmpdir, state=ExposureState(state_path, "localhost:3000")
+            )
+
+            # Nothing edited, nothing fetched
+            unchanged = MockMetabaseClient(
+                host="localhost:3000",
+                user="dummy",
+                password="dummy",
+                use_http=True,
+            )
+            self.assertEqual(
+                unchanged.extract_exposures(
+                    MODELS, tmpdir, state=ExposureState(state_path, "localhost:3000")
+                ),
+                first,
+            )
+            fetched = [
+                path
+                for path in unchanged.reads
+                if path.startswith(("/api/card/", "/api/dashboard/"))
+            ]
+            self.assertEqual(fetched, [])
+
+            # Edited question and dashboards based on it are fetched again
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            state["exposures"]["card/3"]["edited_at"] = "2000-01-01T00:00:00Z"
+            state["exposures"]["dashboard/1"]["dependencies"]["card/3"] = None
+            del state["exposures"]["card/4"]
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+
+            edited = MockMetabaseClient(
+                host="localhost:3000",
+                user="dummy",
+                password="dummy",
+                use_http=True,
+            )
+            self.assertEqual(
+                edited.extract_exposures(
+                    MODELS, tmpdir, state=ExposureState(state_path, "localhost:3000")
+                ),
+                first,
+            )
+            fetched = [
+                path
+                for path in edited.reads
+                if path.startswith(("/api/card/", "/api/dashboard/"))
+            ]
+            self.assertEqual(
+                sorted(fetched), ["/api/card/3", "/api/card/4", "/api/dashboard/1"]
+            )
+
+            # Only questions reading from a renamed table are fetched again,
+            # tables added elsewhere do not matter
+            synced = MockMetabaseClient(
+                host="localhost:3000",
+                user="dummy",
+                password="dummy",
+                use_http=True,
+            )
+            api = synced.api
+
+            def synced_api(method: str, path: str, **kwargs):
+                response = api(method, path, **kwargs)
+                if path == "/api/table":
+                    response = [
+                        dict(table, name="orders_v2") if table["id"] == 6 else table
+                        for table in response
+                    ] + [{"id": 1000, "name": "new_table"}]
+                return response
+
+            synced.api = synced_api
+            synced.extract_exposures(
+                MODELS, tmpdir, state=ExposureState(state_path, "localhost:3000")
+            )
+            fetched = [
+                path
+                for path in synced.reads
+                if path.startswith(("/api/card/", "/api/dashboard/"))
+            ]
+            self.assertEqual(fetched, ["/api/card/2"])
+
+    def test_session_lifecycle(self):
+        with MockMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+            http_pool_size=4,
+        ) as mbc:
+            adapter = mbc.session.get_adapter("http://localhost:3000")
+            self.assertEqual(adapter._pool_maxsize, 4)
+            self.assertIs(adapter, mbc.session.get_adapter("https://localhost:3000"))
+        self.assertFalse(adapter.poolmanager.pools)
+
+    def test_export_models_concurrent(self):
+        # CUSTOMERS.TOTAL_ORDER_AMOUNT is missing in the fixture metadata
+        serial = self.client
+        self.assertFalse(serial.export_models("unit_testing", MODELS, aliases={}))
+
+        concurrent = MockMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+            concurrency=4,
+        )
+        self.assertFalse(concurrent.export_models("unit_testing", MODELS, aliases={}))
+
+        self.assertTrue(serial.writes)
+        written_paths = [path for _, path, _ in serial.writes]
+        self.assertEqual(len(written_paths), len(set(written_paths)))
+        self.assertFalse([path for path in serial.reads if "/api/field/" in path])
+        self.assertEqual(
+            sorted(serial.writes, key=str), sorted(concurrent.writes, key=str)
+        )
+
+        found = [model for model in MODELS if model.name != "CUSTOMERS"]
+        self.assertTrue(serial.export_models("unit_testing", found, aliases={}))
+        self.assertTrue(concurrent.export_models("unit_testing", found, aliases={}))
+
+    def test_fk_targets(self):
+        mbc = self.client
+        customer_id = "/api/field/38"
+
+        # Target without a semantic type in dbt is kept as PK by its own diff
+        mbc.export_models("unit_testing", fk_models(), aliases={})
+        updates = [update for _, path, update in mbc.writes if path == customer_id]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0]["semantic_type"], "type/PK")
+
+        # Target already PK is not promoted again
+        table_lookup, field_lookup = mbc.build_metadata_lookups(2)
+        field_lookup["PUBLIC.CUSTOMERS"]["CUSTOMER_ID"]["semantic_type"] = "type/PK"
+        mbc.writes.clear()
+        with mock.patch.object(
+            mbc, "build_metadata_lookups", return_value=(table_lookup, field_lookup)
+        ):
+            mbc.export_models("unit_testing", fk_models()[1:], aliases={})
+            self.assertTrue(mbc.writes)
+            self.assertNotIn(customer_id, [path for _, path, _ in mbc.writes])
+
+            # Target exported without the unchanged models pointing at it stays PK
+            mbc.writes.clear()
+            mbc.export_models(
+                "unit_testing", fk_models()[:1], aliases={}, all_models=fk_models()
+            )
+        self.assertNotIn(customer_id, [path for _, path, _ in mbc.writes])
+
+    def test_async_client(self):
+        async def run(mbc: AsyncMetabaseClient):
+            async with mbc:
+                exported = await mbc.export_models("unit_testing", MODELS, aliases={})
+                exposures = await mbc.extract_exposures(
+                    MODELS,
+                    output_name="unittest_exposures",
+                    output_path="tests/fixtures/exposure/",
+                )
+            return exported, exposures
+
+        mbc = MockAsyncMetabaseClient(
+            host="localhost:3000",
+            user="dummy",
+            password="dummy",
+            use_http=True,
+        )
+        exported, exposures = asyncio.run(run(mbc))
+        self.assertFalse(exported)
+
+        self.client.export_models("unit_testing", MODELS, aliases={})
+        self.assertEqual(
+            sorted(self.client.writes, key=str), sorted(mbc.writes, key=str)
+        )
+        self.assertEqual(
+            self.client.extract_exposures(
+                MODELS,
+                output_name="unittest_exposures",
+                output_path="tests/fixtures/exposure/",
+            ),
+            exposures,
+        )
+
+    def test_api_retries(self):
+        def response(status: int, body: str = "{}", **headers) -> requests.Response:
+            resp = requests.Response()
+            resp.status_code = status
+            resp._content = body.encode()
+            resp.headers.update(headers)
+            return resp
+
+        with mock.patch.object(MetabaseClient, "get_session_id", return_value="x"):
+            mbc = MetabaseClient(host="localhost:3000", user="u", password="p")
+
+        with mock.patch.object(
+            mbc.session,
+            "request",
+            side_effect=[
+                response(429, **{"Retry-After": "0"}),
+                requests.exceptions.ConnectionError(),
+                response(200, '{"id": 1}'),
+            ],
+        ) as request, mock.patch("time.sleep") as sleep:
+            self.assertEqual(mbc.api("get", "/api/field/1"), {"id": 1})
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(sleep.call_args_list[0], mock.call(0.0))
+        self.assertEqual(mbc.retries, {429: 1, "connection": 1})
+        self.assertEqual(request.call_args.kwargs["timeout"], (10, 120))
+
+        with mock.patch.object(
+            mbc.session, "request", return_value=response(503)
+        ) as request, mock.patch("time.sleep"):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                mbc.api("post", "/api/database/2/sync_schema")
+        self.assertEqual(request.call_count, 1)
+
+    def test_plan_apply(self):
+        self.client.export_models("unit_testing", MODELS, aliases={})
+
+        planner = MockMetabaseClient(
+            host="localhost:3000", user="dummy", password="dummy", use_http=True
+        )
+        applier = MockMetabaseClient(
+            host="localhost:3000", user="dummy", password="dummy", use_http=True
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plan_path = os.path.join(tmpdir, "plan.json")
+            self.assertFalse(
+                planner.export_models(
+                    "unit_testing", MODELS, aliases={}, plan_path=plan_path
+                )
+            )
+            self.assertFalse(planner.writes)
+            self.assertTrue(applier.apply_plan(plan_path))
+
+        self.assertEqual(self.client.writes, applier.writes)
+
+    def test_apply_cli(self):
+        args = [
+            "models",
+            "--metabase_host=localhost:3000",
+            "--metabase_user=dummy",
+            "--metabase_password=dummy",
+            "--metabase_database=unit_testing",
+        ]
+        with mock.patch("dbtmetabase.models") as models:
+            dbtmetabase.main(args + ["--apply=plan.json"])
+            self.assertEqual(models.call_args.kwargs["apply_path"], "plan.json")
+            # dbt arguments are still required to export models from dbt
+            with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+                dbtmetabase.main(args)
+
+    def test_resume(self):
+        self.client.export_models("unit_testing", MODELS, aliases={})
+
+        interrupted = MockMetabaseClient(
+            host="localhost:3000", user="dummy", password="dummy", use_http=True
+        )
+        resumed = MockMetabaseClient(
+            host="localhost:3000", user="dummy", password="dummy", use_http=True
+        )
+
+        def api(method: str, path: str, **kwargs):
+            if method == "put" and len(interrupted.writes) == 2:
+                raise requests.exceptions.ConnectionError()
+            return MockMetabaseClient.api(interrupted, method, path, **kwargs)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal_path = os.path.join(tmpdir, "journal")
+
+            journal = ExportJournal(journal_path)
+            exported: List[MetabaseModel] = []
+            with mock.patch.object(interrupted, "api", side_effect=api):
+                self.assertFalse(
+                    interrupted.export_models(
+                        "unit_testing",
+                        MODELS,
+                        aliases={},
+                        journal=journal,
+                        exported=exported,
+                    )
+                )
+            self.assertFalse(exported)
+            journal.close(False)
+
+            journal = ExportJournal(journal_path, resume=True)
+            self.assertFalse(
+                resumed.export_models(
+                    "unit_testing", MODELS, aliases={}, journal=journal
+                )
+            )
+            journal.close(True)
+            self.assertFalse(os.path.exists(journal_path))
+
+        self.assertEqual(self.client.writes, interrupted.writes + resumed.writes)
+
+    def test_sync_and_wait(self):
+        # Customers has a column missing from Metabase
+        synced = [model for model in MODELS if model.name != "CUSTOMERS"]
+        self.assertTrue(self.client.sync_and_wait("unit_testing", synced, 30))
+
+        clock = [0.0]
+        sleeps = []
+
+        def sleep(secs):
+            sleeps.append(secs)
+            clock[0] += secs
+
+        mbc = MockMetabaseClient(
+            host="localhost:3000", user="dummy", password="dummy", use_http=True
+        )
+        with mock.patch("dbtmetabase.metabase.time") as mock_time:
+            mock_time.monotonic.side_effect = lambda: clock[0]
+            mock_time.sleep.side_effect = sleep
+            self.assertFalse(mbc.sync_and_wait("unit_testing", MODELS, 30))
+
+        self.assertEqual([1, 2, 4, 8, 15], sleeps)
+        self.assertEqual(1, mbc.reads.count("/api/database/2/metadata"))
+        self.assertEqual(
+            len(sleeps),
+            len([path for path in mbc.reads if path.endswith("/query_metadata")]),
+        )
+
+    def test_sync_tables_only(self):
+        synced = [model for model in MODELS if model.name != "CUSTOMERS"]
+        mbc = self.client
+
+        def api(method: str, path: str, **kwargs):
+            result = MockMetabaseClient.api(mbc, method, path, **kwargs)
+            return {"status": "ok"} if method == "post" else result
+
+        with mock.patch.object(mbc, "api", side_effect=api):
+            self.assertTrue(
+                mbc.sync_and_wait("unit_testing", synced, 30, tables_only=True)
+            )
+        self.assertEqual(
+            [
+                "/api/table/6/sync_schema",
+                "/api/table/5/sync_schema",
+                "/api/table/10/sync_schema",
+                "/api/table/8/sync_schema",
+            ],
+            [path for _, path, _ in mbc.writes],
+        )
+
+        # Older Metabase versions only synchronize whole databases
+        mbc.writes.clear()
+        self.assertTrue(mbc.sync_and_wait("unit_testing", synced, 30, tables_only=True))
+        self.assertEqual("/api/database/2/sync_schema", mbc.writes[-1][1])
+
+    def test_find_database_id(self):
+        self.assertEqual(2, self.client.find_database_id("unit_testing"))
+        self.assertEqual(2, self.client.find_database_id("UNIT_TESTING"))
+        self.assertEqual(1, self.client.reads.count("/api/database"))
+
+        self.client.database_ids["OTHER"] = 5
+        self.assertEqual(5, self.client.find_database_id("other"))
+        self.assertEqual(1, self.client.reads.count("/api/database"))
+
+    def test_metadata_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mbc = MockMetabaseClient(
+                host="localhost:3000",
+                user="dummy",
+                password="dummy",
+                use_http=True,
+                metadata_cache=MetadataCache(os.path.join(tmpdir, "cache.db")),
+            )
+            metadata_path = "/api/database/2/metadata"
+
+            lookups = mbc.build_metadata_lookups(2)
+            self.assertEqual(lookups, mbc.build_metadata_lookups(2))
+            self.assertEqual(1, mbc.reads.count(metadata_path))
+
+            # Writes make the cached metadata stale
+            mbc.export_models("unit_testing", MODELS, aliases={})
+            self.assertTrue(mbc.writes)
+            mbc.build_metadata_lookups(2)
+            self.assertEqual(2, mbc.reads.count(metadata_path))
+
+    def test_export_state(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = os.path.join(tmpdir, "state.json")
+
+            state = ExportState(state_path, "localhost:3000", "unit_testing")
+            self.assertEqual(MODELS, state.changed(MODELS))
+            state.save(MODELS)
+
+            changed = MetabaseModel(
+                name=MODELS[0].name,
+                schema=MODELS[0].schema,
+                description="Changed description",
+                columns=MODELS[0].columns,
+            )
+            state = ExportState(state_path, "localhost:3000", "unit_testing")
+            self.assertEqual([changed], state.changed([changed] + MODELS[1:]))
+
+            # Models missing in Metabase are not recorded as exported, e.g. a new
+            # table or CUSTOMERS.TOTAL_ORDER_AMOUNT missing in the fixture metadata,
+            # and exported models hash the same as before the export
+            exported: List[MetabaseModel] = []
+            missing = MetabaseModel(name="MISSING", schema="PUBLIC")
+            self.assertFalse(
+                self.client.export_models(
+                    "unit_testing",
+                    copy.deepcopy(MODELS) + [missing],
+                    aliases={},
+                    exported=exported,
+                )
+            )
+            self.assertEqual(exported, [MODELS[0]] + MODELS[2:])
+            exported_path = os.path.join(tmpdir, "exported.json")
+            ExportState(exported_path, "localhost:3000", "unit_testing").save(exported)
+            state = ExportState(exported_path, "localhost:3000", "unit_testing")
+            self.assertEqual([MODELS[1], missing], state.changed(MODELS + [missing]))
+
+            state = ExportState(
+                state_path, "localhost:3000", "unit_testing", reconcile_days=0
+            )
+            self.assertEqual(MODELS, state.changed(MODELS))
+
+            state = ExportState(state_path, "localhost:3000", "other_database")
+            self.assertEqual(MODELS, state.changed(MODELS))
+
     def test_build_lookups(self):
         mbc = self.client
         baseline_tables = [
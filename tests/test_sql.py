@@ -0,0 +1,79 @@
+import re
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+from dbtmetabase.parsers import sql
+from dbtmetabase.models.metabase import MetabaseModel
+from dbtmetabase.parsers.sql import ModelMatcher, extract_tables
+
+
+class TestExtractTables(unittest.TestCase):
+    def test_native_queries(self):
+        with open("tests/fixtures/sql/native_queries.sql", "r", encoding="utf-8") as f:
+            corpus = f.read()
+
+        cases = re.findall(r"-- tables: ([^\n]*)\n(.*?);", corpus, re.DOTALL)
+        self.assertTrue(cases)
+        for tables, sql in cases:
+            self.assertEqual(
+                list(dict.fromkeys(extract_tables(sql))),
+                tables.split(", "),
+                sql,
+            )
+
+    def test_cached(self):
+        sql = "select * from customers join orders using (customer_id)"
+        tables = extract_tables(sql)
+        tables.append("mutated")
+        self.assertEqual(extract_tables(sql), ["customers", "orders"])
+
+    def test_parse_in_pool(self):
+        queries = [
+            f"select * from orders_{i} join customers using (customer_id)"
+            for i in range(10)
+        ]
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            sql.parse_in_pool(queries + queries[:3], pool, 2)
+        for i, query in enumerate(queries):
+            self.assertEqual(sql._cached(query)[1], (f"orders_{i}", "customers"))
+
+    def test_parse_in_pool_evicted(self):
+        queries = [f"select * from orders_{i}" for i in range(sql._CACHE_SIZE + 10)]
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            parsed = sql.parse_in_pool(queries, pool, 2)
+        with mock.patch.object(sql, "_parse", side_effect=AssertionError):
+            for i, query in enumerate(queries):
+                self.assertEqual(extract_tables(query, parsed), [f"orders_{i}"])
+
+
+class TestModelMatcher(unittest.TestCase):
+    def test_match(self):
+        matcher = ModelMatcher(
+            [
+                MetabaseModel(name="ORDERS", schema="PUBLIC", ref="ref('orders')"),
+                MetabaseModel(
+                    name="CUSTOMERS", schema="PUBLIC", ref="ref('customers')"
+                ),
+                MetabaseModel(
+                    name="PAYMENTS",
+                    schema="RAW",
+                    ref="source('stripe', 'stripe_payments')",
+                ),
+            ]
+        )
+        sql = """
+            -- customers from a comment
+            select o.customers, count(*)
+            from public.orders o
+            cross join table(flatten(input => 'customers'))
+            where exists (select 1 from "RAW"."stripe_payments" p)
+              and o.id in (select id from other.customers)
+              and customers(o.id)
+            group by 1
+        """
+        self.assertEqual(matcher.match(sql), ["ORDERS", "PAYMENTS"])
+        self.assertEqual(
+            matcher.match("select * from unnest(get_rows('x', Customers))"),
+            ["CUSTOMERS"],
+        )